@@ -0,0 +1,234 @@
+import os
+from typing import Dict, List, Optional
+import argparse
+import contextlib
+import json
+import math
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from poe2filter import (
+    BASE_DIR, FILTER_SETTINGS, SCRIPT_DIR, SECTION_ENDGAME_T1, SECTION_ENDGAME_T2, SECTION_HIDE,
+    SECTION_LEVELING, SECTION_QUIVER, SECTION_SKILL, BaseCatalog, DefenseTierIndex, FilterBuild,
+    FilterSettings, build_filter_units, consolidate_hide_blocks, parse_defense_file, parse_item_file,
+    parse_quiver_file, parse_skill_weapon_file, settings_defense_type, write_filter
+)
+
+BENCHMARK_OUTPUT = "benchmark.json"
+PHASES = ("parse", "tiering", "units", "render", "assembly", "write")
+# Defense stats that get jittered in the synthetic copies so tiers differ
+DEFENSE_STAT_PATTERN = re.compile(r'^(Armour|Evasion Rating|Energy Shield): (\d+)$')
+# Only the SHOW keys are randomised, HIDE_UNSHOWN_ITEMS keeps its default
+SETTING_PATTERN = re.compile(r'^(SHOW_[A-Z0-9_]+\s*=\s*)(True|False)(.*)$')
+# Phases must take this long at the smaller scale before their scaling is checked
+MIN_SCALING_SECONDS = 0.01
+
+def base_file_parser(relpath: str):
+    """Get the parser build_filter_units uses for a base file."""
+    return {
+        "martial weapons": parse_item_file,
+        "skill-based weapons": parse_skill_weapon_file,
+        "quivers": parse_quiver_file,
+    }.get(relpath.replace('\\', '/').split('/')[0], parse_defense_file)
+
+def synthetic_entry(entry: List[str], copy: int, rng: random.Random) -> List[str]:
+    """Rename a base entry for a synthetic copy and jitter its defense stats."""
+    lines = []
+    for index, line in enumerate(entry):
+        if index == 0 or '(Area Level' in line:
+            # Prefix the name, quiver names have to keep ending in "Quiver"
+            line = f"Mk{copy} {line}"
+        else:
+            match = DEFENSE_STAT_PATTERN.match(line)
+            if match:
+                line = f"{match.group(1)}: {max(1, round(int(match.group(2)) * rng.uniform(0.9, 1.1)))}"
+        lines.append(line)
+    return lines
+
+def generate_bases(target_dir: str, scale: int, seed: int = 0) -> int:
+    """Write a copy of bases/ with every entry repeated scale times, return the line count."""
+    rng = random.Random(seed)
+    total_lines = 0
+    for root, _, files in os.walk(BASE_DIR):
+        for file in files:
+            if not file.endswith('.txt'):
+                continue
+            source = os.path.join(root, file)
+            target = os.path.join(target_dir, os.path.relpath(source, BASE_DIR))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(source, 'r') as f:
+                text = f.read()
+            entries = [entry.splitlines() for entry in re.split(r'\n\s*\n', text) if entry.strip()]
+            with open(target, 'w') as f:
+                for copy in range(scale):
+                    for entry in entries:
+                        lines = entry if copy == 0 else synthetic_entry(entry, copy, rng)
+                        f.write("\n".join(lines) + "\n\n")
+                        total_lines += len(lines) + 1
+    return total_lines
+
+def generate_settings(target_dir: str, count: int, seed: int = 0) -> List[str]:
+    """Write settings files with every SHOW key set at random."""
+    with open(os.path.join(SCRIPT_DIR, FILTER_SETTINGS), 'r') as f:
+        lines = f.read().splitlines()
+    paths = []
+    for index in range(count):
+        rng = random.Random(seed * 1000 + index)
+        variant = []
+        for line in lines:
+            match = SETTING_PATTERN.match(line)
+            if match:
+                line = f"{match.group(1)}{rng.choice(['True', 'False'])}{match.group(3)}"
+            variant.append(line)
+        path = os.path.join(target_dir, f"settings_{index}.txt")
+        with open(path, 'w') as f:
+            f.write("\n".join(variant) + "\n")
+        paths.append(path)
+    return paths
+
+def run_scale(work_dir: str, scale: int, settings_paths: List[str], seed: int = 0) -> Dict:
+    """Generate the bases for one scale and time every phase of a build."""
+    base_dir = os.path.join(work_dir, f"bases_{scale}x")
+    lines = generate_bases(base_dir, scale, seed)
+    timings = {phase: 0.0 for phase in PHASES}
+
+    # Parse every base file into a cold catalog
+    start = time.perf_counter()
+    catalog = BaseCatalog(base_dir, os.path.join(work_dir, f"bases_{scale}x.cache.json"))
+    items = {}
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if file.endswith('.txt'):
+                path = os.path.join(root, file)
+                items[path] = catalog.items_for(path, base_file_parser(os.path.relpath(path, base_dir)))
+    timings["parse"] = time.perf_counter() - start
+
+    # Index the defense tiers and look up every endgame item
+    start = time.perf_counter()
+    tier_index = DefenseTierIndex()
+    for path, file_items in items.items():
+        if base_file_parser(os.path.relpath(path, base_dir)) is not parse_defense_file:
+            continue
+        slot = os.path.basename(os.path.dirname(path))
+        defense_type = settings_defense_type(os.path.splitext(os.path.basename(path))[0])
+        tier_index.add_file(slot, defense_type, path, file_items)
+        for item in file_items:
+            if item.is_endgame:
+                tier_index.lookup(slot, defense_type, item)
+    timings["tiering"] = time.perf_counter() - start
+
+    # Register the block units from the warm catalog
+    start = time.perf_counter()
+    units = build_filter_units(catalog)
+    timings["units"] = time.perf_counter() - start
+
+    # The output and its index are written to the work directory, not next to the real filter
+    output_path = os.path.join(work_dir, f"filter_{scale}x.filter")
+    for settings_path in settings_paths:
+        settings = FilterSettings(settings_path)
+        build = FilterBuild(units)
+        start = time.perf_counter()
+        build.render(settings)
+        timings["render"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for section in (SECTION_ENDGAME_T1, SECTION_ENDGAME_T2, SECTION_SKILL, SECTION_QUIVER, SECTION_LEVELING):
+            build.blocks(section)
+        consolidate_hide_blocks([(order[0], block) for order, block in build.ordered_blocks(SECTION_HIDE)])
+        timings["assembly"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        write_filter(build, output_path=output_path)
+        timings["write"] += time.perf_counter() - start
+
+    # Settings dependent phases are averaged over the variants
+    for phase in ("render", "assembly", "write"):
+        timings[phase] /= len(settings_paths)
+    return {
+        "scale": scale,
+        "files": len(items),
+        "lines": lines,
+        "items": sum(len(file_items) for file_items in items.values()),
+        "units": len(units),
+        "output_bytes": os.path.getsize(output_path),
+        "seconds": timings,
+    }
+
+def scaling_exponents(results: List[Dict]) -> Dict[str, Optional[float]]:
+    """Fit time ~ scale**k per phase between the two largest scales that are slow enough to measure."""
+    exponents = {}
+    for phase in PHASES:
+        measured = [result for result in results if result["seconds"][phase] >= MIN_SCALING_SECONDS]
+        if len(measured) < 2:
+            exponents[phase] = None
+            continue
+        small, large = measured[-2], measured[-1]
+        exponents[phase] = (math.log(large["seconds"][phase] / small["seconds"][phase]) /
+                            math.log(large["scale"] / small["scale"]))
+    return exponents
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time filter generation on synthetic base catalogs")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100, 1000],
+                        help="multiples of the real bases to generate")
+    parser.add_argument("--variants", type=int, default=3, help="random settings files per scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-exponent", type=float, default=1.2,
+                        help="fail if a phase grows faster than scale**max_exponent")
+    parser.add_argument("--output", default=os.path.join(SCRIPT_DIR, BENCHMARK_OUTPUT),
+                        help=f"where to write the results (default: {BENCHMARK_OUTPUT})")
+    parser.add_argument("--keep", action="store_true", help="keep the generated bases and filters")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="poe2filter-bench-")
+    try:
+        settings_paths = generate_settings(work_dir, args.variants, args.seed)
+        results = []
+        for scale in sorted(args.scales):
+            # The generator reports its progress, keep it out of the benchmark output
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = run_scale(work_dir, scale, settings_paths, args.seed)
+            results.append(result)
+            seconds = "  ".join(f"{phase} {result['seconds'][phase] * 1000:9.1f}ms" for phase in PHASES)
+            print(f"{scale:5}x  {result['lines']:8} lines  {result['items']:7} items  {seconds}")
+    finally:
+        if args.keep:
+            print(f"Kept generated files in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    exponents = scaling_exponents(results)
+    failed = [phase for phase, exponent in exponents.items()
+              if exponent is not None and exponent > args.max_exponent]
+    print("Scaling exponents: " + ", ".join(
+        f"{phase} {exponent:.2f}" if exponent is not None else f"{phase} n/a"
+        for phase, exponent in exponents.items()))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "variants": args.variants,
+            "seed": args.seed,
+            "max_exponent": args.max_exponent,
+            "results": results,
+            "exponents": exponents,
+            "failed": failed,
+        }, f, indent=2)
+    print(f"Wrote results to {args.output}")
+
+    if failed:
+        print(f"Phases scaling worse than scale**{args.max_exponent}: {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
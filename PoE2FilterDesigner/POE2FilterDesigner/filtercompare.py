@@ -0,0 +1,47 @@
+import os
+from typing import List, Optional
+import argparse
+import sys
+import time
+
+from filterrules import MAX_AREA_LEVEL, RARITIES, compare_filters, describe_difference, parse_filter_file
+from poe2filter import BASE_DIR, BaseCatalog, catalog_drop_space
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Report every drop two filters decide differently")
+    parser.add_argument("before", help="reference filter, e.g. one generated without --minify")
+    parser.add_argument("after", help="filter to check against it")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes for large base catalogs (default: one per core)")
+    parser.add_argument("--visibility-only", action="store_true",
+                        help="only report drops that are shown by one filter and hidden by the other")
+    parser.add_argument("--limit", type=int, default=50,
+                        help="differences to print, 0 for all (default: 50)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Compare two filters over every base in bases/ at every rarity and area level.
+
+    Exits with status 1 when a drop is decided differently.
+    """
+    args = parse_args(argv)
+    start = time.perf_counter()
+    before = parse_filter_file(args.before)
+    after = parse_filter_file(args.after)
+    space = catalog_drop_space(BaseCatalog(BASE_DIR))
+    differences = compare_filters(before, after, space.bases, space.drop_levels, args.workers,
+                                  styles=not args.visibility_only)
+    elapsed = time.perf_counter() - start
+
+    shown = differences[:args.limit] if args.limit else differences
+    for difference in shown:
+        print(describe_difference(difference, before, after))
+    if len(shown) < len(differences):
+        print(f"... and {len(differences) - len(shown)} more")
+    drops = len(space.bases) * len(RARITIES) * MAX_AREA_LEVEL
+    print(f"{len(differences)} drop ranges of {os.path.basename(args.after)} differ from "
+          f"{os.path.basename(args.before)} ({drops:,} drops of {len(space.bases)} bases checked in {elapsed:.2f}s)")
+    return 1 if differences else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,963 @@
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Rarities in filter order, "Rarity <= Magic" matches Normal and Magic
+RARITIES = ("Normal", "Magic", "Rare", "Unique")
+RARITY_RANKS = {name: rank for rank, name in enumerate(RARITIES)}
+MAX_AREA_LEVEL = 100
+
+BLOCK_KEYWORDS = ("Show", "Hide", "Minimal")
+ACTION_PREFIXES = ("Set", "Play", "Minimap", "Custom", "Disable", "Enable")
+CONDITION_PATTERN = re.compile(r'^(\w+)\s*(==|!=|<=|>=|=|<|>|!)?\s*(.*)$')
+VALUE_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+TOKEN_PATTERN = re.compile(r'"[^"]*"|\S+')
+# Other rules a rule may be folded into before merge_rules gives up on it
+MAX_FOLD_ATTEMPTS = 4
+# Up to this many blocks between a rule and its fold target are checked one by one instead of through the index
+DIRECT_CHECK_BLOCKS = 32
+# compare_filters only starts worker processes for at least this many bases
+PARALLEL_COMPARE_BASES = 2000
+
+# Numeric conditions and the FilterItem field they are checked against
+NUMERIC_CONDITIONS = {
+    "AreaLevel": "area_level",
+    "ItemLevel": "item_level",
+    "DropLevel": "drop_level",
+    "Quality": "quality",
+    "Sockets": "sockets",
+    "StackSize": "stack_size",
+    "WaystoneTier": "waystone_tier",
+}
+TEXT_CONDITIONS = {
+    "BaseType": "base_type",
+    "Class": "item_class",
+}
+# Fields that follow the area level in FilterEvaluator.decision_table
+LEVEL_FIELDS = ("area_level", "item_level")
+# Values a field can take when a rule has no condition on it
+FIELD_DOMAINS = {
+    "rarity": ((0, len(RARITIES) - 1),),
+}
+
+class FilterItem(NamedTuple):
+    """An item drop as seen by the filter.
+
+    item_level defaults to the area level the item dropped in, drop_level to
+    the evaluator's drop level for the base. Conditions on unknown values
+    never match.
+    """
+    base_type: str
+    item_class: str
+    rarity: str = "Normal"
+    area_level: int = 1
+    item_level: Optional[int] = None
+    drop_level: Optional[int] = None
+    quality: int = 0
+    sockets: int = 0
+    stack_size: int = 1
+    waystone_tier: int = 0
+
+class FilterCondition:
+    __slots__ = ("key", "operator", "values", "line_number")
+
+    def __init__(self, key: str, operator: str, values: List[str], line_number: int):
+        self.key = key
+        self.operator = operator
+        self.values = values
+        self.line_number = line_number
+
+    @property
+    def is_exact(self) -> bool:
+        return self.operator == "=="
+
+    def __str__(self) -> str:
+        values = [f'"{value}"' if self.key in TEXT_CONDITIONS or not value or " " in value else value
+                  for value in self.values]
+        return " ".join(part for part in [self.key, self.operator] + values if part)
+
+    def __repr__(self) -> str:
+        return f"FilterCondition({self})"
+
+class FilterRule:
+    """A Show/Hide block of a filter."""
+    __slots__ = ("visibility", "line_number", "last_line", "comment", "comment_line", "conditions", "actions",
+                 "continues")
+
+    def __init__(self, visibility: str, line_number: int, comment: Optional[str] = None,
+                 comment_line: Optional[int] = None):
+        self.visibility = visibility
+        self.line_number = line_number
+        self.last_line = line_number
+        self.comment = comment
+        self.comment_line = comment_line
+        self.conditions: List[FilterCondition] = []
+        self.actions: List[str] = []
+        self.continues = False
+
+    @property
+    def is_shown(self) -> bool:
+        return self.visibility != "Hide"
+
+    def condition(self, key: str) -> Optional[FilterCondition]:
+        for condition in self.conditions:
+            if condition.key == key:
+                return condition
+        return None
+
+    def __repr__(self) -> str:
+        return f"FilterRule({self.visibility} at line {self.line_number})"
+
+def parse_values(text: str) -> List[str]:
+    return [bare or quoted for quoted, bare in VALUE_PATTERN.findall(text)]
+
+def parse_filter_rules(lines: Iterable[str]) -> List[FilterRule]:
+    """Parse filter text into its Show/Hide blocks in file order."""
+    rules = []
+    rule = None
+    comment = None
+    comment_line = None
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            comment = comment_line = None
+            continue
+        if line.startswith('#'):
+            # The comment right above a block names it in reports
+            comment = line.strip('#').strip() or comment
+            comment_line = line_number
+            continue
+        line = line.split('#', 1)[0].strip()
+
+        keyword = line.split(None, 1)[0]
+        if keyword in BLOCK_KEYWORDS:
+            rule = FilterRule(keyword, line_number, comment, comment_line)
+            rules.append(rule)
+            comment = comment_line = None
+            continue
+        if rule is None:
+            logger.warning("Ignoring line %d outside of a block: %s", line_number, line)
+            continue
+        rule.last_line = line_number
+        if keyword == "Continue":
+            rule.continues = True
+        elif keyword.startswith(ACTION_PREFIXES):
+            rule.actions.append(line)
+        else:
+            match = CONDITION_PATTERN.match(line)
+            key, operator, values = match.groups()
+            rule.conditions.append(FilterCondition(key, operator or "", parse_values(values), line_number))
+    return rules
+
+def parse_filter_file(filepath: str) -> List[FilterRule]:
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return parse_filter_rules(f)
+
+def compile_intervals(operator: str, values: List[int]) -> Tuple[Tuple[float, float], ...]:
+    """Turn a numeric condition into the closed intervals of values it accepts."""
+    inf = float('inf')
+    if operator in ("<", "<=", ">", ">="):
+        value = values[0]
+        return {
+            "<": ((-inf, value - 1),),
+            "<=": ((-inf, value),),
+            ">": ((value + 1, inf),),
+            ">=": ((value, inf),),
+        }[operator]
+    if operator in ("!=", "!"):
+        # Everything between the excluded values
+        intervals = []
+        low = -inf
+        for value in sorted(set(values)):
+            if low <= value - 1:
+                intervals.append((low, value - 1))
+            low = value + 1
+        intervals.append((low, inf))
+        return tuple(intervals)
+    return merge_intervals([(value, value) for value in values])
+
+def merge_intervals(intervals: List[Tuple[float, float]]) -> Tuple[Tuple[float, float], ...]:
+    """Sort intervals and join the ones that overlap or touch."""
+    merged = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return tuple(merged)
+
+def intervals_cover(outer: Tuple[Tuple[float, float], ...], inner: Tuple[Tuple[float, float], ...]) -> bool:
+    return all(any(low >= outer_low and high <= outer_high for outer_low, outer_high in outer)
+               for low, high in inner)
+
+def intervals_overlap(first: Tuple[Tuple[float, float], ...], second: Tuple[Tuple[float, float], ...]) -> bool:
+    return any(low <= other_high and other_low <= high for low, high in first for other_low, other_high in second)
+
+def text_covers(outer: Tuple[bool, Tuple[str, ...]], exact: bool, value: str) -> bool:
+    """Whether every text matched by a BaseType/Class value is matched by an outer condition."""
+    outer_exact, outer_values = outer
+    if outer_exact:
+        return exact and value in outer_values
+    return any(outer_value in value for outer_value in outer_values)
+
+class CompiledRule:
+    """A FilterRule reduced to text matchers and interval checks."""
+    def __init__(self, index: int, rule: FilterRule):
+        self.index = index
+        self.rule = rule
+        self.text_checks: List[Tuple[str, bool, Tuple[str, ...]]] = []
+        self.range_checks: List[Tuple[str, Tuple[Tuple[float, float], ...]]] = []
+        self.unsupported: List[str] = []
+        # Exact values as sets, so blocks listing many bases check them in constant time
+        self.exact_values: Dict[str, frozenset] = {}
+        for condition in rule.conditions:
+            if condition.key in TEXT_CONDITIONS:
+                self.text_checks.append((TEXT_CONDITIONS[condition.key], condition.is_exact,
+                                         tuple(condition.values)))
+                if condition.is_exact:
+                    self.exact_values[TEXT_CONDITIONS[condition.key]] = frozenset(condition.values)
+            elif condition.key == "Rarity":
+                ranks = [RARITY_RANKS[value] for value in condition.values if value in RARITY_RANKS]
+                self.range_checks.append(("rarity", compile_intervals(condition.operator, ranks)))
+            elif condition.key in NUMERIC_CONDITIONS:
+                try:
+                    values = [int(value) for value in condition.values]
+                except ValueError:
+                    self.unsupported.append(condition.key)
+                    continue
+                self.range_checks.append((NUMERIC_CONDITIONS[condition.key],
+                                          compile_intervals(condition.operator, values)))
+            else:
+                self.unsupported.append(condition.key)
+
+    def text_values(self, field: str) -> Optional[Tuple[bool, Tuple[str, ...]]]:
+        for check_field, exact, values in self.text_checks:
+            if check_field == field:
+                return exact, values
+        return None
+
+    def intervals(self, field: str) -> Tuple[Tuple[float, float], ...]:
+        """Get the values a field may take for the rule to match."""
+        domain = FIELD_DOMAINS.get(field, ((float('-inf'), float('inf')),))
+        for check_field, intervals in self.range_checks:
+            if check_field == field:
+                low, high = domain[0][0], domain[-1][1]
+                return tuple((max(a, low), min(b, high)) for a, b in intervals if a <= high and b >= low)
+        return domain
+
+    def covers(self, other: 'CompiledRule', base_type: Optional[Tuple[bool, str]] = None) -> bool:
+        """Whether every item matching other also matches this rule.
+
+        base_type restricts other to one of its BaseType values. Rules that
+        continue or use unsupported conditions never cover anything.
+        """
+        if self.unsupported or self.rule.continues:
+            return False
+        for field, exact, values in self.text_checks:
+            if field == "base_type" and base_type is not None:
+                other_values = [base_type]
+            else:
+                other_text = other.text_values(field)
+                if other_text is None:
+                    return False
+                other_values = [(other_text[0], value) for value in other_text[1]]
+            if not all(text_covers((exact, values), value_exact, value) for value_exact, value in other_values):
+                return False
+        return all(intervals_cover(intervals, other.intervals(field))
+                   for field, intervals in self.range_checks)
+
+    def overlaps(self, other: 'CompiledRule', base_type: Optional[str] = None) -> bool:
+        """Whether an item could match both rules.
+
+        base_type restricts other to the base of that name. Class and
+        unsupported conditions are assumed to overlap.
+        """
+        base_types = self.text_values("base_type")
+        if base_types is not None and base_type is not None:
+            exact, values = base_types
+            if not (base_type in self.exact_values["base_type"] if exact
+                    else any(value in base_type for value in values)):
+                return False
+        return all(intervals_overlap(intervals, other.intervals(field)) for field, intervals in self.range_checks)
+
+    def matches_text(self, base_type: str, item_class: str) -> bool:
+        for field, exact, values in self.text_checks:
+            text = base_type if field == "base_type" else item_class
+            if exact:
+                if text not in self.exact_values[field]:
+                    return False
+            elif not any(value in text for value in values):
+                return False
+        return True
+
+    def matches_ranges(self, values: Dict[str, Optional[int]], skip: Tuple[str, ...] = ()) -> bool:
+        for field, intervals in self.range_checks:
+            if field in skip:
+                continue
+            value = values[field]
+            if value is None:
+                return False
+            if not any(low <= value <= high for low, high in intervals):
+                return False
+        return True
+
+class FilterEvaluator:
+    """Evaluate items against a filter with first-match semantics.
+
+    Rules are indexed by their BaseType and Class values; the candidate rules
+    of every (base type, class) pair are resolved once and cached, so
+    evaluating an item only checks the rules that can match its base. Rules
+    using conditions the evaluator does not model never match.
+    """
+    def __init__(self, rules: List[FilterRule], drop_levels: Optional[Dict[str, int]] = None):
+        self.rules = rules
+        self.drop_levels = drop_levels or {}
+        self.compiled = [CompiledRule(index, rule) for index, rule in enumerate(rules)]
+        self.exact_base_types: Dict[str, List[int]] = {}
+        self.scanned_rules: List[int] = []
+        self.unsupported: Dict[int, List[str]] = {}
+        for compiled in self.compiled:
+            if compiled.unsupported:
+                self.unsupported[compiled.index] = compiled.unsupported
+                logger.debug("Rule at line %s uses unsupported conditions %s and never matches",
+                             compiled.rule.line_number, compiled.unsupported)
+                continue
+            base_types = compiled.text_values("base_type")
+            if base_types and base_types[0]:
+                for base_type in base_types[1]:
+                    self.exact_base_types.setdefault(base_type, []).append(compiled.index)
+            else:
+                self.scanned_rules.append(compiled.index)
+        self.index = FilterBlockIndex(rules, self.compiled)
+        self._candidates: Dict[Tuple[str, str], Tuple[CompiledRule, ...]] = {}
+        self._tables: Dict[Tuple[str, str], List[int]] = {}
+
+    def candidates(self, base_type: str, item_class: str) -> Tuple[CompiledRule, ...]:
+        """Get the rules whose BaseType and Class conditions match, in filter order."""
+        key = (base_type, item_class)
+        cached = self._candidates.get(key)
+        if cached is not None:
+            return cached
+        cached = tuple(self.compiled[index] for index in self.index.blocks_for(base_type, item_class)
+                       if index not in self.unsupported)
+        self._candidates[key] = cached
+        return cached
+
+    def item_values(self, item: FilterItem) -> Dict[str, Optional[int]]:
+        values = item._asdict()
+        values["rarity"] = RARITY_RANKS.get(item.rarity)
+        if item.item_level is None:
+            values["item_level"] = item.area_level
+        if item.drop_level is None:
+            values["drop_level"] = self.drop_levels.get(item.base_type)
+        return values
+
+    @staticmethod
+    def first_match(candidates: Tuple[CompiledRule, ...], values: Dict[str, Optional[int]]) -> int:
+        matched = -1
+        for compiled in candidates:
+            if compiled.matches_ranges(values):
+                if not compiled.rule.continues:
+                    return compiled.index
+                matched = compiled.index
+        return matched
+
+    def match_index(self, item: FilterItem) -> int:
+        """Get the index of the rule deciding an item, or -1 if none matches."""
+        return self.first_match(self.candidates(item.base_type, item.item_class), self.item_values(item))
+
+    def evaluate(self, item: FilterItem) -> Optional[FilterRule]:
+        """Get the rule deciding an item, or None if it is shown unstyled."""
+        index = self.match_index(item)
+        return self.rules[index] if index >= 0 else None
+
+    def decision_table(self, base_type: str, item_class: str) -> List[int]:
+        """Get the matching rule index for every rarity and area level of a base.
+
+        The table is indexed by rarity rank * (MAX_AREA_LEVEL + 1) + area level,
+        other attributes use the FilterItem defaults.
+        """
+        key = (base_type, item_class)
+        table = self._tables.get(key)
+        if table is None:
+            candidates = self.candidates(base_type, item_class)
+            values = self.item_values(FilterItem(base_type, item_class))
+            # The decision only changes where an area level interval starts or ends
+            starts = {0}
+            for compiled in candidates:
+                for field, intervals in compiled.range_checks:
+                    if field in LEVEL_FIELDS:
+                        for low, high in intervals:
+                            starts.update(level for level in (low, high + 1) if 0 < level <= MAX_AREA_LEVEL)
+            starts = sorted(starts) + [MAX_AREA_LEVEL + 1]
+            table = []
+            for rank in range(len(RARITIES)):
+                values["rarity"] = rank
+                # Only the levels change within a rarity, rules failing any other condition are left out once
+                ranked = tuple(compiled for compiled in candidates if compiled.matches_ranges(values, LEVEL_FIELDS))
+                for start, end in zip(starts, starts[1:]):
+                    values["area_level"] = values["item_level"] = start
+                    table.extend([self.first_match(ranked, values)] * (end - start))
+            self._tables[key] = table
+        return table
+
+    def classify(self, drops: Iterable[Tuple[str, str, str, int]]) -> List[int]:
+        """Get the matching rule index of many (base type, class, rarity, area level) drops.
+
+        Every distinct base is resolved into a decision table once, after which
+        each drop is a dictionary lookup and a list index.
+        """
+        tables = self._tables
+        ranks = RARITY_RANKS
+        stride = MAX_AREA_LEVEL + 1
+        results = []
+        append = results.append
+        for base_type, item_class, rarity, area_level in drops:
+            table = tables.get((base_type, item_class))
+            if table is None:
+                table = self.decision_table(base_type, item_class)
+            append(table[ranks[rarity] * stride + area_level])
+        return results
+
+    def visibility(self, drops: Iterable[Tuple[str, str, str, int]]) -> List[bool]:
+        """Get whether each drop is shown; drops matching no rule are shown."""
+        shown = [compiled.rule.is_shown for compiled in self.compiled] + [True]
+        return [shown[index] for index in self.classify(drops)]
+
+class FilterBlockIndex:
+    """The blocks of a filter indexed by the BaseType and Class values they name.
+
+    Exact (==) values are indexed apart from substring values, so a lookup
+    only probes the substrings of a name for the blocks that match by
+    substring. The index and the compiled blocks are built on first use, so
+    blocks that are never looked up cost nothing; compiled blocks can also
+    be shared with a FilterEvaluator.
+    """
+    def __init__(self, rules: List[FilterRule], compiled: Optional[List[CompiledRule]] = None):
+        self.rules = rules
+        self._compiled: List[Optional[CompiledRule]] = list(compiled) if compiled else [None] * len(rules)
+        self.by_base_type: Dict[str, List[int]] = {}
+        self.by_class: Dict[str, List[int]] = {}
+        self.exact_base_types: Dict[str, List[int]] = {}
+        self.exact_classes: Dict[str, List[int]] = {}
+        self.unrestricted: List[int] = []
+        self.classless: List[int] = []
+        self.indexed = False
+
+    def compiled(self, index: int) -> CompiledRule:
+        compiled = self._compiled[index]
+        if compiled is None:
+            compiled = self._compiled[index] = CompiledRule(index, self.rules[index])
+        return compiled
+
+    def build(self):
+        for index, rule in enumerate(self.rules):
+            for indexes in self.value_lists(rule):
+                indexes.append(index)
+        self.indexed = True
+
+    def value_lists(self, rule: FilterRule) -> List[List[int]]:
+        """Get the index lists a block belongs in."""
+        lists = []
+        for key, unrestricted, exact_values, substring_values in (
+                ("BaseType", self.unrestricted, self.exact_base_types, self.by_base_type),
+                ("Class", self.classless, self.exact_classes, self.by_class)):
+            condition = rule.condition(key)
+            if condition is None:
+                lists.append(unrestricted)
+            else:
+                by_value = exact_values if condition.is_exact else substring_values
+                lists.extend(by_value.setdefault(value, []) for value in condition.values)
+        return lists
+
+    def recompile(self, index: int, added_base_types: Optional[List[str]] = None):
+        """Update a block after values were added to its conditions in place.
+
+        added_base_types limits the index update to the BaseType values that
+        were added, so growing a long list does not revisit all of it.
+        """
+        self._compiled[index] = None
+        if not self.indexed:
+            return
+        if added_base_types is None:
+            value_lists = self.value_lists(self.rules[index])
+        else:
+            exact = self.rules[index].condition("BaseType").is_exact
+            by_value = self.exact_base_types if exact else self.by_base_type
+            value_lists = [by_value.setdefault(value, []) for value in added_base_types]
+        for indexes in value_lists:
+            if not indexes or indexes[-1] != index and index not in indexes:
+                indexes.append(index)
+
+    def blocks_for(self, base_type: Optional[str] = None, item_class: Optional[str] = None) -> List[int]:
+        """Get the blocks whose BaseType and Class conditions can match an item, in filter order.
+
+        Conditions on a field that is not given are skipped.
+        """
+        if base_type is None and item_class is None:
+            return list(range(len(self.rules)))
+        if not self.indexed:
+            self.build()
+        if base_type is not None:
+            indexes = self.text_matches(self.unrestricted, self.exact_base_types, self.by_base_type, base_type)
+            if item_class is not None:
+                return [index for index in sorted(indexes) if self.matches_known_text(index, None, item_class)]
+        else:
+            indexes = self.text_matches(self.classless, self.exact_classes, self.by_class, item_class)
+        return sorted(indexes)
+
+    def text_matches(self, unrestricted: List[int], exact_values: Dict[str, List[int]],
+                     substring_values: Dict[str, List[int]], text: str) -> set:
+        """Get the blocks whose condition on one field matches text, or that have none."""
+        indexes = set(unrestricted)
+        indexes.update(exact_values.get(text, ()))
+        for value_indexes in self.values_in(substring_values, text):
+            indexes.update(value_indexes)
+        return indexes
+
+    @staticmethod
+    def values_in(by_value: Dict[str, List[int]], text: str) -> List[List[int]]:
+        """Get the index lists of the values that are substrings of text."""
+        substring_count = len(text) * (len(text) + 1) // 2
+        if len(by_value) <= substring_count:
+            return [indexes for value, indexes in by_value.items() if value in text]
+        # Large indexes are probed with every substring instead of being scanned
+        substrings = {text[start:end] for start in range(len(text) + 1) for end in range(start, len(text) + 1)}
+        return [by_value[value] for value in substrings if value in by_value]
+
+    def matches_known_text(self, index: int, base_type: Optional[str], item_class: Optional[str]) -> bool:
+        for field, exact, values in self.compiled(index).text_checks:
+            text = base_type if field == "base_type" else item_class
+            if text is None:
+                continue
+            if not (text in self.compiled(index).exact_values[field] if exact
+                    else any(value in text for value in values)):
+                return False
+        return True
+
+class FilterDocument:
+    """A filter file kept as its lines and its blocks, indexed by BaseType and Class.
+
+    Blocks keep their conditions, actions, Continue flag and source lines, so
+    a changed condition can be written back without touching the rest of the
+    file.
+    """
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+        self.rules = parse_filter_rules(lines)
+        self.index = FilterBlockIndex(self.rules)
+        self.modified = False
+
+    @classmethod
+    def load(cls, filepath: str) -> "FilterDocument":
+        with open(filepath, 'r') as f:
+            return cls(f.readlines())
+
+    def write_condition(self, rule_index: int, key: str):
+        """Rewrite the line of a block condition that was changed in place, keeping its trailing comment."""
+        condition = self.rules[rule_index].condition(key)
+        line = self.lines[condition.line_number - 1].rstrip('\n')
+        indent = line[:len(line) - len(line.lstrip())]
+        code, hash_sign, comment = line.partition('#')
+        gap = code[len(code.rstrip()):] or " "
+        suffix = f"{gap}#{comment}" if hash_sign else ""
+        self.lines[condition.line_number - 1] = f"{indent}{condition}{suffix}\n"
+        self.index.recompile(rule_index)
+        self.modified = True
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+def find_shadowed_rules(rules: List[FilterRule]) -> Dict[int, List[int]]:
+    """Find rules no item can reach under first-match semantics.
+
+    A rule is shadowed when each of its BaseType values is covered by an
+    earlier rule, so blocks listing bases that were all shown by earlier
+    blocks are found too. Returns the shadowing rule indexes of every
+    shadowed rule index.
+    """
+    evaluator = FilterEvaluator(rules)
+    base_type_rules: Dict[str, List[CompiledRule]] = {}
+    unrestricted = [compiled for compiled in evaluator.compiled if compiled.text_values("base_type") is None]
+    shadowed = {}
+    for compiled in evaluator.compiled:
+        base_types = compiled.text_values("base_type")
+        if base_types is None:
+            parts = [(None, unrestricted)]
+        else:
+            parts = []
+            for value in base_types[1]:
+                earlier = base_type_rules.get(value)
+                if earlier is None:
+                    # Every rule whose BaseType condition matches the value as a base name
+                    indexes = sorted(evaluator.exact_base_types.get(value, []) + evaluator.scanned_rules)
+                    earlier = [evaluator.compiled[index] for index in indexes
+                               if evaluator.compiled[index].matches_text(value, value)
+                               or evaluator.compiled[index].text_values("base_type") is None]
+                    base_type_rules[value] = earlier
+                parts.append(((base_types[0], value), earlier))
+
+        shadowing = []
+        for base_type, earlier in parts:
+            covering = next((rule for rule in earlier
+                             if rule.index < compiled.index and rule.covers(compiled, base_type)), None)
+            if covering is None:
+                break
+            shadowing.append(covering.index)
+        else:
+            shadowed[compiled.index] = sorted(set(shadowing))
+    return shadowed
+
+def drop_rules(lines: List[str], rules: List[FilterRule], indexes: Iterable[int]) -> List[str]:
+    """Remove rules, the comment line above them and one trailing blank line."""
+    dropped = set()
+    for index in indexes:
+        rule = rules[index]
+        first_line = rule.comment_line or rule.line_number
+        last_line = rule.last_line
+        if last_line < len(lines) and not lines[last_line].strip():
+            last_line += 1
+        dropped.update(range(first_line, last_line + 1))
+    return [line for line_number, line in enumerate(lines, 1) if line_number not in dropped]
+
+def rule_signature(rule: FilterRule) -> Tuple:
+    """Identify a rule by everything but its BaseType values."""
+    base_type = rule.condition("BaseType")
+    conditions = sorted((condition.key, condition.operator, tuple(condition.values))
+                        for condition in rule.conditions if condition.key != "BaseType")
+    return (rule.visibility, rule.continues, base_type.operator if base_type else None,
+            tuple(conditions), tuple(sorted(rule.actions)))
+
+def merge_rules(rules: List[FilterRule], mergeable: Iterable[int], targets: Iterable[int],
+                drop_decided: bool = True) -> Tuple[List[int], Dict[int, int]]:
+    """Merge rules into the decisions the rest of the filter already makes.
+
+    A mergeable rule that shows items without styling them is dropped when
+    every later rule that can match one of its items shows it unstyled too,
+    so no item changes its style. Other
+    mergeable rules are folded into a target rule with the same conditions
+    and actions apart from their BaseType values, when no rule between the
+    two can match their items; the nearest targets are tried first. Rules
+    are only folded forward into targets that are not mergeable themselves,
+    a mergeable target folds back into them instead, so a growing list is
+    not carried along the filter. BaseType values are taken as base names,
+    like in find_shadowed_rules.
+    The BaseType conditions of the targets are extended in place. Returns
+    the dropped rule indexes and, for every folded rule, the target it went
+    into.
+    """
+    index = FilterBlockIndex(rules)
+    compiled = index.compiled
+    mergeable = sorted(mergeable)
+    mergeable_indexes = set(mergeable)
+    # Targets by signature, all of them and the ones later rules may be folded forward into
+    signatures: Dict[int, Tuple] = {}
+    targets_by_signature: Dict[Tuple, List[int]] = {}
+    forward_targets: Dict[Tuple, List[int]] = {}
+    for target in sorted(targets):
+        if rules[target].condition("BaseType") is not None:
+            signature = signatures[target] = rule_signature(rules[target])
+            targets_by_signature.setdefault(signature, []).append(target)
+            if target not in mergeable_indexes:
+                forward_targets.setdefault(signature, []).append(target)
+    # Most rules style their items differently from every target, skip their signatures
+    target_actions = {(signature[0], signature[-1]) for signature in targets_by_signature}
+    removed = set()
+    # The blocks matching each base looked up so far, and the bases each block was found for
+    candidates: Dict[Optional[str], List[int]] = {}
+    found_for: Dict[int, List[Optional[str]]] = {}
+    target_values: Dict[int, set] = {}
+
+    def base_parts(rule_index: int) -> List[Optional[str]]:
+        base_types = compiled(rule_index).text_values("base_type")
+        return list(base_types[1]) if base_types else [None]
+
+    def blocks_for(base_type: Optional[str]) -> List[int]:
+        found = candidates.get(base_type)
+        if found is None:
+            found = candidates[base_type] = index.blocks_for(base_type)
+            for other in found:
+                found_for.setdefault(other, []).append(base_type)
+        return found
+
+    def reaches(rule_index: int, start: int, end: int) -> bool:
+        """Whether a rule between start and end can match an item of rule_index."""
+        if end - start - 1 <= DIRECT_CHECK_BLOCKS:
+            return any(compiled(other).overlaps(compiled(rule_index), base_type)
+                       for other in range(start + 1, end) if other not in removed
+                       for base_type in base_parts(rule_index))
+        for base_type in base_parts(rule_index):
+            found = blocks_for(base_type)
+            # The index already matched the BaseType, only the other conditions are compared
+            for other in found[bisect_right(found, start):bisect_left(found, end)]:
+                if other not in removed and compiled(other).overlaps(compiled(rule_index)):
+                    return True
+        return False
+
+    def decided_later(rule_index: int) -> bool:
+        """Whether the rules after rule_index show every item it matches without styling it."""
+        base_types = compiled(rule_index).text_values("base_type")
+        for base_type in base_parts(rule_index):
+            found = blocks_for(base_type)
+            for other in found[bisect_right(found, rule_index):]:
+                if other in removed or not compiled(other).overlaps(compiled(rule_index)):
+                    continue
+                if rules[other].visibility != "Show" or rules[other].continues or rules[other].actions:
+                    return False
+                if compiled(other).covers(compiled(rule_index),
+                                          (base_types[0], base_type) if base_type is not None else None):
+                    break
+        return True
+
+    def nearest_targets(rule_index: int, signature: Tuple) -> List[int]:
+        """Get the closest targets with the signature of rule_index, up to MAX_FOLD_ATTEMPTS."""
+        earlier = targets_by_signature.get(signature, [])
+        later = forward_targets.get(signature, [])
+        before = bisect_left(earlier, rule_index) - 1
+        after = bisect_right(later, rule_index)
+        nearest = []
+        while len(nearest) < MAX_FOLD_ATTEMPTS and (before >= 0 or after < len(later)):
+            if after >= len(later) or (before >= 0 and rule_index - earlier[before] <= later[after] - rule_index):
+                nearest.append(earlier[before])
+                before -= 1
+            else:
+                nearest.append(later[after])
+                after += 1
+        return nearest
+
+    def remove(rule_index: int):
+        removed.add(rule_index)
+        signature = signatures.get(rule_index)
+        for groups in (targets_by_signature, forward_targets):
+            group = groups.get(signature, [])
+            position = bisect_left(group, rule_index)
+            if position < len(group) and group[position] == rule_index:
+                del group[position]
+
+    def fold(rule_index: int, target: int):
+        condition = rules[target].condition("BaseType")
+        known = target_values.get(target)
+        if known is None:
+            known = target_values[target] = set(condition.values)
+        added = [value for value in dict.fromkeys(rules[rule_index].condition("BaseType").values)
+                 if value not in known]
+        condition.values.extend(added)
+        known.update(added)
+        index.recompile(target, added)
+        # The target now matches every base the folded rule was found for
+        for base_type in found_for.get(rule_index, []):
+            found = candidates[base_type]
+            position = bisect_left(found, target)
+            if position == len(found) or found[position] != target:
+                found.insert(position, target)
+                found_for.setdefault(target, []).append(base_type)
+        folded[rule_index] = target
+        remove(rule_index)
+
+    dropped = []
+    folded = {}
+    for rule_index in mergeable:
+        rule = rules[rule_index]
+        if rule.continues:
+            continue
+        if drop_decided and rule.visibility == "Show" and not rule.actions:
+            if not compiled(rule_index).unsupported and decided_later(rule_index):
+                dropped.append(rule_index)
+                remove(rule_index)
+            continue
+        if (rule.visibility, tuple(sorted(rule.actions))) not in target_actions \
+                or compiled(rule_index).unsupported:
+            continue
+        for target in nearest_targets(rule_index, rule_signature(rule)):
+            if not reaches(rule_index, min(rule_index, target), max(rule_index, target)):
+                fold(rule_index, target)
+                break
+    return dropped, folded
+
+def normalise_action(action: str) -> str:
+    """Collapse the whitespace of an action line outside of its quoted values."""
+    return " ".join(TOKEN_PATTERN.findall(action))
+
+def minify_rules(rules: List[FilterRule]) -> Dict[int, int]:
+    """Canonicalise rules in place and fold together the ones that only differ in their BaseType values.
+
+    BaseType and Class values are sorted and deduplicated and repeated
+    actions are dropped, keeping the last one. Rules are folded like in
+    merge_rules, so every item keeps the decision and style it had. Returns
+    the target of every folded rule.
+    """
+    for rule in rules:
+        for condition in rule.conditions:
+            if condition.key in TEXT_CONDITIONS:
+                condition.values = sorted(set(condition.values))
+        actions = [normalise_action(action) for action in rule.actions]
+        rule.actions = [action for position, action in enumerate(actions) if action not in actions[position + 1:]]
+    _, folded = merge_rules(rules, range(len(rules)), range(len(rules)), drop_decided=False)
+    for target in set(folded.values()):
+        rules[target].condition("BaseType").values.sort()
+    return folded
+
+def format_rule(rule: FilterRule) -> str:
+    """Render a rule as a block without comments, indentation or blank lines."""
+    lines = [rule.visibility] + [str(condition) for condition in rule.conditions] + rule.actions
+    if rule.continues:
+        lines.append("Continue")
+    return "\n".join(lines) + "\n"
+
+class FilterDifference(NamedTuple):
+    """Drops of one base, class and rarity that two filters decide differently.
+
+    before and after are the deciding rule indexes, -1 if no rule matches.
+    """
+    base_type: str
+    item_class: str
+    rarity: str
+    min_area_level: int
+    max_area_level: int
+    before: int
+    after: int
+
+def rule_outcomes(rules: List[FilterRule], outcome_ids: Dict[Tuple, int], styles: bool = True) -> List[int]:
+    """Get the interned visibility and, if styles is set, style of every rule.
+
+    The list ends with the outcome of items no rule matches, so it can be
+    indexed with the -1 of FilterEvaluator.match_index. A Show rule without
+    actions has the same outcome as no rule.
+    """
+    outcomes = []
+    for rule in rules:
+        actions = rule.actions if styles else ()
+        key = (rule.visibility, tuple(sorted(normalise_action(action) for action in actions)))
+        outcomes.append(outcome_ids.setdefault(key, len(outcome_ids)))
+    outcomes.append(outcome_ids.setdefault(("Show", ()), len(outcome_ids)))
+    return outcomes
+
+class FilterComparison:
+    """Compare the decisions of two filters over the drops of a list of bases.
+
+    Every base is resolved into a decision table per filter and the tables
+    are compared as interned outcomes, so two blocks with the same
+    visibility and actions count as the same decision wherever they are.
+    Without styles only the visibility is compared.
+    """
+    def __init__(self, before: List[FilterRule], after: List[FilterRule],
+                 drop_levels: Optional[Dict[str, int]] = None, styles: bool = True):
+        outcome_ids: Dict[Tuple, int] = {}
+        self.evaluators = (FilterEvaluator(before, drop_levels), FilterEvaluator(after, drop_levels))
+        self.outcomes = (rule_outcomes(before, outcome_ids, styles), rule_outcomes(after, outcome_ids, styles))
+
+    def differences(self, bases: Iterable[Tuple[str, str]]) -> List[FilterDifference]:
+        """Get the drops of (base type, class) pairs decided differently, by area level range."""
+        stride = MAX_AREA_LEVEL + 1
+        before_evaluator, after_evaluator = self.evaluators
+        before_outcomes, after_outcomes = self.outcomes
+        differences = []
+        for base_type, item_class in bases:
+            before = before_evaluator.decision_table(base_type, item_class)
+            after = after_evaluator.decision_table(base_type, item_class)
+            if list(map(before_outcomes.__getitem__, before)) == list(map(after_outcomes.__getitem__, after)):
+                continue
+            for rank, rarity in enumerate(RARITIES):
+                run = None
+                for area_level in range(1, stride):
+                    position = rank * stride + area_level
+                    pair = (before[position], after[position])
+                    differs = before_outcomes[pair[0]] != after_outcomes[pair[1]]
+                    if run is not None and (not differs or pair != run[1]):
+                        differences.append(FilterDifference(base_type, item_class, rarity, run[0],
+                                                            area_level - 1, *run[1]))
+                        run = None
+                    if differs and run is None:
+                        run = (area_level, pair)
+                if run is not None:
+                    differences.append(FilterDifference(base_type, item_class, rarity, run[0],
+                                                        MAX_AREA_LEVEL, *run[1]))
+        return differences
+
+# Per-process state of the comparison workers, set up by init_compare_worker
+_compare_worker = {}
+
+def init_compare_worker(before: List[FilterRule], after: List[FilterRule], drop_levels: Optional[Dict[str, int]],
+                        styles: bool):
+    _compare_worker["comparison"] = FilterComparison(before, after, drop_levels, styles)
+
+def compare_chunk(bases: List[Tuple[str, str]]) -> List[FilterDifference]:
+    return _compare_worker["comparison"].differences(bases)
+
+def compare_filters(before: List[FilterRule], after: List[FilterRule], bases: List[Tuple[str, str]],
+                    drop_levels: Optional[Dict[str, int]] = None, workers: Optional[int] = None,
+                    styles: bool = True) -> List[FilterDifference]:
+    """Get every drop of the bases that the two filters decide differently.
+
+    The bases are split over worker processes (one per core by default)
+    once there are enough of them to pay for starting the workers.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(bases) < PARALLEL_COMPARE_BASES:
+        return FilterComparison(before, after, drop_levels, styles).differences(bases)
+    chunk_size = -(-len(bases) // (workers * 4))
+    chunks = [bases[start:start + chunk_size] for start in range(0, len(bases), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_compare_worker,
+                             initargs=(before, after, drop_levels, styles)) as pool:
+        return [difference for differences in pool.map(compare_chunk, chunks) for difference in differences]
+
+def describe_difference(difference: FilterDifference, before: List[FilterRule], after: List[FilterRule]) -> str:
+    levels = (f"area level {difference.min_area_level}" if difference.min_area_level == difference.max_area_level
+              else f"area levels {difference.min_area_level}-{difference.max_area_level}")
+    decisions = [describe_rule(rules[index]) if index >= 0 else "no block"
+                 for rules, index in ((before, difference.before), (after, difference.after))]
+    return (f"{difference.rarity} {difference.base_type} ({difference.item_class}) at {levels}: "
+            f"{decisions[0]} before, {decisions[1]} after")
+
+def load_evaluator(filepath: str, drop_levels: Optional[Dict[str, int]] = None) -> FilterEvaluator:
+    return FilterEvaluator(parse_filter_file(filepath), drop_levels)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Show which filter block decides an item")
+    parser.add_argument("base_type", nargs="?", help="base type of the item, e.g. \"Expert Tribal Mask\"")
+    parser.add_argument("--class", dest="item_class", default="", help="item class, e.g. Helmets")
+    parser.add_argument("--rarity", default="Normal", choices=RARITIES)
+    parser.add_argument("--area-level", type=int, default=1)
+    parser.add_argument("--drop-level", type=int, default=None)
+    parser.add_argument("--filter", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "filter.filter"),
+                        help="filter to evaluate (default: the generated filter.filter)")
+    parser.add_argument("--shadowed", action="store_true",
+                        help="list the blocks no item can reach instead of evaluating an item")
+    args = parser.parse_args(argv)
+    if args.base_type is None and not args.shadowed:
+        parser.error("a base type or --shadowed is required")
+    return args
+
+def describe_rule(rule: FilterRule) -> str:
+    name = f" ({rule.comment})" if rule.comment else ""
+    return f"{rule.visibility} block at line {rule.line_number}{name}"
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.shadowed:
+        rules = parse_filter_file(args.filter)
+        shadowed = find_shadowed_rules(rules)
+        for index, shadowing in shadowed.items():
+            lines = ", ".join(str(rules[i].line_number) for i in shadowing)
+            print(f"{describe_rule(rules[index])} is shadowed by line {lines}")
+        print(f"{len(shadowed)} of {len(rules)} blocks are shadowed")
+        return
+    evaluator = load_evaluator(args.filter)
+    item = FilterItem(args.base_type, args.item_class, args.rarity, args.area_level,
+                      drop_level=args.drop_level)
+    rule = evaluator.evaluate(item)
+    if rule is None:
+        print("No block matches, the item is shown")
+        return
+    print(describe_rule(rule))
+    for condition in rule.conditions:
+        print(f"    {condition}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,34 @@
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from bisect import bisect_right
+from collections import OrderedDict
+from difflib import SequenceMatcher
 from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import locale
 import logging
+import math
 import re
+import shutil
+import sys
+import threading
+import time
+
+from filterrules import (
+    MAX_AREA_LEVEL, FilterDocument, FilterRule, compare_filters, describe_difference, describe_rule, drop_rules,
+    find_shadowed_rules, format_rule, merge_rules, minify_rules, parse_filter_file, parse_filter_rules
+)
+from profiling import profiler
 
 logging.basicConfig(
     level=logging.ERROR,
@@ -19,6 +45,26 @@ FILTER_DIR = SCRIPT_DIR
 FILTER_BASE = "filterbase.filter"
 FILTER_TEMP = "filter.txt"
 FILTER_OUTPUT = "filter.filter"
+FILTER_SETTINGS = "filtersettings.txt"
+RARE_SAFEGUARD_BLOCK = "Show\nRarity >= Rare\n\n"
+WRITE_BUFFER_SIZE = 1 << 20
+COPY_CHUNK_SIZE = 1 << 20
+CATALOG_CACHE = "bases.cache.json"
+CATALOG_VERSION = 3
+# Threads that list, stat and read base files, see BaseCatalog.preload
+LOAD_WORKERS = 8
+FILTER_STATE = "filter.state.json"
+BLOCK_CACHE = "blocks.cache.json"
+# Bump when a block renderer changes its output, cached blocks of other versions are never used
+BLOCK_CACHE_VERSION = 1
+BLOCK_CACHE_BYTES = 4 << 20
+FILTER_INDEX_SUFFIX = ".index.json"
+# Settings that are not the key of a block unit
+GLOBAL_SETTINGS = ("HIDE_UNSHOWN_ITEMS",)
+# --serve defaults, settings bodies are refused above MAX_SETTINGS_BYTES
+SERVE_HOST = "127.0.0.1"
+SERVE_CACHE_SIZE = 64
+MAX_SETTINGS_BYTES = 1 << 20
 AREA_LEVEL_MARKER = "Area Level"
 REQUIRES_MARKER = "Requires:"
 LEVEL_MARKER = "Level"
@@ -29,18 +75,86 @@ WEAPON_RANGE_MARKER = "Weapon Range:"
 SPIRIT_MARKER = "Spirit:"
 GRANTS_SKILL_MARKER = "Grants Skill:"
 
+# Weapon types of the settings keys that differ from their base file names
+WEAPON_TYPE_NAMES = {
+    "ONEHANDMACES": "ONE_HAND_MACES",
+    "TWOHANDMACES": "TWO_HAND_MACES",
+}
+SKILL_WEAPON_TYPES = ("WANDS", "STAVES", "SCEPTRES")
+
+class ItemCategory(Enum):
+    """Directory of bases/ an item was parsed from."""
+    BODY = "body"
+    BOOTS = "boots"
+    GLOVES = "gloves"
+    HELMET = "helmet"
+    SHIELDS = "shields"
+    FOCI = "foci"
+    MARTIAL_WEAPONS = "martial weapons"
+    SKILL_WEAPONS = "skill-based weapons"
+    QUIVERS = "quivers"
+    UNKNOWN = "unknown"
+
+@lru_cache(maxsize=None)
+def base_file_traits(filepath: Optional[str]) -> Tuple[ItemCategory, str]:
+    """Get the category and upper case file name (e.g. WANDS or ONEHANDMACES) of a base file.
+
+    Cached, so every item of a file shares the same strings.
+    """
+    if not filepath:
+        return ItemCategory.UNKNOWN, "UNKNOWN"
+    directory, filename = os.path.split(filepath.replace('\\', '/'))
+    category = ItemCategory._value2member_map_.get(os.path.basename(directory), ItemCategory.UNKNOWN)
+    return category, os.path.splitext(filename)[0].upper()
+
+def parse_area_level(area_level: str) -> Tuple[int, Optional[int]]:
+    """Parse area level string into min and max levels."""
+    # Remove "Area Level " prefix if present
+    area_level = area_level.replace("Area Level ", "")
+
+    # Handle endgame case with "+"
+    if area_level.endswith("+"):
+        min_level = int(area_level.rstrip("+"))
+        return min_level, None
+
+    # Handle range case with "-"
+    if "-" in area_level:
+        min_level, max_level = map(int, area_level.split("-"))
+        return min_level, max_level
+
+    # Handle single number case
+    return int(area_level), None
+
 class BaseItem:
-    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None):
+    """A base item type.
+
+    The area level range, endgame flag, category and file type are derived
+    once at construction, so sorting and block rendering never reparse the
+    area level string or the file path.
+    """
+    __slots__ = ("name", "area_level", "_filepath", "level_req", "attribute_reqs", "tier",
+                 "min_area_level", "max_area_level", "open_ended", "is_endgame", "category", "file_type")
+    # Slots computed from name, area_level and the file path, never serialized
+    DERIVED_SLOTS = frozenset(("_filepath", "min_area_level", "max_area_level", "open_ended", "is_endgame",
+                               "category", "file_type"))
+
+    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None, tier: Optional[int] = None):
         self.name = name
         self.area_level = area_level
-        self._filepath = filepath
         self.level_req: Optional[int] = None
         self.attribute_reqs: Dict[str, int] = {}
-        
-    @property
-    def is_endgame(self) -> bool:
-        return "Expert" in self.name or self.area_level.endswith("+")
-        
+        self.tier = tier
+        # max_area_level is None for endgame "+" ranges and single levels
+        self.min_area_level, self.max_area_level = parse_area_level(area_level) if area_level else (0, None)
+        self.open_ended = area_level.endswith("+") if area_level else False
+        self.is_endgame = "Expert" in name or self.open_ended
+        self.set_filepath(filepath)
+
+    def set_filepath(self, filepath: Optional[str]):
+        """Set the base file of the item and derive its category and file type."""
+        self._filepath = filepath
+        self.category, self.file_type = base_file_traits(filepath)
+
     @property
     def is_advanced(self) -> bool:
         return "Advanced" in self.name
@@ -49,42 +163,6 @@ class BaseItem:
         """Validate that required fields are set."""
         return bool(self.name and self.area_level)
 
-    @property
-    def category(self) -> str:
-        """Get the item category based on directory structure."""
-        if not self._filepath:
-            return "unknown"
-        return self._filepath.split('bases/')[-1].split('/')[0]
-
-    def parse_area_level(self, area_level: str) -> Tuple[int, Optional[int]]:
-        """Parse area level string into min and max levels."""
-        # Remove "Area Level " prefix if present
-        area_level = area_level.replace("Area Level ", "")
-        
-        # Handle endgame case with "+"
-        if area_level.endswith("+"):
-            min_level = int(area_level.rstrip("+"))
-            return min_level, None
-            
-        # Handle range case with "-"
-        if "-" in area_level:
-            min_level, max_level = map(int, area_level.split("-"))
-            return min_level, max_level
-            
-        # Handle single number case
-        return int(area_level), None
-
-    @property
-    def min_area_level(self) -> int:
-        return self.parse_area_level(self.area_level)[0]
-
-    @property
-    def max_area_level(self) -> Optional[int]:
-        """Get the maximum area level if it exists."""
-        if self.is_endgame:
-            return None
-        return self.parse_area_level(self.area_level)[1]
-
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, BaseItem):
             return NotImplemented
@@ -99,13 +177,26 @@ class BaseItem:
         return hash((self.name, self.area_level))
 
 class DefenseItem(BaseItem):
-    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None):
-        super().__init__(name, area_level, filepath)
+    __slots__ = ("armour", "evasion", "energy_shield", "block_chance")
+
+    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None, tier: Optional[int] = None):
+        super().__init__(name, area_level, filepath, tier)
         self.armour: int = 0
         self.evasion: int = 0
         self.energy_shield: int = 0
         self.block_chance: Optional[int] = None
-        
+
+    def defense_values(self) -> Dict[str, int]:
+        """Get the defense values in the format used by DefenseBaseParser."""
+        values = {}
+        if self.armour:
+            values["armour"] = self.armour
+        if self.evasion:
+            values["evasion"] = self.evasion
+        if self.energy_shield:
+            values["es"] = self.energy_shield
+        return values
+
     def validate(self) -> bool:
         """Validate that at least one defense stat is set."""
         return super().validate() and any([
@@ -115,14 +206,15 @@ class DefenseItem(BaseItem):
         ])
 
 class WeaponItem(BaseItem):
-    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None):
-        super().__init__(name, area_level, filepath)
+    __slots__ = ("physical_damage_min", "physical_damage_max", "crit_chance", "attacks_per_second", "weapon_range")
+
+    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None, tier: Optional[int] = None):
+        super().__init__(name, area_level, filepath, tier)
         self.physical_damage_min: int = 0
         self.physical_damage_max: int = 0
         self.crit_chance: float = 0.0
         self.attacks_per_second: float = 0.0
         self.weapon_range: float = 0.0
-        self.tier = None
 
     def validate(self) -> bool:
         """Validate that required weapon stats are set."""
@@ -134,8 +226,10 @@ class WeaponItem(BaseItem):
         ])
 
 class SkillWeaponItem(BaseItem):
-    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None):
-        super().__init__(name, area_level, filepath)
+    __slots__ = ("spirit", "granted_skill")
+
+    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None, tier: Optional[int] = None):
+        super().__init__(name, area_level, filepath, tier)
         self.spirit: Optional[int] = None
         self.granted_skill: Optional[str] = None
 
@@ -144,71 +238,123 @@ class SkillWeaponItem(BaseItem):
         return super().validate() and self.granted_skill is not None
 
 class CrossbowItem(WeaponItem):
-    def __init__(self, name: str, area_level: str):
-        super().__init__(name, area_level)
+    __slots__ = ("reload_time",)
+
+    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None, tier: Optional[int] = None):
+        super().__init__(name, area_level, filepath, tier)
         self.reload_time: float = 0.0
 
     def validate(self) -> bool:
         return super().validate() and self.reload_time > 0
 
 class QuiverItem(BaseItem):
-    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None):
-        super().__init__(name, area_level, filepath)
+    __slots__ = ("implicit_effect",)
+
+    def __init__(self, name: str, area_level: str, filepath: Optional[str] = None, tier: Optional[int] = None):
+        super().__init__(name, area_level, filepath, tier)
         self.implicit_effect: Optional[str] = None
 
     def validate(self) -> bool:
         """Validate that quiver has required properties."""
         return super().validate()
 
+# MinimapIcon sizes, 0 is the largest icon in the filter syntax
+MINIMAP_ICON_SIZES = {
+    "Large": "0",
+    "Medium": "1",
+    "Small": "2"
+}
+
+def format_style_lines(style: Dict[str, str]) -> List[str]:
+    """Format style dictionary into filter syntax lines."""
+    lines = []
+    
+    # Combine the minimap icon properties into a single line first, a size alone gives a white circle
+    size = style.get("MinimapIconSize")
+    if size:
+        size = MINIMAP_ICON_SIZES.get(size, size if size.isdigit() else "0")
+        colour = style.get("MinimapIconColour", "White")
+        shape = style.get("MinimapIconShape", "Circle")
+        lines.append(f"MinimapIcon {size} {colour} {shape}")
+    
+    # Add remaining style properties
+    for key, value in style.items():
+        if key not in ("MinimapIconSize", "MinimapIconColour", "MinimapIconShape"):
+            lines.append(f"{key} {value}")
+    
+    return lines
+
 class FilterSettings:
-    def __init__(self, settings_file):
+    def __init__(self, settings_file=None):
         self.show_settings = {}
         self.styles = {}
-        logger.debug(f"Initializing FilterSettings with file: {settings_file}")
-        self.parse_settings_file(settings_file)
+        self.style_fragments = MappingProxyType({})
+        if settings_file is not None:
+            logger.debug("Initializing FilterSettings with file: %s", settings_file)
+            self.parse_settings_file(settings_file)
+
+    @classmethod
+    def from_text(cls, text: str) -> "FilterSettings":
+        """Parse settings given as the text of a settings file."""
+        settings = cls()
+        settings.parse_settings_lines(text.splitlines())
+        return settings
         
     def parse_settings_file(self, settings_file):
         """Parse settings from txt file"""
+        with open(settings_file, 'r') as f:
+            self.parse_settings_lines(f)
+
+    def parse_settings_lines(self, lines):
+        """Parse settings from the lines of a settings file"""
         current_section = None
         current_style = None
         
-        with open(settings_file, 'r') as f:
-            for line in f:
-                line = line.strip()
+        for line in lines:
+            profiler.count("lines scanned")
+            line = line.strip()
+            
+            # Skip empty lines and comments
+            if not line or line.startswith('#'):
+                continue
                 
-                # Skip empty lines and comments
-                if not line or line.startswith('#'):
-                    continue
-                    
-                # Parse show/hide settings
-                if "=" in line and ":" not in line:  # Added ": not in line" to avoid matching style lines
-                    key, value = [x.strip() for x in line.split("=", 1)]
-                    value = value.split('#')[0].strip()
-                    self.show_settings[key] = value.lower() == 'true'
-                    
-                # Check for style section - strip quotes and "{" from style name
-                elif line.endswith("{"):
-                    current_style = line.split("{")[0].strip().strip('"').strip(':').strip()
-                    logger.debug(f"Found style section: {current_style}")
-                    self.styles[current_style] = {}
-                    continue
-                    
-                # Check for style closing
-                elif line.startswith("}"):
-                    current_style = None
+            # Parse show/hide settings
+            if "=" in line and ":" not in line:  # Added ": not in line" to avoid matching style lines
+                key, value = [x.strip() for x in line.split("=", 1)]
+                value = value.split('#')[0].strip()
+                self.show_settings[key] = value.lower() == 'true'
+                
+            # Check for style section - strip quotes and "{" from style name
+            elif line.endswith("{"):
+                current_style = line.split("{")[0].strip().strip('"').strip(':').strip()
+                logger.debug("Found style section: %s", current_style)
+                self.styles[current_style] = {}
+                continue
+                
+            # Check for style closing
+            elif line.startswith("}"):
+                current_style = None
+                continue
+                
+            # Parse style settings
+            elif current_style is not None and ":" in line:
+                if line.strip().startswith("#"):  # Skip comments inside style blocks
                     continue
-                    
-                # Parse style settings
-                elif current_style is not None and ":" in line:
-                    if line.strip().startswith("#"):  # Skip comments inside style blocks
-                        continue
-                    key, value = [x.strip().strip('"').strip(',') for x in line.split(":", 1)]
-                    self.styles[current_style][key] = value
-                    
+                key, value = [x.strip().strip('"').strip(',') for x in line.split(":", 1)]
+                self.styles[current_style][key] = value
+                
         logger.debug("Parsed styles:")
         for style, settings in self.styles.items():
-            logger.debug(f"Style: {style}")
-            logger.debug(f"Settings: {settings}")
+            logger.debug("Style: %s", style)
+            logger.debug("Settings: %s", settings)
+        self.compile_styles()
+
+    def compile_styles(self):
+        """Render every style once into the filter syntax shared by all blocks"""
+        self.style_fragments = MappingProxyType({
+            name: "\n".join(format_style_lines(style))
+            for name, style in self.styles.items()
+        })
 
 class FilterBlockGenerator:
     def __init__(self, settings: FilterSettings):
@@ -236,26 +382,15 @@ class FilterBlockGenerator:
 
     def _get_item_class(self, item: BaseItem) -> str:
         """Get the item class based on filepath."""
-        if not item._filepath:
-            return "UNKNOWN"
-        
-        parts = item._filepath.split('/')
-        if len(parts) < 2:
+        if item.category is ItemCategory.UNKNOWN:
             return "UNKNOWN"
         
         # For weapons, use the specific weapon type from the filename
-        if 'martial weapons' in item._filepath.lower() or 'skill-based weapons' in item._filepath.lower():
-            # Get filename without extension
-            weapon_type = parts[-1].replace('.txt', '').upper()
-            # Handle special cases
-            if weapon_type == "ONEHANDMACES":
-                return "ONE HAND MACES"
-            elif weapon_type == "TWOHANDMACES":
-                return "TWO HAND MACES"
-            return weapon_type
+        if item.category in (ItemCategory.MARTIAL_WEAPONS, ItemCategory.SKILL_WEAPONS):
+            return WEAPON_TYPE_NAMES.get(item.file_type, item.file_type).replace('_', ' ')
         
         # For other items, use the directory name
-        return parts[-2].upper()
+        return item.category.value.upper()
 
     def _create_header(self, item: BaseItem) -> str:
         """Create the descriptive header comment."""
@@ -264,15 +399,10 @@ class FilterBlockGenerator:
             if item.name == "Shrine Sceptre" and "Purity" in item.granted_skill:
                 return "# PURITY SCEPTRES"
             
-            weapon_type = (
-                'WANDS' if 'wands' in item._filepath.lower() else
-                'STAVES' if 'staves' in item._filepath.lower() else
-                'SCEPTRES' if 'sceptres' in item._filepath.lower() else
-                'UNKNOWN'
-            )
+            weapon_type = item.file_type if item.file_type in SKILL_WEAPON_TYPES else 'UNKNOWN'
             return f"# {item.granted_skill.upper()} {weapon_type}"
         
-        if 'quivers' in item._filepath.lower():
+        if item.category is ItemCategory.QUIVERS:
             return f"# {item.name}"  # Use the quiver's name as the header
         
         # Original header logic for other items...
@@ -319,11 +449,9 @@ class FilterBlockGenerator:
         
         # Add style if showing
         if show:
-            if style:
-                style_dict = self.settings.styles.get(style, {})
-            else:
-                style_dict = self.settings.get_style_for_item(item)
-            lines.extend(self._format_style(style_dict))
+            fragment = self._style_fragment(item, style)
+            if fragment:
+                lines.append(fragment)
         
         # Add blank line at end of block
         lines.append("")
@@ -354,45 +482,152 @@ class FilterBlockGenerator:
         
         # Add style if showing
         if show:
-            if style:
-                style_dict = self.settings.styles.get(style, {})
-            else:
-                style_dict = self.settings.get_style_for_item(item)
-            lines.extend(self._format_style(style_dict))
+            fragment = self._style_fragment(item, style)
+            if fragment:
+                lines.append(fragment)
         
         # Add blank line at end of block
         lines.append("")
         
         return "\n".join(lines) + "\n"
 
+    def _style_fragment(self, item: BaseItem, style: Optional[str] = None) -> str:
+        """Get the compiled style lines for a block."""
+        if not style:
+            style = self.settings.get_style_for_item(item)
+        return self.settings.style_fragments.get(style, "")
+
     def _format_style(self, style: Dict[str, str]) -> List[str]:
         """Format style dictionary into filter syntax lines."""
-        lines = []
-        
-        # Convert size string to integer
-        size_map = {
-            "Large": "0",
-            "Medium": "1",
-            "Small": "2"
-        }
-        
-        # Handle minimap icon properties together
-        if "MinimapIconSize" in style:
-            size = size_map.get(style["MinimapIconSize"], "0")
-            color = style.get("MinimapIconColour", "White")
-            shape = style.get("MinimapIconShape", "Circle")
-            lines.append(f"MinimapIcon {size} {color} {shape}")
-            
-            # Remove these keys so they're not processed again
-            style.pop("MinimapIconSize", None)
-            style.pop("MinimapIconColour", None)
-            style.pop("MinimapIconShape", None)
-        
-        # Add remaining style properties
-        for key, value in style.items():
-            lines.append(f"{key} {value}")
-        
-        return lines
+        return format_style_lines(style)
+
+# Precompiled patterns for the base file tokenizer
+BASE_HEADER_PATTERN = re.compile(r'^(.+?) \(Area Level (\d+)(?:-(\d+)|(\+))?\)')
+BASE_TIER_PATTERN = re.compile(r'^Tier (\d+)$')
+BASE_FIELD_PATTERN = re.compile(r'^([A-Za-z][A-Za-z ]*):\s*(.*)$')
+LEVEL_REQ_PATTERN = re.compile(r'Level (\d+)')
+ATTRIBUTE_REQ_PATTERN = re.compile(r'(\d+) (Str|Dex|Int)')
+
+class BaseRecord:
+    """A single blank-line delimited entry of a base file."""
+    def __init__(self, name: str, line_number: int):
+        self.name = name
+        self.line_number = line_number
+        self.area_level: Optional[str] = None
+        self.min_level: Optional[int] = None
+        self.max_level: Optional[int] = None
+        self.is_endgame = False
+        self.tier: Optional[int] = None
+        self.fields: Dict[str, str] = {}
+        self.level_req: Optional[int] = None
+        self.attribute_reqs: Dict[str, int] = {}
+        self.granted_skill: Optional[str] = None
+        self.implicits: List[str] = []
+
+    def add_line(self, line: str):
+        """Classify a body line of the record."""
+        match = BASE_FIELD_PATTERN.match(line)
+        if not match:
+            match = BASE_TIER_PATTERN.match(line)
+            if match:
+                if self.tier is None:
+                    self.tier = int(match.group(1))
+            else:
+                self.implicits.append(line)
+            return
+
+        key, value = match.groups()
+        if key == "Requires":
+            match = LEVEL_REQ_PATTERN.search(value)
+            if match:
+                self.level_req = int(match.group(1))
+            for amount, attribute in ATTRIBUTE_REQ_PATTERN.findall(value):
+                self.attribute_reqs[attribute] = int(amount)
+        elif key == "Grants Skill":
+            self.granted_skill = value
+        self.fields[key] = value
+
+    def has_body(self) -> bool:
+        return bool(self.fields or self.implicits) or self.tier is not None
+
+    def with_aliases(self, aliases: List["BaseRecord"]) -> List["BaseRecord"]:
+        """Give header-only aliases the body of this record, in file order."""
+        for alias in aliases:
+            alias.tier = self.tier
+            alias.fields = dict(self.fields)
+            alias.level_req = self.level_req
+            alias.attribute_reqs = dict(self.attribute_reqs)
+            alias.granted_skill = self.granted_skill
+            alias.implicits = list(self.implicits)
+        return aliases + [self]
+
+    def int_field(self, key: str, default: int = 0) -> int:
+        value = self.fields.get(key)
+        return int(value.rstrip("%")) if value else default
+
+    def float_field(self, key: str, default: float = 0.0) -> float:
+        value = self.fields.get(key)
+        return float(value.rstrip("%")) if value else default
+
+def open_base_file(filepath: str, data: Optional[bytes] = None):
+    """Open a base file as text, from data if its content was already read."""
+    if data is None:
+        return open(filepath, 'r')
+    return io.TextIOWrapper(io.BytesIO(data))
+
+def iter_base_records(filepath: str, data: Optional[bytes] = None):
+    """Read a base file once and yield a BaseRecord for every entry.
+
+    Entries are separated by blank lines and start with the item name,
+    optionally followed by its area level range. Consecutive header lines
+    name bases that share the stats below them. Comment lines are skipped.
+    data is the content of the file if it was already read.
+    """
+    record = None
+    aliases = []
+    line_number = 0
+    with open_base_file(filepath, data) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                if record is not None:
+                    yield from record.with_aliases(aliases)
+                    record = None
+                    aliases = []
+                continue
+            if line[0] == '#':
+                continue
+
+            # A header starts a new entry even without a separating blank line
+            if record is not None and '(Area Level' not in line:
+                record.add_line(line)
+                continue
+            if record is not None:
+                if record.has_body():
+                    yield from record.with_aliases(aliases)
+                    aliases = []
+                else:
+                    aliases.append(record)
+
+            match = BASE_HEADER_PATTERN.match(line)
+            if match:
+                name, min_level, max_level, plus = match.groups()
+                record = BaseRecord(name.strip(), line_number)
+                record.min_level = int(min_level)
+                if max_level:
+                    record.max_level = int(max_level)
+                    record.area_level = f"{min_level}-{max_level}"
+                elif plus:
+                    record.is_endgame = True
+                    record.area_level = f"{min_level}+"
+                else:
+                    record.area_level = min_level
+            else:
+                record = BaseRecord(line, line_number)
+
+    profiler.count("lines scanned", line_number)
+    if record is not None:
+        yield from record.with_aliases(aliases)
 
 class DefenseBaseParser:
     def __init__(self):
@@ -426,65 +661,73 @@ class DefenseBaseParser:
                 values["es"] = int(line.split(":")[1].strip())
         return values
 
-def parse_item_file(filepath: str) -> List[BaseItem]:
+    def get_record_values(self, record: BaseRecord):
+        """Extract armor/evasion/es values from a tokenized record"""
+        values = {}
+        for key, field in (("armour", "Armour"), ("evasion", "Evasion Rating"), ("es", "Energy Shield")):
+            if field in record.fields:
+                values[key] = record.int_field(field)
+        return values
+
+def parse_defense_file(filepath: str, data: Optional[bytes] = None) -> List[DefenseItem]:
+    """Parse a defense base file (armour slots, shields and foci) into DefenseItems."""
+    parser = DefenseBaseParser()
+    items = []
+
+    for record in iter_base_records(filepath, data):
+        # Defense bases always have an area level range or an endgame "+"
+        if not record.min_level or (record.max_level is None and not record.is_endgame):
+            continue
+        item = DefenseItem(record.name, record.area_level, filepath, record.tier)
+        values = parser.get_record_values(record)
+        item.armour = values.get("armour", 0)
+        item.evasion = values.get("evasion", 0)
+        item.energy_shield = values.get("es", 0)
+        if "Block chance" in record.fields:
+            item.block_chance = record.int_field("Block chance")
+        item.level_req = record.level_req
+        item.attribute_reqs = record.attribute_reqs
+        items.append(item)
+
+    return items
+
+def parse_item_file(filepath: str, data: Optional[bytes] = None) -> List[BaseItem]:
     """Parse a single item file and return a list of items."""
     items = []
-    current_item = None
+    lower_path = filepath.lower()
     
-    with open(filepath, 'r') as f:
-        lines = [line.strip() for line in f if line.strip()]
+    for record in iter_base_records(filepath, data):
+        # Only entries with an area level are items
+        if record.area_level is None:
+            continue
+        name = record.name
+        area_level = record.area_level
+        
+        # Handle different weapon types
+        if 'martial weapons' in lower_path:
+            # Only endgame items carry a Tier
+            item = WeaponItem(name, area_level, filepath, record.tier if record.is_endgame else None)
+            fields = record.fields
+            if "Physical Damage" in fields:
+                min_dmg, max_dmg = map(int, fields["Physical Damage"].split("-"))
+                item.physical_damage_min = min_dmg
+                item.physical_damage_max = max_dmg
+            item.crit_chance = record.float_field("Critical Hit Chance")
+            item.attacks_per_second = record.float_field("Attacks per Second")
+            item.weapon_range = record.float_field("Weapon Range")
+            if isinstance(item, CrossbowItem):
+                item.reload_time = record.float_field("Reload Time")
+        elif 'quivers' in lower_path:
+            item = QuiverItem(name, area_level, filepath)
+        elif any(x in lower_path for x in ['wands', 'staves', 'sceptres']):
+            item = SkillWeaponItem(name, area_level, filepath)
+        else:
+            item = BaseItem(name, area_level, filepath)
+        item.level_req = record.level_req
+        item.attribute_reqs = record.attribute_reqs
         
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            
-            # Start new item when we see a name with area level
-            if '(Area Level' in line:
-                if current_item and current_item.validate():
-                    items.append(current_item)
-                
-                # Extract name and area level
-                name = line.split(' (Area Level')[0].strip()
-                area_level = line.split('(Area Level ')[1].split(')')[0].strip()
-                
-                # Handle different weapon types
-                if 'martial weapons' in filepath.lower():
-                    current_item = WeaponItem(name, area_level)
-                    current_item._filepath = filepath
-                    # Look ahead for Tier if this is an endgame item
-                    if "+" in area_level and i + 1 < len(lines) and "Tier" in lines[i + 1]:
-                        current_item.tier = int(lines[i + 1].split("Tier")[1].strip())
-                        i += 1  # Skip the tier line since we've processed it
-                elif 'quivers' in filepath.lower():
-                    current_item = QuiverItem(name, area_level, filepath)
-                elif any(x in filepath.lower() for x in ['wands', 'staves', 'sceptres']):
-                    current_item = SkillWeaponItem(name, area_level, filepath)
-                else:
-                    current_item = BaseItem(name, area_level, filepath)
-                    current_item._filepath = filepath
-            
-            # Parse weapon properties
-            elif current_item and isinstance(current_item, WeaponItem):
-                if "Physical Damage:" in line:
-                    damage = line.split(":")[1].strip()
-                    min_dmg, max_dmg = map(int, damage.split("-"))
-                    current_item.physical_damage_min = min_dmg
-                    current_item.physical_damage_max = max_dmg
-                elif "Critical Hit Chance:" in line:
-                    crit = line.split(":")[1].strip().rstrip("%")
-                    current_item.crit_chance = float(crit)
-                elif "Attacks per Second:" in line:
-                    aps = line.split(":")[1].strip()
-                    current_item.attacks_per_second = float(aps)
-                elif "Reload Time:" in line and isinstance(current_item, CrossbowItem):
-                    reload = line.split(":")[1].strip()
-                    current_item.reload_time = float(reload)
-            
-            i += 1
-            
-    # Add final item if valid
-    if current_item and current_item.validate():
-        items.append(current_item)
+        if item.validate():
+            items.append(item)
         
     return items
 
@@ -494,20 +737,20 @@ def parse_all_bases() -> List[BaseItem]:
     all_items = []
     
     # Add debug logging
-    logger.debug(f"Searching for base files in: {BASE_DIR}")
+    logger.debug("Searching for base files in: %s", BASE_DIR)
     
     for root, _, files in os.walk(BASE_DIR):
         for file in files:
             if file.endswith('.txt'):
                 filepath = os.path.join(root, file)
-                logger.debug(f"Found file: {filepath}")
+                logger.debug("Found file: %s", filepath)
                 if 'martial weapons' in filepath.lower():
-                    logger.debug(f"Found martial weapon file: {filepath}")
+                    logger.debug("Found martial weapon file: %s", filepath)
                 items = parse_item_file(filepath)
-                logger.debug(f"Parsed {len(items)} items from {filepath}")
+                logger.debug("Parsed %s items from %s", len(items), filepath)
                 all_items.extend(items)
                 
-    logger.debug(f"Total items parsed: {len(all_items)}")
+    logger.debug("Total items parsed: %s", len(all_items))
     return all_items
 
 def create_item(filepath: str, name: str, area_level: str) -> BaseItem:
@@ -572,31 +815,13 @@ def get_max_defense_values(base_dir, slot_type, defense_type):
     if not os.path.exists(file_path):
         return max_values
         
-    # Read and parse file
-    with open(file_path, 'r') as f:
-        current_block = []
-        for line in f:
-            line = line.strip()
-            if not line:  # Empty line marks end of block
-                if current_block:
-                    # Only process endgame bases
-                    _, _, is_endgame = parser.parse_area_level(current_block[0])
-                    if is_endgame:
-                        values = parser.get_defense_values(current_block)
-                        # Update max values
-                        for defense, value in values.items():
-                            max_values[defense] = max(max_values[defense], value)
-                current_block = []
-            else:
-                current_block.append(line)
-                
-        # Process last block if exists
-        if current_block:
-            _, _, is_endgame = parser.parse_area_level(current_block[0])
-            if is_endgame:
-                values = parser.get_defense_values(current_block)
-                for defense, value in values.items():
-                    max_values[defense] = max(max_values[defense], value)
+    # Only process endgame bases
+    for record in iter_base_records(file_path):
+        if record.is_endgame:
+            values = parser.get_record_values(record)
+            # Update max values
+            for defense, value in values.items():
+                max_values[defense] = max(max_values[defense], value)
                     
     return max_values
 
@@ -621,46 +846,184 @@ def determine_defense_tier(values, slot, defense_type, base_dir):
     if not os.path.exists(file_path):
         return 2
         
-    with open(file_path, 'r') as f:
-        current_block = []
-        for line in f:
-            line = line.strip()
-            if not line:
-                if current_block and values:
-                    block_values = DefenseBaseParser().get_defense_values(current_block)
-                    if block_values == values:
-                        for block_line in current_block:
-                            if block_line.startswith("Tier"):
-                                tier = int(block_line.split()[1])
-                                return tier
-                current_block = []
-                continue
-            current_block.append(line)
-            
-        # Check last block
-        if current_block and values:
-            block_values = DefenseBaseParser().get_defense_values(current_block)
-            if block_values == values:
-                for block_line in current_block:
-                    if block_line.startswith("Tier"):
-                        tier = int(block_line.split()[1])
-                        return tier
+    if values:
+        parser = DefenseBaseParser()
+        for record in iter_base_records(file_path):
+            if record.tier is not None and parser.get_record_values(record) == values:
+                return record.tier
                 
     return 2  # Default to T2 if no tier found
 
+DEFENSE_SLOTS = ("body", "helmet", "gloves", "boots", "shields", "foci")
+DEFENSE_STATS = ("armour", "evasion", "energy_shield")
+TIER_MODES = ("file", "relative", "percentile")
+
+class TierRule(NamedTuple):
+    """How endgame defense tiers are computed from the stat table.
+
+    relative: T1 within threshold percent of the best base of the slot and
+    defense type. percentile: T1 for the top threshold percent of them,
+    at least the best one.
+    With overrides, hand-written Tier lines win over the computed tiers.
+    """
+    mode: str
+    threshold: float = 5.0
+    overrides: bool = True
+
+def settings_defense_type(defense_type: str) -> str:
+    """Convert a defense base file name to the defense type of the settings keys."""
+    return {
+        "armoures": "ARMOUR_ES",
+        "armourevasion": "ARMOUR_EVASION",
+        "evasiones": "EVASION_ES",
+    }.get(defense_type.lower(), defense_type)
+
+class DefenseStatTable:
+    """Columnar stats of the defense catalog, one group of columns per (slot, defense type).
+
+    Every column is an array with one entry per item in file order. A block
+    chance, max area level or tier of 0 means the item has none; the tier
+    column holds the hand-written Tier lines of the base files.
+    """
+    COLUMNS = ("armour", "evasion", "energy_shield", "block_chance", "min_area_level", "max_area_level",
+               "endgame", "tier")
+
+    def __init__(self):
+        self.names: Dict[Tuple[str, str], List[str]] = {}
+        self.columns: Dict[Tuple[str, str], Dict[str, array]] = {}
+
+    def add_group(self, slot: str, defense_type: str, items: List[DefenseItem]):
+        """Set the columns of a slot and defense type from its parsed items."""
+        self.names[(slot, defense_type)] = [item.name for item in items]
+        self.columns[(slot, defense_type)] = {
+            "armour": array('i', [item.armour for item in items]),
+            "evasion": array('i', [item.evasion for item in items]),
+            "energy_shield": array('i', [item.energy_shield for item in items]),
+            "block_chance": array('i', [item.block_chance or 0 for item in items]),
+            "min_area_level": array('i', [item.min_area_level for item in items]),
+            "max_area_level": array('i', [item.max_area_level or 0 for item in items]),
+            "endgame": array('b', [item.open_ended for item in items]),
+            "tier": array('b', [item.tier or 0 for item in items]),
+        }
+
+    def max_values(self, slot: str, defense_type: str) -> Dict[str, int]:
+        """Get the highest value of every defense stat among the endgame bases."""
+        columns = self.columns[(slot, defense_type)]
+        endgame = columns["endgame"]
+        return {stat: max((value for value, flag in zip(columns[stat], endgame) if flag), default=0)
+                for stat in DEFENSE_STATS}
+
+    def scores(self, slot: str, defense_type: str) -> List[float]:
+        """Score the endgame bases by their mean defense relative to the best one, 0 for leveling bases."""
+        columns = self.columns[(slot, defense_type)]
+        ratios = [[value / maximum for value in columns[stat]]
+                  for stat, maximum in self.max_values(slot, defense_type).items() if maximum]
+        if not ratios:
+            return [0.0] * len(columns["endgame"])
+        return [sum(row) / len(ratios) if flag else 0.0 for row, flag in zip(zip(*ratios), columns["endgame"])]
+
+    def group_tiers(self, slot: str, defense_type: str, rule: TierRule) -> array:
+        """Compute the tiers of one group in a single pass over its columns, 0 for leveling bases."""
+        columns = self.columns[(slot, defense_type)]
+        scores = self.scores(slot, defense_type)
+        if rule.mode == "relative":
+            cutoff = 1 - rule.threshold / 100
+            tiers = [1 if score >= cutoff else 2 for score in scores]
+        elif rule.mode == "percentile":
+            # The top threshold percent rounded up, so small groups keep a T1, and ties share a tier
+            ranked = sorted((score for score, flag in zip(scores, columns["endgame"]) if flag), reverse=True)
+            top = max(1, math.ceil(len(ranked) * rule.threshold / 100))
+            cutoff = ranked[top - 1] if ranked else 0.0
+            tiers = [1 if score >= cutoff else 2 for score in scores]
+        else:
+            raise ValueError(f"Unknown tier mode: {rule.mode}")
+        if rule.overrides:
+            tiers = [hand_tier or tier for tier, hand_tier in zip(tiers, columns["tier"])]
+        return array('b', [tier if flag else 0 for tier, flag in zip(tiers, columns["endgame"])])
+
+class DefenseTierIndex:
+    """Tier lookup for endgame defense bases, built once per base file.
+
+    Replaces rescanning the base file for every endgame item. Tiers are keyed
+    by item name and by defense values per (slot, defense type), where the
+    first block with matching values wins like in determine_defense_tier.
+    With a tier rule, the tiers of each file are computed from its stat table
+    columns instead, with the hand-written tiers as overrides unless the rule
+    turns them off.
+    """
+    def __init__(self, tiers: Optional[TierRule] = None):
+        self.tiers = tiers
+        self.table = DefenseStatTable()
+        self.computed: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self.by_name: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self.by_values: Dict[Tuple[str, str], Dict[Tuple, int]] = {}
+        self.scan_counts: Dict[str, int] = {}
+
+    def add_file(self, slot: str, defense_type: str, file_path: str, items: List[DefenseItem]):
+        """Index the tiers of all items parsed from one defense base file."""
+        self.scan_counts[file_path] = self.scan_counts.get(file_path, 0) + 1
+        if self.tiers:
+            self.table.add_group(slot, defense_type, items)
+            computed = self.computed.setdefault((slot, defense_type), {})
+            for item, tier in zip(items, self.table.group_tiers(slot, defense_type, self.tiers)):
+                if tier:
+                    computed.setdefault(item.name, tier)
+        by_name = self.by_name.setdefault((slot, defense_type), {})
+        by_values = self.by_values.setdefault((slot, defense_type), {})
+        for item in items:
+            if item.tier is None:
+                continue
+            by_name.setdefault(item.name, item.tier)
+            by_values.setdefault(tuple(sorted(item.defense_values().items())), item.tier)
+
+    def lookup(self, slot: str, defense_type: str, item: DefenseItem) -> int:
+        """Get the tier of an item, defaulting to T2 if no tier is found."""
+        tier = self.computed.get((slot, defense_type), {}).get(item.name)
+        if tier is not None:
+            return tier
+        tier = self.by_name.get((slot, defense_type), {}).get(item.name)
+        if tier is None:
+            values = tuple(sorted(item.defense_values().items()))
+            tier = self.by_values.get((slot, defense_type), {}).get(values, 2)
+        return tier
+
+    @property
+    def files_scanned(self) -> int:
+        return sum(self.scan_counts.values())
+
+    def rescanned_files(self) -> List[str]:
+        """Get the files that were indexed more than once."""
+        return [path for path, count in self.scan_counts.items() if count > 1]
+
+def get_defense_name(defense_type):
+    """Format a settings defense type for headers and style names"""
+    if defense_type.upper() == "ES":
+        return "ES"
+    elif "_" in defense_type:
+        # Handle hybrid defenses
+        parts = defense_type.split("_")
+        return " ".join(part if part == "ES" else part.title() for part in parts)
+    return defense_type.title()
+
+def resolve_show_block_style(style, is_endgame, defense_type, slot):
+    """Get the style generate_show_block applies to a defense item"""
+    # Only determine style for non-foci defense items
+    if not is_endgame and slot.upper() != "FOCI":
+        if "_" in defense_type:
+            # Handle hybrid defense styles
+            return f"Leveling {get_defense_name(defense_type)}"
+        elif defense_type.upper() == "ES":
+            return "Leveling ES"
+        else:
+            return f"Leveling {get_defense_name(defense_type)}"
+    return style
+
 def generate_show_block(item_name, style, min_level, max_level, is_endgame, settings, defense_type, slot):
     """Generate a show block with appropriate style settings"""
     block_lines = []
     
     # Format the defense type and slot for the header
-    if defense_type.upper() == "ES":
-        defense_name = "ES"
-    elif "_" in defense_type:
-        # Handle hybrid defenses
-        parts = defense_type.split("_")
-        defense_name = " ".join(part if part == "ES" else part.title() for part in parts)
-    else:
-        defense_name = defense_type.title()
+    defense_name = get_defense_name(defense_type)
     slot_name = slot.upper()
     
     # Add comment header with correct defense type and slot
@@ -677,46 +1040,15 @@ def generate_show_block(item_name, style, min_level, max_level, is_endgame, sett
     if not is_endgame and max_level:
         block_lines.append(f"AreaLevel <= {max_level}")
     
-    # Only determine style for non-foci defense items
-    if not is_endgame and slot.upper() != "FOCI":
-        if "_" in defense_type:
-            # Handle hybrid defense styles
-            style = f"Leveling {defense_name}"
-        elif defense_type.upper() == "ES":
-            style = "Leveling ES"
-        else:
-            style = f"Leveling {defense_name}"
+    style = resolve_show_block_style(style, is_endgame, defense_type, slot)
     
     # Add style settings from parsed settings file
-    if style in settings.styles:
-        logger.debug(f"Applying style '{style}' to {item_name}")
-        style_settings = settings.styles[style]
-        
-        # Handle minimap icon settings separately
-        minimap_size = None
-        minimap_color = None
-        minimap_shape = None
-        other_settings = []
-        
-        for setting, value in style_settings.items():
-            if setting == "MinimapIconSize":
-                size_map = {"Small": "0", "Medium": "1", "Large": "2"}
-                minimap_size = size_map.get(value, "1")
-            elif setting == "MinimapIconColour":
-                minimap_color = value
-            elif setting == "MinimapIconShape":
-                minimap_shape = value
-            else:
-                other_settings.append(f"{setting} {value}")
-        
-        # Add combined MinimapIcon line immediately after AreaLevel
-        if all([minimap_size, minimap_color, minimap_shape]):
-            block_lines.append(f"MinimapIcon {minimap_size} {minimap_color} {minimap_shape}")
-        
-        # Add all other style settings
-        block_lines.extend(other_settings)
+    if style in settings.style_fragments:
+        logger.debug("Applying style '%s' to %s", style, item_name)
+        if settings.style_fragments[style]:
+            block_lines.append(settings.style_fragments[style])
     else:
-        logger.warning(f"Style '{style}' not found in settings. Available styles: {list(settings.styles.keys())}")
+        logger.warning("Style '%s' not found in settings. Available styles: %s", style, list(settings.styles.keys()))
         
     return "\n".join(block_lines) + "\n\n"
 
@@ -728,11 +1060,449 @@ Rarity <= Magic
 
 """
 
+# Filter sections in output order, see write_filter
+SECTION_ENDGAME_T1 = "endgame_t1"
+SECTION_ENDGAME_T2 = "endgame_t2"
+SECTION_SKILL = "skill"
+SECTION_QUIVER = "quiver"
+SECTION_LEVELING = "leveling"
+SECTION_HIDE = "hide"
+
+# Hide block sources in output order, the first element of a hide block's order
+HIDE_SOURCE_NAMES = {
+    0: "DEFENSE",
+    1: "MARTIAL WEAPON",
+    2: "SKILL WEAPON",
+    3: "QUIVER"
+}
+
+def consolidate_hide_blocks(blocks: List[Tuple[int, str]]) -> List[str]:
+    """Merge hide blocks with identical conditions into one multi-BaseType block per source.
+
+    Takes (source, block) pairs in output order. Hide blocks only differ in
+    their BaseType, so the whole hide section collapses into a few blocks.
+    """
+    groups = {}  # key: (source, condition lines), value: base types in insertion order
+    for source, block in blocks:
+        base_types = []
+        conditions = []
+        for line in block.splitlines():
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("BaseType "):
+                base_types.extend(re.findall(r'"[^"]*"', line))
+            else:
+                conditions.append(line)
+        group = groups.setdefault((source, tuple(conditions)), {})
+        group.update(dict.fromkeys(base_types))
+    
+    consolidated = []
+    for (source, conditions), base_types in groups.items():
+        lines = [f"# HIDDEN {HIDE_SOURCE_NAMES.get(source, 'OTHER')} BASES"]
+        lines.append(conditions[0] if conditions else "Hide")
+        lines.append(f"BaseType {' '.join(base_types)}")
+        lines.extend(conditions[1:])
+        consolidated.append("\n".join(lines) + "\n\n")
+    return consolidated
+
+def report_hide_consolidation(blocks: List[str], consolidated: List[str]):
+    """Print the hide block and line counts before and after consolidation"""
+    lines_before = sum(block.count("\n") for block in blocks)
+    lines_after = sum(block.count("\n") for block in consolidated)
+    print(f"Consolidated {len(blocks)} hide blocks ({lines_before} lines) into "
+          f"{len(consolidated)} blocks ({lines_after} lines)")
+
+def coalesce_leveling_blocks(blocks: List[str]) -> List[str]:
+    """Merge rendered leveling show blocks that only differ in their BaseType.
+
+    Takes the blocks in output order. Blocks with the same AreaLevel cap and
+    style lines, e.g. of different settings keys, become one block at the
+    position of the first, so it lists the bases of every key that is on.
+    A block is never moved in front of a block listing one of its bases, so
+    every base is still decided by the same conditions and style.
+    """
+    groups: Dict[Tuple[str, ...], int] = {}  # key: condition and style lines, value: merged block index
+    merged: List[Tuple[List[str], Dict[str, None], Tuple[str, ...]]] = []
+    positions: Dict[str, int] = {}  # key: base type, value: last merged block listing it
+    for block in blocks:
+        headers = []
+        base_types = []
+        conditions = []
+        for line in block.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                headers.append(line)
+            elif line.startswith("BaseType "):
+                base_types.extend(re.findall(r'"[^"]*"', line))
+            else:
+                conditions.append(line)
+        key = tuple(conditions)
+        index = groups.get(key)
+        if index is None or any(positions.get(base_type, -1) > index for base_type in base_types):
+            index = groups[key] = len(merged)
+            merged.append(([], {}, key))
+        block_headers, block_base_types, _ = merged[index]
+        block_headers.extend(header for header in headers if header not in block_headers)
+        block_base_types.update(dict.fromkeys(base_types))
+        for base_type in base_types:
+            positions[base_type] = max(positions.get(base_type, -1), index)
+
+    coalesced = []
+    for headers, base_types, conditions in merged:
+        lines = headers + [conditions[0] if conditions else "Show", f"BaseType {' '.join(base_types)}"]
+        lines.extend(conditions[1:])
+        coalesced.append("\n".join(lines) + "\n\n")
+    if len(coalesced) < len(blocks):
+        print(f"Coalesced {len(blocks)} leveling blocks into {len(coalesced)}")
+    return coalesced
+
+class LevelingBlockGroups:
+    """Leveling bases of one settings key grouped into AreaLevel-bounded show blocks.
+
+    A block ends at a single AreaLevel <= cap, so bases share one when they
+    have the same settings key, style and cap; the merged block then decides
+    every base exactly like a block of its own. Bases of different slots
+    share blocks too, slots are kept for block headers and the report.
+    Blocks of different keys are merged after rendering, when the keys that
+    are on are known, see coalesce_leveling_blocks.
+    """
+    def __init__(self):
+        self.groups: Dict[Tuple[str, str, Optional[int]], List[BaseItem]] = {}
+        self.group_slots: Dict[Tuple[str, str, Optional[int]], List[str]] = {}
+
+    def add(self, setting_key: str, style: str, slot: str, item: BaseItem) -> bool:
+        """Add a base to the group of its key, style and cap; return True if this created the group."""
+        key = (setting_key, style, item.max_area_level)
+        created = key not in self.groups
+        if created:
+            self.groups[key] = []
+            self.group_slots[key] = []
+        self.groups[key].append(item)
+        self.group_slots[key].append(slot)
+        return created
+
+    def group(self, setting_key: str, style: str, item: BaseItem) -> Tuple[List[BaseItem], List[str]]:
+        """Get the bases and their slots of the group an item was added to."""
+        key = (setting_key, style, item.max_area_level)
+        return self.groups[key], self.group_slots[key]
+
+    def report(self):
+        """Print the leveling block count per slot against one block per base"""
+        if not self.groups:
+            return
+        slot_bases = {}
+        slot_blocks = {}
+        for slots in self.group_slots.values():
+            for slot in slots:
+                slot_bases[slot] = slot_bases.get(slot, 0) + 1
+            for slot in set(slots):
+                slot_blocks[slot] = slot_blocks.get(slot, 0) + 1
+        print(f"Consolidated {sum(slot_bases.values())} leveling bases into {len(self.groups)} blocks")
+        for slot, bases in slot_bases.items():
+            blocks = slot_blocks[slot]
+            print(f"  {slot.upper()}: {bases} bases in {blocks} blocks ({bases - blocks} fewer)")
+
+class FilterBlockUnit:
+    """The filter blocks controlled by a single settings key.
+
+    A unit renders its show blocks when the key is True and its hide blocks
+    otherwise. Every block has a fixed section and sort order, so units can
+    be re-rendered on their own and reassembled exactly like a full build.
+    bases are the items the key decides.
+    """
+    def __init__(self, setting_key: str):
+        self.setting_key = setting_key
+        self.styles = set()
+        self.show_blocks = []
+        self.hide_blocks = []
+        self.bases: List[BaseItem] = []
+
+    def add_show(self, section: str, order: Tuple, render, style: Optional[str] = None):
+        """Add a show block; render is called with the FilterSettings."""
+        self.show_blocks.append((section, order, render))
+        if style:
+            self.styles.add(style)
+
+    def add_hide(self, section: str, order: Tuple, render):
+        """Add a hide block; render is called with the FilterSettings."""
+        self.hide_blocks.append((section, order, render))
+
+    def blocks(self, shown: bool) -> List[Tuple]:
+        return self.show_blocks if shown else self.hide_blocks
+
+    def render(self, settings: FilterSettings, shown: bool) -> List[Tuple[str, Tuple, str]]:
+        return [(section, order, render(settings)) for section, order, render in self.blocks(shown)]
+
+def get_unit(units: Dict[str, FilterBlockUnit], setting_key: str) -> FilterBlockUnit:
+    """Get the unit for a settings key, creating it on first use."""
+    unit = units.get(setting_key)
+    if unit is None:
+        unit = units[setting_key] = FilterBlockUnit(setting_key)
+    return unit
+
+class SettingsKeyRegistry:
+    """Interned ids of the settings keys that decide a list of block units.
+
+    Built once from the units, so a profile resolves to a bitset of the ids
+    it shows and each unit is decided by a bit test instead of a string
+    lookup. Settings files are checked against it for keys that match no
+    base and for bases whose key they never set, which are always hidden.
+    """
+    def __init__(self, units: List[FilterBlockUnit]):
+        self.ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.base_counts: List[int] = []
+        self.unit_ids = [self.intern(unit.setting_key) for unit in units]
+        for unit, key_id in zip(units, self.unit_ids):
+            self.base_counts[key_id] += len(unit.bases)
+
+    def intern(self, key: str) -> int:
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+            self.base_counts.append(0)
+        return key_id
+
+    def decisions(self, show_settings: Dict[str, bool]) -> int:
+        """Get the bitset of the key ids the settings show."""
+        shown = 0
+        for key, value in show_settings.items():
+            key_id = self.ids.get(key)
+            if value and key_id is not None:
+                shown |= 1 << key_id
+        return shown
+
+    @staticmethod
+    def changed_ids(before: int, after: int) -> List[int]:
+        """Get the key ids decided differently by two bitsets."""
+        changed = before ^ after
+        ids = []
+        while changed:
+            low = changed & -changed
+            ids.append(low.bit_length() - 1)
+            changed ^= low
+        return ids
+
+    def unknown_keys(self, settings: FilterSettings) -> List[str]:
+        """Get the keys of the settings that match no base."""
+        return [key for key in settings.show_settings
+                if key and key not in self.ids and key not in GLOBAL_SETTINGS]
+
+    def unset_keys(self, settings: FilterSettings) -> List[str]:
+        """Get the keys of bases that the settings never set."""
+        return [key for key, count in zip(self.keys, self.base_counts)
+                if count and key not in settings.show_settings]
+
+    def report(self, settings: FilterSettings, name: str):
+        """Print the keys of a settings file that match no base and the bases it cannot show"""
+        unknown = self.unknown_keys(settings)
+        if unknown:
+            print(f"{name}: {len(unknown)} settings keys match no base: {', '.join(unknown)}")
+        unset = self.unset_keys(settings)
+        if unset:
+            bases = sum(self.base_counts[self.ids[key]] for key in unset)
+            print(f"{name}: {bases} bases are always hidden, their settings keys are missing: {', '.join(unset)}")
+
+class FilterBuild:
+    """Rendered blocks of every FilterBlockUnit and the settings they used.
+
+    render() compares the new settings against the previous ones and only
+    re-renders units whose settings key or one of whose styles changed.
+    With a block cache, units whose blocks were rendered before, in this or
+    an earlier run, are taken from it instead of being rendered again.
+    """
+    def __init__(self, units: List[FilterBlockUnit], block_cache: Optional["BlockCache"] = None):
+        self.units = units
+        self.block_cache = block_cache
+        self.identities: List[Optional[str]] = [None] * len(units)
+        self.registry = SettingsKeyRegistry(units)
+        self.units_by_key: List[List[int]] = [[] for _ in self.registry.keys]
+        self.units_by_style: Dict[str, List[int]] = {}
+        for index, unit in enumerate(units):
+            self.units_by_key[self.registry.unit_ids[index]].append(index)
+            for style in unit.styles:
+                self.units_by_style.setdefault(style, []).append(index)
+        self.show_settings: Dict[str, bool] = {}
+        self.decisions = 0
+        self.styles: Dict[str, Dict[str, str]] = {}
+        self.rendered: List[Optional[List[Tuple[str, Tuple, str]]]] = [None] * len(units)
+        self.units_rendered = 0
+        self.units_cached = 0
+
+    def affected_units(self, settings: FilterSettings, decisions: int) -> List[int]:
+        """Get the units whose output may differ under the new settings and their decisions."""
+        if any(blocks is None for blocks in self.rendered):
+            return list(range(len(self.units)))
+
+        affected = set()
+        for key_id in self.registry.changed_ids(self.decisions, decisions):
+            affected.update(self.units_by_key[key_id])
+        for style in set(self.styles) | set(settings.styles):
+            if self.styles.get(style) != settings.styles.get(style):
+                affected.update(self.units_by_style.get(style, []))
+        return sorted(affected)
+
+    def render(self, settings: FilterSettings) -> int:
+        """Render the units affected by the settings and return how many were rendered."""
+        decisions = self.registry.decisions(settings.show_settings)
+        affected = self.affected_units(settings, decisions)
+        self.units_cached = 0
+        for index in affected:
+            shown = bool(decisions >> self.registry.unit_ids[index] & 1)
+            self.rendered[index] = self.render_unit(index, settings, shown)
+        self.show_settings = dict(settings.show_settings)
+        self.decisions = decisions
+        self.styles = {name: dict(style) for name, style in settings.styles.items()}
+        self.units_rendered = len(affected)
+        logger.debug("Rendered %s of %s filter block units (%s from the block cache)", len(affected),
+                     len(self.units), self.units_cached)
+        return len(affected)
+
+    def render_unit(self, index: int, settings: FilterSettings, shown: bool) -> List[Tuple[str, Tuple, str]]:
+        """Render a unit, taking its blocks from the block cache if they were rendered before."""
+        unit = self.units[index]
+        if self.block_cache is None:
+            return unit.render(settings, shown)
+        blocks = unit.blocks(shown)
+        key = self.block_key(index, shown, settings)
+        texts = self.block_cache.get(key)
+        if texts is None or len(texts) != len(blocks):
+            texts = [render(settings) for _, _, render in blocks]
+            self.block_cache.put(key, texts)
+        else:
+            self.units_cached += 1
+        return [(section, order, text) for (section, order, _), text in zip(blocks, texts)]
+
+    def block_key(self, index: int, shown: bool, settings: FilterSettings) -> str:
+        """Key the blocks of a unit by its bases, whether it is shown and the style fragments it uses."""
+        if self.identities[index] is None:
+            unit = self.units[index]
+            bases = [(type(item).__name__, item.category.value, item.file_type,
+                      tuple(getattr(item, name) for name in item_fields(type(item)))) for item in unit.bases]
+            self.identities[index] = repr((unit.setting_key, bases))
+        fragments = [settings.style_fragments.get(style) for style in sorted(self.units[index].styles)] if shown else None
+        key = repr((BLOCK_CACHE_VERSION, self.identities[index], shown, fragments))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def ordered_blocks(self, section: str) -> List[Tuple[Tuple, str]]:
+        """Get the (order, block) pairs of a section in output order."""
+        blocks = [(order, block)
+                  for rendered in self.rendered if rendered
+                  for block_section, order, block in rendered
+                  if block_section == section]
+        blocks.sort(key=lambda x: x[0])
+        return blocks
+
+    def blocks(self, section: str) -> List[str]:
+        return [block for _, block in self.ordered_blocks(section)]
+
+    def load_state(self, state_path: str, signature: str) -> bool:
+        """Restore a previous build of the same units from disk."""
+        if not os.path.exists(state_path):
+            return False
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable build state %s: %s", state_path, e)
+            return False
+        if state.get("signature") != signature or len(state.get("rendered", [])) != len(self.units):
+            return False
+        self.show_settings = state["show_settings"]
+        self.decisions = self.registry.decisions(self.show_settings)
+        self.styles = state["styles"]
+        self.rendered = [[(section, tuple(order), block) for section, order, block in rendered]
+                         for rendered in state["rendered"]]
+        return True
+
+    def save_state(self, state_path: str, signature: str):
+        """Write the build to disk for the next incremental regeneration."""
+        temp_path = state_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "signature": signature,
+                "show_settings": self.show_settings,
+                "styles": self.styles,
+                "rendered": self.rendered
+            }, f)
+        os.replace(temp_path, state_path)
+
+class BlockCache:
+    """Persistent content-addressed cache of rendered unit blocks, see FilterBuild.block_key.
+
+    Blocks are keyed by the bases of their unit, its settings key, whether
+    it is shown, the style fragments it uses and BLOCK_CACHE_VERSION, so
+    they stay valid across profiles and runs. Entries are kept in least
+    recently used order and the oldest are evicted on save once the cached
+    blocks exceed max_bytes.
+    """
+    def __init__(self, cache_path: Optional[str] = None, max_bytes: int = BLOCK_CACHE_BYTES):
+        self.cache_path = cache_path or os.path.join(SCRIPT_DIR, BLOCK_CACHE)
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Load the cached blocks, discarding them if unreadable or outdated."""
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable block cache %s: %s", self.cache_path, e)
+            return
+        if data.get("version") != BLOCK_CACHE_VERSION:
+            logger.debug("Block cache version changed, discarding %s", self.cache_path)
+            return
+        self.entries = OrderedDict(data.get("entries", []))
+
+    def get(self, key: str) -> Optional[List[str]]:
+        blocks = self.entries.get(key)
+        if blocks is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if next(reversed(self.entries)) != key:
+            self.entries.move_to_end(key)
+            self._dirty = True
+        return blocks
+
+    def put(self, key: str, blocks: List[str]):
+        self.entries[key] = blocks
+        self.entries.move_to_end(key)
+        self._dirty = True
+
+    def evict(self):
+        """Drop the least recently used entries until the blocks fit in max_bytes."""
+        size = sum(len(block) for blocks in self.entries.values() for block in blocks)
+        while size > self.max_bytes and self.entries:
+            _, blocks = self.entries.popitem(last=False)
+            size -= sum(map(len, blocks))
+            self._dirty = True
+
+    def save(self):
+        """Write the cache back to disk if anything changed."""
+        self.evict()
+        if not self._dirty:
+            return
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": BLOCK_CACHE_VERSION, "entries": list(self.entries.items())}, f)
+        os.replace(temp_path, self.cache_path)
+        self._dirty = False
+
 class FilterGenerator:
-    def __init__(self, base_dir, filter_dir, settings):
+    def __init__(self, base_dir, filter_dir, settings, catalog=None, tiers=None):
         self.base_dir = base_dir
         self.filter_dir = filter_dir
         self.settings = settings
+        self.catalog = catalog
         self.defense_parser = DefenseBaseParser()
         self.show_blocks = {
             "endgame_t1": [],
@@ -741,12 +1511,14 @@ class FilterGenerator:
         }
         self.hide_blocks = []
         self.endgame_items = {}
+        self.tier_index = DefenseTierIndex(tiers)
+        self.units: Dict[str, FilterBlockUnit] = {}
+        self.leveling_groups = LevelingBlockGroups()
+        self._item_count = 0
 
     def process_defense_bases(self):
         """Process all defense base types"""
-        defense_slots = ["body", "helmet", "gloves", "boots", "shields", "foci"]
-        
-        for slot in defense_slots:
+        for slot in DEFENSE_SLOTS:
             slot_dir = os.path.join(self.base_dir, slot)
             if not os.path.exists(slot_dir):
                 continue
@@ -764,58 +1536,34 @@ class FilterGenerator:
         if not os.path.exists(file_path):
             return
         
-        current_block = []
+        # Convert defense type for settings lookup
+        defense_settings_type = settings_defense_type(defense_type)
         
-        with open(file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                
-                if not line:
-                    if current_block:
-                        # Convert defense type for settings lookup
-                        settings_defense_type = defense_type
-                        
-                        # Handle hybrid defense types
-                        if defense_type.lower() == "armoures":
-                            settings_defense_type = "ARMOUR_ES"
-                        elif defense_type.lower() == "armourevasion":
-                            settings_defense_type = "ARMOUR_EVASION"
-                        elif defense_type.lower() == "evasiones":
-                            settings_defense_type = "EVASION_ES"
-                        
-                        self.process_defense_block(current_block, slot, settings_defense_type)
-                        current_block = []
-                    continue
-                
-                current_block.append(line)
-                
-        # Process last block if it exists
-        if current_block:
-            settings_defense_type = defense_type
-            if defense_type.lower() == "armoures":
-                settings_defense_type = "ARMOUR_ES"
-            elif defense_type.lower() == "armourevasion":
-                settings_defense_type = "ARMOUR_EVASION"
-            elif defense_type.lower() == "evasiones":
-                settings_defense_type = "EVASION_ES"
-            
-            self.process_defense_block(current_block, slot, settings_defense_type)
+        with profiler.phase("defense parse"):
+            if self.catalog:
+                items = self.catalog.items_for(file_path, parse_defense_file)
+            else:
+                items = parse_defense_file(file_path)
+        
+        # Tiers are resolved while the blocks of each item are registered
+        with profiler.phase("tier resolution"):
+            self.tier_index.add_file(slot, defense_settings_type, file_path, items)
+            for item in items:
+                self.process_defense_block(item, slot, defense_settings_type)
 
-    def process_defense_block(self, lines, slot, defense_type):
-        """Process a single item block and generate filter block"""
-        first_line = lines[0]
-        item_name = first_line.split(" (")[0]
-        min_level, max_level, is_endgame = self.defense_parser.parse_area_level(first_line)
+    def process_defense_block(self, item, slot, defense_type):
+        """Process a single parsed defense item and generate filter block"""
+        item_name = item.name
+        min_level, max_level = item.min_area_level, item.max_area_level
+        is_endgame = item.open_ended
         
         if not min_level:
             return
         
-        values = self.defense_parser.get_defense_values(lines)
-        
         # Handle different item types
         if slot.upper() == "SHIELDS":
             if is_endgame:
-                tier = determine_defense_tier(values, slot, defense_type, self.base_dir)
+                tier = self.tier_index.lookup(slot, defense_type, item)
                 # Convert defense type to match settings format
                 shield_type = {
                     "ARMOUR": "ARMOUR",
@@ -831,7 +1579,7 @@ class FilterGenerator:
                 style = f"Leveling {defense_type.title()} Shield"
         elif slot.upper() == "FOCI":
             if is_endgame:
-                tier = determine_defense_tier(values, slot, defense_type, self.base_dir)
+                tier = self.tier_index.lookup(slot, defense_type, item)
                 settings_key = f"SHOW_ENDGAME_T{tier}_FOCI"
                 style = f"Endgame Tier {tier}"
             else:
@@ -839,115 +1587,56 @@ class FilterGenerator:
                 style = "Caster Weapon"  # Use Caster Weapon style for leveling foci
         else:
             if is_endgame:
-                tier = determine_defense_tier(values, slot, defense_type, self.base_dir)
+                tier = self.tier_index.lookup(slot, defense_type, item)
                 settings_key = f"SHOW_ENDGAME_T{tier}_{defense_type.upper()}"
                 style = f"Endgame Tier {tier}"
             else:
                 settings_key = f"SHOW_LEVELING_{defense_type.upper()}"
                 style = f"Leveling {defense_type.title()}"
         
-        logger.debug(f"Item: {item_name} | Settings key: {settings_key} | Style: {style}")
+        logger.debug("Item: %s | Settings key: %s | Style: %s", item_name, settings_key, style)
         
-        # Generate appropriate block based on settings
-        if settings_key in self.settings.show_settings and self.settings.show_settings[settings_key]:
-            if is_endgame:
-                # Store item name for consolidation
-                key = (slot, defense_type, tier if 'tier' in locals() else 1)
-                if key not in self.endgame_items:
-                    self.endgame_items[key] = []
-                self.endgame_items[key].append(item_name)
-            else:
-                block = generate_show_block(item_name, style, min_level, max_level, is_endgame, 
-                                      self.settings, defense_type, slot)
-                self.show_blocks["leveling"].append((min_level, block))
-        else:
-            logger.debug(f"Hiding {item_name} because {settings_key} is not True")
-            self.hide_blocks.append(generate_hide_block(item_name))
-
-    def get_shield_settings_key(self, defense_type, is_endgame):
-        """Get the appropriate settings key for shield items"""
+        # Register the show and hide blocks under the settings key
+        unit = get_unit(self.units, settings_key)
+        unit.bases.append(item)
+        index = self._item_count
+        self._item_count += 1
         if is_endgame:
-            if defense_type.upper() == "ARMOUR":
-                return "SHOW_ENDGAME_T1_ARMOUR_SHIELD"
-            elif defense_type.upper() == "EVASION":
-                return "SHOW_ENDGAME_T1_EVASION_SHIELD"
-            elif defense_type.upper() == "ARMOUR_EVASION":
-                return "SHOW_ENDGAME_T1_ARMOUR_EVASION_SHIELD"
-            elif defense_type.upper() == "ARMOUR_ES":
-                return "SHOW_ENDGAME_T1_ARMOUR_ES_SHIELD"
+            # Store item name for consolidation
+            key = (slot, defense_type, tier)
+            if key not in self.endgame_items:
+                self.endgame_items[key] = []
+                style = f"Endgame Tier {tier}"
+                section = SECTION_ENDGAME_T1 if tier == 1 else SECTION_ENDGAME_T2
+                unit.add_show(section, (0, len(self.endgame_items)), 
+                              lambda settings, items=self.endgame_items[key], style=style:
+                                  generate_consolidated_show_block(items, style, slot, defense_type, settings),
+                              style)
+            self.endgame_items[key].append(item_name)
         else:
-            if defense_type.upper() == "ARMOUR":
-                return "SHOW_LEVELING_ARMOUR_SHIELD"
-            elif defense_type.upper() == "EVASION":
-                return "SHOW_LEVELING_EVASION_SHIELD"
-            elif defense_type.upper() == "ARMOUR_EVASION":
-                return "SHOW_LEVELING_ARMOUR_EVASION_SHIELD"
-            elif defense_type.upper() == "ARMOUR_ES":
-                return "SHOW_LEVELING_ARMOUR_ES_SHIELD"
+            style = resolve_show_block_style(style, is_endgame, defense_type, slot)
+            if self.leveling_groups.add(settings_key, style, slot, item):
+                group, slots = self.leveling_groups.group(settings_key, style, item)
+                unit.add_show(SECTION_LEVELING, (-(max_level or min_level), 0, len(self.leveling_groups.groups)),
+                              lambda settings, group=group, style=style, slots=slots:
+                                  generate_leveling_show_block(group, style, slots, defense_type, settings),
+                              style)
+        unit.add_hide(SECTION_HIDE, (0, index), lambda settings: generate_hide_block(item_name))
 
     def generate_consolidated_blocks(self):
-        """Generate consolidated blocks for endgame items"""
-        for (slot, defense_type, tier), items in self.endgame_items.items():
-            style = f"Endgame Tier {tier}"
-            block = generate_consolidated_show_block(items, style, slot, defense_type, self.settings)
-            if tier == 1:
-                self.show_blocks["endgame_t1"].append(block)
-            else:
-                self.show_blocks["endgame_t2"].append(block)
+        """Render the defense units into show and hide blocks"""
+        build = FilterBuild(list(self.units.values()))
+        build.render(self.settings)
+        self.show_blocks["endgame_t1"] = build.blocks(SECTION_ENDGAME_T1)
+        self.show_blocks["endgame_t2"] = build.blocks(SECTION_ENDGAME_T2)
+        self.show_blocks["leveling"] = [(-order[0], block) for order, block in build.ordered_blocks(SECTION_LEVELING)]
+        self.hide_blocks = build.blocks(SECTION_HIDE)
 
     def generate_filter(self):
-        """Generate the complete filter file"""
-        try:
-            temp_path = os.path.join(SCRIPT_DIR, FILTER_TEMP)
-            with open(temp_path, 'w') as f:
-                # Write endgame T1 blocks
-                f.write("### Endgame Tier 1 Show Blocks ###\n")
-                for block in self.show_blocks["endgame_t1"]:
-                    f.write(block)
-                    
-                # Write endgame T2 blocks
-                f.write("\n### Endgame Tier 2 Show Blocks ###\n")
-                for block in self.show_blocks["endgame_t2"]:
-                    f.write(block)
-                    
-                # Write leveling blocks in descending order
-                f.write("\n### Leveling Show Blocks ###\n")
-                sorted_leveling = sorted(self.show_blocks["leveling"], 
-                                      key=lambda x: x[0], 
-                                      reverse=True)
-                for _, block in sorted_leveling:
-                    f.write(block)
-                    
-                # Write rare safeguard
-                f.write("\n### Rare Item Safeguard ###\n")
-                f.write("Show\nRarity >= Rare\n\n")
-                
-                # Include base filter
-                base_filter_path = os.path.join(SCRIPT_DIR, FILTER_BASE)
-                if os.path.exists(base_filter_path):
-                    with open(base_filter_path, 'r') as bf:
-                        f.write(bf.read())
-                        
-                # Write hide blocks
-                write_hide_blocks = True
-                settings_path = os.path.join(SCRIPT_DIR, 'filtersettings.txt')
-                with open(settings_path, 'r') as settings_file:
-                    for line in settings_file:
-                        if line.strip().startswith('HIDE_UNSHOWN_ITEMS'):
-                            write_hide_blocks = 'True' in line
-                            break
-                
-                if write_hide_blocks:
-                    f.write("\n### Hide Blocks ###\n")
-                    for block in self.hide_blocks:
-                        f.write(block)
-                    
-            # Rename temp file to final output
-            output_path = os.path.join(SCRIPT_DIR, FILTER_OUTPUT)
-            os.replace(temp_path, output_path)
-        except Exception as e:
-            logger.error(f"Error generating filter: {e}")
-            raise
+        """Generate a filter from the defense blocks only"""
+        build = FilterBuild(list(self.units.values()))
+        build.render(self.settings)
+        write_filter(build)
 
 def generate_consolidated_show_block(items, style, slot, defense_type, settings):
     """Generate a show block for multiple items with the same tier and slot"""
@@ -961,50 +1650,45 @@ def generate_consolidated_show_block(items, style, slot, defense_type, settings)
     base_types = '" "'.join(items)
     block_lines.append(f'BaseType "{base_types}"')
     
-    # Add style settings with correct MinimapIcon format
-    if style in settings.styles:
-        style_settings = settings.styles[style]
-        
-        # Convert MinimapIcon settings
-        icon_size = style_settings.get("MinimapIconSize", "")
-        icon_color = style_settings.get("MinimapIconColour", "")
-        icon_shape = style_settings.get("MinimapIconShape", "")
-        
-        if icon_size and icon_color and icon_shape:
-            size_value = {"Large": "0", "Medium": "1", "Small": "2"}.get(icon_size, "0")
-            block_lines.append(f"MinimapIcon {size_value} {icon_color} {icon_shape}")
-        
-        # Add other style settings
-        for setting, value in style_settings.items():
-            if not setting.startswith("MinimapIcon"):  # Skip individual minimap settings
-                block_lines.append(f"{setting} {value}")
+    # Add compiled style settings
+    if settings.style_fragments.get(style):
+        block_lines.append(settings.style_fragments[style])
                 
     return "\n".join(block_lines) + "\n\n"
 
+def generate_leveling_show_block(items, style, slots, defense_type, settings):
+    """Generate a show block for leveling items sharing a style and area level cap"""
+    block_lines = []
+    
+    # Add header with every slot of the items and their combined level range
+    min_level = min(item.min_area_level for item in items)
+    max_level = items[0].max_area_level
+    slot_names = "/".join(dict.fromkeys(slot.upper() for slot in slots))
+    block_lines.append(f"# LEVELING {get_defense_name(defense_type)} {slot_names} (Area Level {min_level}-{max_level})")
+    
+    # Add show statement, combined base types and the shared area level cap
+    block_lines.append("Show")
+    base_types = '" "'.join(item.name for item in items)
+    block_lines.append(f'BaseType "{base_types}"')
+    if max_level:
+        block_lines.append(f"AreaLevel <= {max_level}")
+    
+    # Add style settings from parsed settings file
+    if style in settings.style_fragments:
+        if settings.style_fragments[style]:
+            block_lines.append(settings.style_fragments[style])
+    else:
+        logger.warning("Style '%s' not found in settings. Available styles: %s", style, list(settings.styles.keys()))
+        
+    return "\n".join(block_lines) + "\n\n"
+
 class WeaponFilterGenerator(FilterBlockGenerator):
     def __init__(self, settings: FilterSettings):
         super().__init__(settings)
         
     def _get_weapon_type(self, item: BaseItem) -> str:
         """Get the weapon type from filepath."""
-        if not item._filepath:
-            return "UNKNOWN"
-        
-        # Normalize path separators
-        filepath = item._filepath.replace('\\', '/')
-        
-        # Extract filename without extension
-        filename = os.path.splitext(os.path.basename(filepath))[0].upper()
-        
-        # Handle special cases
-        if "ONEHANDMACES" in filename:
-            return "ONE_HAND_MACES"
-        elif "TWOHANDMACES" in filename:
-            return "TWO_HAND_MACES"
-        elif "QUARTERSTAVES" in filename:
-            return "QUARTERSTAVES"
-        
-        return filename
+        return WEAPON_TYPE_NAMES.get(item.file_type, item.file_type)
 
     def _create_header(self, item: BaseItem) -> str:
         """Create the descriptive header comment."""
@@ -1012,12 +1696,7 @@ class WeaponFilterGenerator(FilterBlockGenerator):
         
         # Handle skill weapons differently
         if isinstance(item, SkillWeaponItem) and item.granted_skill:
-            weapon_type = (
-                'WANDS' if 'wands' in item._filepath.lower() else
-                'STAVES' if 'staves' in item._filepath.lower() else
-                'SCEPTRES' if 'sceptres' in item._filepath.lower() else
-                'UNKNOWN'
-            )
+            weapon_type = item.file_type if item.file_type in SKILL_WEAPON_TYPES else 'UNKNOWN'
             return f"# {item.granted_skill.upper()} {weapon_type}"
             
         # Handle quivers
@@ -1045,8 +1724,8 @@ class WeaponFilterGenerator(FilterBlockGenerator):
         
         # Add header comment
         if isinstance(item, WeaponItem) and not isinstance(item, (SkillWeaponItem, QuiverItem)):
-            if "+" in item.area_level:  # Endgame item
-                tier_str = f"T{item.tier}" if hasattr(item, 'tier') else ""
+            if item.open_ended:  # Endgame item
+                tier_str = f"T{item.tier}"
                 lines.append(f"# ENDGAME {tier_str} {self._get_weapon_type(item)} ({item.area_level})")
             else:  # Leveling item
                 lines.append(f"# LEVELING {self._get_weapon_type(item)} ({item.area_level})")
@@ -1060,42 +1739,12 @@ class WeaponFilterGenerator(FilterBlockGenerator):
         lines.append(f'BaseType "{item.name}"')
         
         # Add area level condition for leveling items that are being shown
-        if show and not "+" in item.area_level and item.area_level:
-            try:
-                level_match = re.search(r'(?:Area Level )?(\d+)-(\d+)', item.area_level)
-                if level_match:
-                    max_level = int(level_match.group(2))
-                    lines.append(f"AreaLevel <= {max_level}")
-            except Exception as e:
-                print(f"Warning: Could not parse area level from {item.area_level}: {e}")
+        if show and item.max_area_level is not None:
+            lines.append(f"AreaLevel <= {item.max_area_level}")
         
         # Add style if showing
-        if show and style in self.settings.styles:
-            style_dict = self.settings.styles[style]
-            
-            # Process minimap icon settings separately
-            minimap_size = None
-            minimap_colour = None
-            minimap_shape = None
-            
-            style_lines = []
-            for key, value in style_dict.items():
-                if key == "MinimapIconSize":
-                    # Correct mapping: Large = 0, Medium = 1, Small = 2
-                    size_map = {"Large": "0", "Medium": "1", "Small": "2"}
-                    minimap_size = size_map.get(value, "1")
-                elif key == "MinimapIconColour":
-                    minimap_colour = value
-                elif key == "MinimapIconShape":
-                    minimap_shape = value
-                else:
-                    style_lines.append(f"{key} {value}")
-            
-            # Add minimap icon line if all components are present
-            if all([minimap_size, minimap_colour, minimap_shape]):
-                style_lines.insert(0, f"MinimapIcon {minimap_size} {minimap_colour} {minimap_shape}")
-            
-            lines.extend(style_lines)
+        if show and self.settings.style_fragments.get(style):
+            lines.append(self.settings.style_fragments[style])
             
         # Add rarity condition for hide blocks
         if not show:
@@ -1107,198 +1756,118 @@ class WeaponFilterGenerator(FilterBlockGenerator):
         
         return "\n".join(lines)
 
-    def _format_style(self, style: Dict[str, str]) -> List[str]:
-        """Format style dictionary into filter syntax lines."""
-        # Process minimap icon settings separately
-        minimap_size = None
-        minimap_colour = None
-        minimap_shape = None
-        
-        lines = []
-        for key, value in style.items():
-            if key == "MinimapIconSize":
-                size_map = {"Large": "0", "Medium": "1", "Small": "2"}
-                minimap_size = size_map.get(value, "1")
-            elif key == "MinimapIconColour":
-                minimap_colour = value
-            elif key == "MinimapIconShape":
-                minimap_shape = value
-            else:
-                lines.append(f"{key} {value}")
-        
-        # Add minimap icon line if all components are present
-        if all([minimap_size, minimap_colour, minimap_shape]):
-            lines.insert(0, f"MinimapIcon {minimap_size} {minimap_colour} {minimap_shape}")
-            
-        return lines
-
-def parse_skill_weapon_file(filepath: str) -> List[SkillWeaponItem]:
+def parse_skill_weapon_file(filepath: str, data: Optional[bytes] = None) -> List[SkillWeaponItem]:
     """Parse a skill weapon file and return a list of SkillWeaponItem objects."""
     items = []
-    current_name = None
-    current_skill = None
-    
     
-    with open(filepath, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-                
-            
-            # Check if this is a weapon name line (doesn't start with space or keywords)
-            if not line.startswith(' ') and not line.startswith('Requires:') and not line.startswith('Spirit:') and not line.startswith('Grants Skill:'):
-                # If we have a complete weapon from previous iteration, add it
-                if current_name and current_skill:
-                    item = SkillWeaponItem(current_name, "1", filepath)
-                    item.skill_name = current_skill
-                    items.append(item)
-                
-                # Start new weapon
-                current_name = line
-                current_skill = None
-                
-            # Check if this is a skill grant line
-            elif 'Grants Skill:' in line:
-                current_skill = line.split('Grants Skill:')[1].strip()
-                
-    # Add the last item
-    if current_name and current_skill:
-        item = SkillWeaponItem(current_name, "1", filepath)
-        item.skill_name = current_skill
+    for record in iter_base_records(filepath, data):
+        # Only weapons that grant a skill are relevant
+        if not record.granted_skill:
+            continue
+        item = SkillWeaponItem(record.name, "1", filepath)
+        item.granted_skill = record.granted_skill
+        if "Spirit" in record.fields:
+            item.spirit = record.int_field("Spirit")
+        item.level_req = record.level_req
         items.append(item)
         
     return items
 
-def process_skill_weapon_blocks(items: List[SkillWeaponItem], settings: FilterSettings) -> Tuple[List[str], List[str]]:
-    """Process skill weapons and generate show/hide blocks based on their granted skills."""
-    generator = WeaponFilterGenerator(settings)
-    show_blocks = []
-    hide_blocks = []
+def generate_skill_weapon_show_block(weapon_type, skill_name, items, settings):
+    """Generate a consolidated show block for skill weapons granting the same skill"""
+    base_types = [f'"{item.name}"' for item in items]
+    
+    # Special header for Purity Sceptres
+    if skill_name == "Purity":
+        header = "# SCEPTRES - Purity"
+    else:
+        header = f"# {weapon_type} - {skill_name}"
+        
+    block = f"{header}\n"
+    block += "Show\n"
+    block += f'BaseType {" ".join(base_types)}\n'
+    
+    # Apply the Caster Weapon style from settings
+    if "Caster Weapon" in settings.style_fragments:
+        block += settings.style_fragments["Caster Weapon"]
+        block += "\n"
+    
+    block += "\n"
+    return block
+
+def generate_skill_weapon_hide_block(weapon_type, skill_name, item):
+    """Generate a hide block for a single skill weapon"""
+    block = f"# {weapon_type} - {skill_name}\n"
+    block += "Hide\n"
+    block += f'BaseType "{item.name}"\n'
+    block += "Rarity <= Magic\n\n"
+    return block
+
+def skill_weapon_block_units(items: List[SkillWeaponItem]) -> List[FilterBlockUnit]:
+    """Group skill weapons by their granted skills into filter block units."""
+    units = {}
     
     # Group items by weapon type and skill
     skill_groups = {}
     
     for item in items:
-        if 'wands' in item._filepath.lower():
-            weapon_type = 'WANDS'
-        elif 'staves' in item._filepath.lower():
-            weapon_type = 'STAVES'
-        elif 'sceptres' in item._filepath.lower():
-            weapon_type = 'SCEPTRES'
-        else:
+        weapon_type = item.file_type
+        if weapon_type not in SKILL_WEAPON_TYPES:
             continue
             
         # Special case for Purity Sceptres
-        if item.name == "Shrine Sceptre" and "Purity" in item.skill_name:
+        if item.name == "Shrine Sceptre" and "Purity" in item.granted_skill:
             key = ("SCEPTRES", "Purity")
             setting_key = "SHOW_PURITY_SCEPTRES"
         else:
-            key = (weapon_type, item.skill_name)
-            setting_key = f"SHOW_{item.skill_name.upper().replace(' ', '_')}_{weapon_type}"
+            key = (weapon_type, item.granted_skill)
+            setting_key = f"SHOW_{item.granted_skill.upper().replace(' ', '_')}_{weapon_type}"
             
         if key not in skill_groups:
             skill_groups[key] = {"items": [], "setting": setting_key}
         skill_groups[key]["items"].append(item)
     
-    # Create consolidated blocks for each group
-    for (weapon_type, skill_name), group in skill_groups.items():
-        if settings.show_settings.get(group["setting"], False):
-            items = group["items"]
-            base_types = [f'"{item.name}"' for item in items]
-            
-            # Special header for Purity Sceptres
-            if skill_name == "Purity":
-                header = "# SCEPTRES - Purity"
-            else:
-                header = f"# {weapon_type} - {skill_name}"
-                
-            block = f"{header}\n"
-            block += "Show\n"
-            block += f'BaseType {" ".join(base_types)}\n'
-            
-            # Apply the Caster Weapon style from settings
-            if "Caster Weapon" in settings.styles:
-                style_dict = settings.styles["Caster Weapon"]
-                
-                # Process minimap icon settings first
-                minimap_size = None
-                minimap_colour = None
-                minimap_shape = None
-                style_lines = []
-                
-                for key, value in style_dict.items():
-                    if key == "MinimapIconSize":
-                        size_map = {"Large": "0", "Medium": "1", "Small": "2"}
-                        minimap_size = size_map.get(value, "1")
-                    elif key == "MinimapIconColour":
-                        minimap_colour = value
-                    elif key == "MinimapIconShape":
-                        minimap_shape = value
-                    else:
-                        style_lines.append(f"{key} {value}")
-                
-                # Add minimap icon line first if all components are present
-                if all([minimap_size, minimap_colour, minimap_shape]):
-                    block += f"MinimapIcon {minimap_size} {minimap_colour} {minimap_shape}\n"
-                
-                # Add remaining style lines
-                block += "\n".join(style_lines)
-                block += "\n"
-            
-            block += "\n"
-            show_blocks.append(block)
-        else:
-            for item in group["items"]:
-                block = f"# {weapon_type} - {skill_name}\n"
-                block += "Hide\n"
-                block += f'BaseType "{item.name}"\n'
-                block += "Rarity <= Magic\n\n"
-                hide_blocks.append(block)
+    # Create a consolidated show block and per item hide blocks for each group
+    for group_index, ((weapon_type, skill_name), group) in enumerate(skill_groups.items()):
+        unit = get_unit(units, group["setting"])
+        group_items = group["items"]
+        unit.bases.extend(group_items)
+        unit.add_show(SECTION_SKILL, (group_index,),
+                      lambda settings, weapon_type=weapon_type, skill_name=skill_name, group_items=group_items:
+                          generate_skill_weapon_show_block(weapon_type, skill_name, group_items, settings),
+                      "Caster Weapon")
+        for item_index, item in enumerate(group_items):
+            unit.add_hide(SECTION_HIDE, (2, group_index, item_index),
+                          lambda settings, weapon_type=weapon_type, skill_name=skill_name, item=item:
+                              generate_skill_weapon_hide_block(weapon_type, skill_name, item))
     
-    return show_blocks, hide_blocks
+    return list(units.values())
 
-def parse_quiver_file(filepath: str) -> List[QuiverItem]:
+def process_skill_weapon_blocks(items: List[SkillWeaponItem], settings: FilterSettings) -> Tuple[List[str], List[str]]:
+    """Process skill weapons and generate show/hide blocks based on their granted skills."""
+    build = FilterBuild(skill_weapon_block_units(items))
+    build.render(settings)
+    return build.blocks(SECTION_SKILL), build.blocks(SECTION_HIDE)
+
+def parse_quiver_file(filepath: str, data: Optional[bytes] = None) -> List[QuiverItem]:
     """Parse a quiver file and return a list of QuiverItem objects."""
     items = []
-    current_name = None
-    current_effect = None
 
-    with open(filepath, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue            
-            # Check if this is a quiver name line (must end in "Quiver")
-            if line.endswith("Quiver"):
-                # If we have a complete quiver from previous iteration, add it
-                if current_name and current_effect:
-                    item = QuiverItem(current_name, "1", filepath)
-                    item.implicit_effect = current_effect
-                    items.append(item)
-                
-                # Start new quiver
-                current_name = line
-                current_effect = None
-            else:
-                # This must be an effect line
-                current_effect = line
-                
-    # Add the last item
-    if current_name and current_effect:
-        item = QuiverItem(current_name, "1", filepath)
-        item.implicit_effect = current_effect
+    for record in iter_base_records(filepath, data):
+        # Quiver names must end in "Quiver" and carry an implicit effect
+        if not record.name.endswith("Quiver") or not record.implicits:
+            continue
+        item = QuiverItem(record.name, "1", filepath)
+        item.implicit_effect = record.implicits[-1]
         items.append(item)
         
     return items
 
-def process_quiver_blocks(items: List[QuiverItem], settings: FilterSettings) -> Tuple[List[str], List[str]]:
-    """Process quiver items and return show/hide blocks."""
-    generator = WeaponFilterGenerator(settings)
-    show_blocks = []
-    hide_blocks = []
+def quiver_block_units(items: List[QuiverItem]) -> List[FilterBlockUnit]:
+    """Group quivers by their implicit effect into filter block units."""
+    units = {}
     
-    for item in items:
+    for index, item in enumerate(items):
         # Create setting key based on effect
         if "Physical Damage" in item.implicit_effect:
             setting_key = "SHOW_PHYSICAL_DAMAGE_QUIVER"
@@ -1324,217 +1893,1488 @@ def process_quiver_blocks(items: List[QuiverItem], settings: FilterSettings) ->
             setting_key = "SHOW_CRIT_CHANCE_QUIVER"
         else:
             continue
-        show = settings.show_settings.get(setting_key, False)
         
-        if show:
-            block = generator.create_block(item, True, "Leveling Martial Weapon")
-            show_blocks.append(block)
-        else:
-            block = generator.create_block(item, False)
-            hide_blocks.append(block)
+        unit = get_unit(units, setting_key)
+        unit.bases.append(item)
+        unit.add_show(SECTION_QUIVER, (index,),
+                      lambda settings, item=item:
+                          WeaponFilterGenerator(settings).create_block(item, True, "Leveling Martial Weapon"),
+                      "Leveling Martial Weapon")
+        unit.add_hide(SECTION_HIDE, (3, index),
+                      lambda settings, item=item: WeaponFilterGenerator(settings).create_block(item, False))
             
-    return show_blocks, hide_blocks
+    return list(units.values())
 
-def process_weapon_blocks(items: List[BaseItem], settings: FilterSettings) -> Tuple[Dict[str, List[str]], List[str]]:
-    """Process weapon items and return show/hide blocks."""
-    generator = WeaponFilterGenerator(settings)
-    show_blocks = {
-        "endgame_t1": [],
-        "endgame_t2": [],
-        "leveling": [],
-        "skill": [],
-        "quiver": []
-    }
-    hide_blocks = []
+def process_quiver_blocks(items: List[QuiverItem], settings: FilterSettings) -> Tuple[List[str], List[str]]:
+    """Process quiver items and return show/hide blocks."""
+    build = FilterBuild(quiver_block_units(items))
+    build.render(settings)
+    return build.blocks(SECTION_QUIVER), build.blocks(SECTION_HIDE)
+
+def weapon_block_units(items: List[BaseItem],
+                       leveling: Optional[LevelingBlockGroups] = None) -> List[FilterBlockUnit]:
+    """Group martial weapons by type and tier into filter block units.
 
-    # Group endgame weapons by type and tier
+    Leveling weapons are added to the leveling groups, if given, for the report.
+    """
+    generator = WeaponFilterGenerator(None)
+    units = {}
+    if leveling is None:
+        leveling = LevelingBlockGroups()
+
+    # Group endgame weapons by type and tier, leveling weapons by type and area level cap
     endgame_groups = {}  # key: (tier, weapon_type), value: list of items
-    leveling_groups = {}  # key: (weapon_type, max_level), value: list of items
+    leveling_style = "Leveling Martial Weapon"
     
     print(f"\nProcessing {len(items)} total items")
     
-    for item in items:
+    for index, item in enumerate(items):
         if isinstance(item, WeaponItem) and not isinstance(item, (SkillWeaponItem, QuiverItem)):
             weapon_type = generator._get_weapon_type(item)
-            is_endgame = "+" in item.area_level
-            
-            if is_endgame:
-                tier = getattr(item, 'tier', None)
-                if tier:
-                    setting_key = f"SHOW_ENDGAME_T{tier}_{weapon_type}"
-                    show = settings.show_settings.get(setting_key, False)
-                    
-                    if show:
-                        key = (tier, weapon_type)
-                        if key not in endgame_groups:
-                            endgame_groups[key] = []
-                        endgame_groups[key].append(item)
-                    else:
-                        hide_blocks.append(generator.create_block(item, False))
+            if item.open_ended:
+                tier = item.tier
+                if not tier:
+                    continue
+                setting_key = f"SHOW_ENDGAME_T{tier}_{weapon_type}"
+                unit = get_unit(units, setting_key)
+                key = (tier, weapon_type)
+                if key not in endgame_groups:
+                    endgame_groups[key] = []
+                    style = f"Endgame Tier {tier}"
+                    unit.add_show(f"endgame_t{tier}", (1, len(endgame_groups)),
+                                  lambda settings, group=endgame_groups[key], style=style:
+                                      WeaponFilterGenerator(settings).create_consolidated_block(group, True, style),
+                                  style)
+                endgame_groups[key].append(item)
             else:
                 setting_key = f"SHOW_LEVELING_{weapon_type}"
-                show = settings.show_settings.get(setting_key, False)
-                
-                if show:
-                    level_match = re.search(r'(?:Area Level )?(\d+)-(\d+)', item.area_level)
-                    if level_match:
-                        max_level = int(level_match.group(2))
-                        key = (weapon_type, max_level)
-                        if key not in leveling_groups:
-                            leveling_groups[key] = []
-                        leveling_groups[key].append(item)
-                else:
-                    hide_blocks.append(generator.create_block(item, False))
+                unit = get_unit(units, setting_key)
+                max_level = item.max_area_level
+                if max_level is not None:
+                    if leveling.add(setting_key, leveling_style, weapon_type, item):
+                        group, _ = leveling.group(setting_key, leveling_style, item)
+                        unit.add_show(SECTION_LEVELING, (-max_level, 1, len(leveling.groups)),
+                                      lambda settings, group=group:
+                                          WeaponFilterGenerator(settings).create_consolidated_block(
+                                              group, True, leveling_style),
+                                      leveling_style)
+            
+            unit.bases.append(item)
+            unit.add_hide(SECTION_HIDE, (1, index),
+                          lambda settings, item=item: WeaponFilterGenerator(settings).create_block(item, False))
+
+    return list(units.values())
+
+def process_weapon_blocks(items: List[BaseItem], settings: FilterSettings) -> Tuple[Dict[str, List[str]], List[str]]:
+    """Process weapon items and return show/hide blocks."""
+    build = FilterBuild(weapon_block_units(items))
+    build.render(settings)
+    show_blocks = {
+        "endgame_t1": build.blocks(SECTION_ENDGAME_T1),
+        "endgame_t2": build.blocks(SECTION_ENDGAME_T2),
+        "leveling": [(-order[0], block) for order, block in build.ordered_blocks(SECTION_LEVELING)],
+        "skill": [],
+        "quiver": []
+    }
+    return show_blocks, build.blocks(SECTION_HIDE)
 
-    # Create consolidated blocks for endgame weapons
-    for (tier, weapon_type), items in endgame_groups.items():
-        if items:
-            style = f"Endgame Tier {tier}"
-            block = generator.create_consolidated_block(items, True, style)
-            show_blocks[f"endgame_t{tier}"].append(block)
+ITEM_TYPES = {
+    cls.__name__: cls
+    for cls in (BaseItem, DefenseItem, WeaponItem, SkillWeaponItem, CrossbowItem, QuiverItem)
+}
 
-    # Create consolidated blocks for leveling weapons
-    for (weapon_type, max_level), items in leveling_groups.items():
-        if items:
-            block = generator.create_consolidated_block(items, True, "Leveling Martial Weapon")
-            show_blocks["leveling"].append((max_level, block))
+@lru_cache(maxsize=None)
+def item_fields(item_type: type) -> Tuple[str, ...]:
+    """Get the slots of an item type that are serialized, the derived ones are rebuilt."""
+    return tuple(name for cls in reversed(item_type.__mro__) for name in cls.__dict__.get("__slots__", ())
+                 if name not in BaseItem.DERIVED_SLOTS)
+
+def item_to_dict(item: BaseItem) -> Dict:
+    """Serialize an item for the base catalog cache (the file path is stored per file)."""
+    data = {name: getattr(item, name) for name in item_fields(type(item))}
+    data["type"] = type(item).__name__
+    return data
+
+def item_from_dict(data: Dict, filepath: str) -> BaseItem:
+    """Rebuild an item serialized by item_to_dict."""
+    item = ITEM_TYPES[data["type"]](data["name"], data["area_level"], filepath)
+    for name in item_fields(type(item)):
+        setattr(item, name, data[name])
+    return item
+
+class BaseCatalog:
+    """Persistent cache of parsed base files.
+
+    Every base file is stored with its mtime, size and content hash. A file is
+    only parsed again when its size or mtime changed and its hash no longer
+    matches, so a warm catalog never touches the text parsers.
+
+    preload() lists, stats and reads the base files on a bounded thread pool,
+    since opening files one by one dominates on network mounts and cold
+    caches. items_for() still parses in the order it is called in.
+
+    A read_only catalog never writes the cache, for processes that share
+    it with the one that saved it.
+    """
+    def __init__(self, base_dir: str, cache_path: Optional[str] = None, load_workers: int = LOAD_WORKERS,
+                 read_only: bool = False):
+        self.base_dir = base_dir
+        self.read_only = read_only
+        self.cache_path = cache_path or os.path.join(SCRIPT_DIR, CATALOG_CACHE)
+        self.load_workers = load_workers
+        self.files: Dict[str, Dict] = {}
+        self.preloaded: Dict[str, Tuple[os.stat_result, Optional[bytes]]] = {}
+        self.parsed_files = 0
+        self.cached_files = 0
+        self.parsed_bytes = 0
+        self.parse_seconds = 0.0
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Load the cached catalog, discarding it if unreadable or outdated."""
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable base catalog %s: %s", self.cache_path, e)
+            return
+        if data.get("version") != CATALOG_VERSION:
+            logger.debug("Base catalog version changed, rebuilding %s", self.cache_path)
+            return
+        self.files = data.get("files", {})
+
+    def _key(self, filepath: str) -> str:
+        return os.path.relpath(filepath, self.base_dir).replace('\\', '/')
+
+    def list_dir(self, directory: str) -> List[str]:
+        """Get the base files in a directory tree, in os.walk order."""
+        return [os.path.join(root, file) for root, _, files in os.walk(directory)
+                for file in files if file.endswith('.txt')]
+
+    def load_file(self, filepath: str) -> Tuple[os.stat_result, Optional[bytes]]:
+        """Stat a base file and read it unless the catalog entry still matches."""
+        stat = os.stat(filepath)
+        entry = self.files.get(self._key(filepath))
+        if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return stat, None
+        with open(filepath, 'rb') as f:
+            return stat, f.read()
+
+    def preload(self):
+        """List, stat and read the changed base files concurrently.
+
+        Each directory of bases/ is listed on the pool, then every file is
+        stat'ed and read on it. Results are kept in file order for items_for.
+        """
+        if not os.path.isdir(self.base_dir):
+            return
+        start = time.perf_counter()
+        directories = sorted(entry.path for entry in os.scandir(self.base_dir) if entry.is_dir())
+        with ThreadPoolExecutor(max_workers=self.load_workers) as pool:
+            paths = [path for listed in pool.map(self.list_dir, directories) for path in listed]
+            self.preloaded = dict(zip(paths, pool.map(self.load_file, paths)))
+        read = sum(len(data) for _, data in self.preloaded.values() if data is not None)
+        profiler.count("bytes read", read)
+        logger.debug("Preloaded %s base files (%s bytes read) with %s workers in %.1f ms", len(paths), read,
+                     self.load_workers, (time.perf_counter() - start) * 1000)
+
+    def items_for(self, filepath: str, parser) -> List[BaseItem]:
+        """Get the parsed items of a base file, parsing it only if it changed."""
+        key = self._key(filepath)
+        stat, content = self.preloaded.pop(filepath, (None, None))
+        if stat is None:
+            stat = os.stat(filepath)
+        entry = self.files.get(key)
+
+        if entry and entry["parser"] == parser.__name__:
+            if entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                self.cached_files += 1
+                return [item_from_dict(data, filepath) for data in entry["items"]]
+
+        if content is None:
+            with open(filepath, 'rb') as f:
+                content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+
+        if entry and entry["parser"] == parser.__name__ and entry["hash"] == digest:
+            # Touched but unchanged, only refresh the stat info
+            entry["mtime"] = stat.st_mtime_ns
+            entry["size"] = stat.st_size
+            self._dirty = True
+            self.cached_files += 1
+            return [item_from_dict(data, filepath) for data in entry["items"]]
+
+        logger.debug("Parsing changed base file: %s", filepath)
+        start = time.perf_counter()
+        items = parser(filepath, content)
+        self.parse_seconds += time.perf_counter() - start
+        self.parsed_bytes += len(content)
+        self.files[key] = {
+            "parser": parser.__name__,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": digest,
+            "items": [item_to_dict(item) for item in items]
+        }
+        self._dirty = True
+        self.parsed_files += 1
+        return items
+
+    def signature(self) -> str:
+        """Hash of the content of every cataloged base file."""
+        digest = hashlib.sha1()
+        for key in sorted(self.files):
+            digest.update(f"{key}:{self.files[key]['hash']};".encode('utf-8'))
+        return digest.hexdigest()
+
+    def save(self):
+        """Write the catalog back to disk if anything changed."""
+        for key in list(self.files):
+            if not os.path.exists(os.path.join(self.base_dir, key)):
+                del self.files[key]
+                self._dirty = True
+        if not self._dirty or self.read_only:
+            return
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": CATALOG_VERSION, "files": self.files}, f)
+        os.replace(temp_path, self.cache_path)
+        self._dirty = False
 
-    return show_blocks, hide_blocks
+def build_filter_units(catalog: BaseCatalog, settings: Optional[FilterSettings] = None,
+                       tiers: Optional[TierRule] = None) -> List[FilterBlockUnit]:
+    """Load all bases through the catalog and build their filter block units.
 
-def main():
-    settings = FilterSettings(os.path.join(os.path.dirname(__file__), 'filtersettings.txt'))
+    Endgame defense tiers come from the base files unless a tier rule is given.
+    """
+    base_dir = catalog.base_dir
+    with profiler.phase("base preload"):
+        catalog.preload()
     
     # Process defense items
-    defense_generator = FilterGenerator(BASE_DIR, FILTER_DIR, settings)
+    defense_generator = FilterGenerator(base_dir, FILTER_DIR, settings, catalog, tiers)
     defense_generator.process_defense_bases()
-    defense_generator.generate_consolidated_blocks()
+    logger.debug("Indexed defense tiers from %s files", defense_generator.tier_index.files_scanned)
+    for file_path in defense_generator.tier_index.rescanned_files():
+        logger.warning("Defense base file was scanned more than once: %s", file_path)
     
     # Process martial weapons (keep existing logic)
     weapon_items = []
-    for root, _, files in os.walk(os.path.join(BASE_DIR, 'martial weapons')):
+    for root, _, files in os.walk(os.path.join(base_dir, 'martial weapons')):
         for file in files:
             if file.endswith('.txt'):
                 filepath = os.path.join(root, file)
-                items = parse_item_file(filepath)
+                with profiler.phase("martial parse"):
+                    items = catalog.items_for(filepath, parse_item_file)
                 weapon_items.extend(items)
     
-    weapon_show_blocks, weapon_hide_blocks = process_weapon_blocks(weapon_items, settings)
-    
     # Process skill weapons
     skill_items = []
-    skill_weapon_dir = os.path.join(BASE_DIR, 'skill-based weapons')
+    skill_weapon_dir = os.path.join(base_dir, 'skill-based weapons')
     if os.path.exists(skill_weapon_dir):
         for file in os.listdir(skill_weapon_dir):
             if file.endswith('.txt'):
                 filepath = os.path.join(skill_weapon_dir, file)
-                skill_items.extend(parse_skill_weapon_file(filepath))
-    
-    skill_show_blocks, skill_hide_blocks = process_skill_weapon_blocks(skill_items, settings)
+                with profiler.phase("skill parse"):
+                    skill_items.extend(catalog.items_for(filepath, parse_skill_weapon_file))
     
     # Process quivers separately
     quiver_items = []
-    quiver_dir = os.path.join(BASE_DIR, 'quivers')
+    quiver_dir = os.path.join(base_dir, 'quivers')
     if os.path.exists(quiver_dir):
         for file in os.listdir(quiver_dir):
             if file.endswith('.txt'):
                 filepath = os.path.join(quiver_dir, file)
-                quiver_items.extend(parse_quiver_file(filepath))
-    
-    quiver_show_blocks, quiver_hide_blocks = process_quiver_blocks(quiver_items, settings)
+                with profiler.phase("quiver parse"):
+                    quiver_items.extend(catalog.items_for(filepath, parse_quiver_file))
     
-    # Add skill blocks to weapon blocks
-    weapon_show_blocks['skill'] = skill_show_blocks
-    weapon_hide_blocks.extend(skill_hide_blocks)
+    with profiler.phase("catalog save"):
+        catalog.save()
+    catalog.preloaded.clear()
+    if catalog.parsed_files:
+        print(f"Parsed {catalog.parsed_files} base files ({catalog.parsed_bytes:,} bytes) in "
+              f"{catalog.parse_seconds * 1000:.1f} ms "
+              f"({catalog.parsed_bytes / max(catalog.parse_seconds, 1e-9) / 1e6:.1f} MB/s)")
     
-    # Add quiver blocks to weapon blocks
-    weapon_show_blocks['quiver'] = quiver_show_blocks
-    weapon_hide_blocks.extend(quiver_hide_blocks)
-    
-    # Generate combined filter
+    with profiler.phase("unit registration"):
+        units = (list(defense_generator.units.values()) +
+                 weapon_block_units(weapon_items, defense_generator.leveling_groups) +
+                 skill_weapon_block_units(skill_items) +
+                 quiver_block_units(quiver_items))
+    defense_generator.leveling_groups.report()
+    return units
+
+def build_signature(catalog: BaseCatalog, tiers: Optional[TierRule] = None) -> str:
+    """Identify the block units a build state belongs to.
+
+    Covers the parsed base files, the tier rule and this script, so saved
+    builds are never reused after the bases or the block renderers changed.
+    """
+    with open(os.path.abspath(__file__), 'rb') as f:
+        script_hash = hashlib.sha1(f.read()).hexdigest()
+    signature = f"{catalog.signature()}-{script_hash}"
+    if tiers:
+        signature += f"-{tiers.mode}{tiers.threshold:g}"
+        if not tiers.overrides:
+            signature += "-computed-only"
+    return signature
+
+# Item classes of the bases in each directory, weapons take theirs from the file name
+ITEM_CLASSES = {
+    ItemCategory.BODY: "Body Armours",
+    ItemCategory.BOOTS: "Boots",
+    ItemCategory.GLOVES: "Gloves",
+    ItemCategory.HELMET: "Helmets",
+    ItemCategory.SHIELDS: "Shields",
+    ItemCategory.FOCI: "Foci",
+    ItemCategory.QUIVERS: "Quivers",
+}
+BASE_PARSERS = {
+    ItemCategory.MARTIAL_WEAPONS: parse_item_file,
+    ItemCategory.SKILL_WEAPONS: parse_skill_weapon_file,
+    ItemCategory.QUIVERS: parse_quiver_file,
+}
+# Differences printed by --verify before the rest are only counted
+MAX_REPORTED_DIFFERENCES = 20
+
+def game_item_class(item: BaseItem) -> str:
+    """Get the in-game item class of a base, e.g. Body Armours or One Hand Maces."""
+    if item.category in ITEM_CLASSES:
+        return ITEM_CLASSES[item.category]
+    return WEAPON_TYPE_NAMES.get(item.file_type, item.file_type).replace('_', ' ').title()
+
+class DropSpace(NamedTuple):
+    """The drops filters are compared on: every (base type, item class) of the catalog.
+
+    Each pair is checked at every rarity and area level, drop_levels gives
+    the DropLevel of every base.
+    """
+    bases: List[Tuple[str, str]]
+    drop_levels: Dict[str, int]
+
+def catalog_drop_space(catalog: BaseCatalog) -> DropSpace:
+    """Get the drop space of every base in the catalog, in base file order."""
+    bases = {}
+    drop_levels = {}
+    for root, dirs, files in os.walk(catalog.base_dir):
+        dirs.sort()
+        for file in sorted(files):
+            if not file.endswith('.txt'):
+                continue
+            filepath = os.path.join(root, file)
+            parser = BASE_PARSERS.get(base_file_traits(filepath)[0], parse_defense_file)
+            for item in catalog.items_for(filepath, parser):
+                bases[(item.name, game_item_class(item))] = None
+                drop_levels.setdefault(item.name, item.min_area_level)
+    catalog.save()
+    return DropSpace(list(bases), drop_levels)
+
+class AreaLevelEntry(NamedTuple):
+    """A base with the area levels it drops at and the settings key that shows it."""
+    name: str
+    item_class: str
+    min_level: int
+    max_level: int
+    setting_key: str
+
+class AreaLevelIndex:
+    """The bases of a build indexed by their [min_area_level, max_area_level] range.
+
+    Bases without an upper bound drop up to MAX_AREA_LEVEL. at_level holds
+    the bases dropping at every level and by_start all bases ordered by their
+    first level, so a range query is the bases dropping at its low end plus
+    the slice of by_start starting inside it: O(log n + k).
+    """
+    def __init__(self, units: List[FilterBlockUnit]):
+        self.entries: List[AreaLevelEntry] = []
+        self.registry = SettingsKeyRegistry(units)
+        self.key_ids: List[int] = []
+        for unit, key_id in zip(units, self.registry.unit_ids):
+            self.key_ids.extend([key_id] * len(unit.bases))
+            for item in unit.bases:
+                min_level = max(item.min_area_level, 1)
+                max_level = min(item.max_area_level or MAX_AREA_LEVEL, MAX_AREA_LEVEL)
+                self.entries.append(AreaLevelEntry(item.name, game_item_class(item), min_level, max_level,
+                                                   unit.setting_key))
+        self.by_start = sorted(range(len(self.entries)), key=lambda index: self.entries[index].min_level)
+        self.starts = [self.entries[index].min_level for index in self.by_start]
+        self.at_level: List[List[int]] = [[] for _ in range(MAX_AREA_LEVEL + 1)]
+        for index in self.by_start:
+            entry = self.entries[index]
+            for level in range(entry.min_level, entry.max_level + 1):
+                self.at_level[level].append(index)
+
+    def at(self, level: int) -> List[int]:
+        """Get the bases dropping at an area level."""
+        return self.at_level[level] if 0 < level <= MAX_AREA_LEVEL else []
+
+    def between(self, low: int, high: int) -> List[int]:
+        """Get the bases dropping at any area level from low to high."""
+        low, high = max(low, 1), min(high, MAX_AREA_LEVEL)
+        if low > high:
+            return []
+        return self.at_level[low] + self.by_start[bisect_right(self.starts, low):bisect_right(self.starts, high)]
+
+    def visibility(self, settings: FilterSettings) -> bytearray:
+        """Get whether the profile shows each base."""
+        decisions = self.registry.decisions(settings.show_settings)
+        return bytearray(decisions >> key_id & 1 for key_id in self.key_ids)
+
+    def visibility_table(self, settings: FilterSettings) -> List[Tuple[List[int], List[int]]]:
+        """Get the shown and hidden bases at every area level from 0 to MAX_AREA_LEVEL."""
+        shown = self.visibility(settings)
+        return [([index for index in indexes if shown[index]], [index for index in indexes if not shown[index]])
+                for indexes in self.at_level]
+
+def area_level_range(text: str) -> Tuple[int, int]:
+    """Parse an area level query, a level or a LOW-HIGH range."""
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+def audit_area_levels(settings_path: Optional[str] = None, shown_at: Optional[str] = None,
+                      table_path: Optional[str] = None, tiers: Optional[TierRule] = None,
+                      load_workers: int = LOAD_WORKERS):
+    """Print the bases a profile shows in an area level range, or write its visibility table as JSON."""
+    settings = FilterSettings(settings_path or os.path.join(SCRIPT_DIR, FILTER_SETTINGS))
+    index = AreaLevelIndex(build_filter_units(BaseCatalog(BASE_DIR, load_workers=load_workers), settings, tiers))
+    if shown_at:
+        low, high = area_level_range(shown_at)
+        shown = index.visibility(settings)
+        matches = sorted(index.between(low, high), key=lambda i: (index.entries[i].min_level, index.entries[i].name))
+        for i in matches:
+            entry = index.entries[i]
+            if shown[i]:
+                print(f"{entry.name} ({entry.item_class}, area level {entry.min_level}-{entry.max_level}, "
+                      f"{entry.setting_key})")
+        print(f"{sum(shown[i] for i in matches)} of {len(matches)} bases dropping at area level {shown_at} are shown")
+    if table_path:
+        table = {
+            level: {
+                "shown": [index.entries[i].name for i in shown],
+                "hidden": [index.entries[i].name for i in hidden]
+            }
+            for level, (shown, hidden) in enumerate(index.visibility_table(settings)) if level
+        }
+        with open(table_path, 'w', encoding='utf-8') as f:
+            json.dump(table, f, indent=1)
+        print(f"Wrote the visibility of {len(index.entries)} bases at area levels 1-{MAX_AREA_LEVEL} to {table_path}")
+
+def check_shadowed_blocks(filter_path: str, drop: bool = False):
+    """Report the blocks of a filter no item can reach, removing them if drop is set."""
+    with open(filter_path, 'r') as f:
+        lines = f.readlines()
+    rules = parse_filter_rules(lines)
+    shadowed = find_shadowed_rules(rules)
+    if not drop:
+        for index, shadowing in shadowed.items():
+            earlier = ", ".join(str(rules[i].line_number) for i in shadowing)
+            print(f"{describe_rule(rules[index])} is shadowed by line {earlier}")
+        print(f"Found {len(shadowed)} shadowed blocks of {len(rules)}")
+        return
+    kept = drop_rules(lines, rules, shadowed)
+    with open(filter_path, 'w') as f:
+        f.writelines(kept)
+    print(f"Dropped {len(shadowed)} shadowed blocks of {len(rules)} ({len(lines) - len(kept)} lines)")
+
+class MinifyOptions(NamedTuple):
+    """Budget of a --minify filter, None for no limit."""
+    max_blocks: Optional[int] = None
+    max_bytes: Optional[int] = None
+
+class FilterBudgetError(Exception):
+    """The minified filter is larger than its budget."""
+
+class FilterVerifyError(Exception):
+    """The written filter decides drops differently from the unoptimised one."""
+
+def section_rules(sections: List[Tuple[str, str, List[str]]]) -> List[FilterRule]:
+    """Parse (name, header, blocks) sections as the filter FilterWriter would write from them."""
+    return parse_filter_rules("".join(header + "".join(blocks) for _, header, blocks in sections).split("\n"))
+
+def verify_filter(filter_path: str, plain: List[FilterRule], merged: List[FilterRule], space: DropSpace):
+    """Check that a written filter decides every drop of the space like its unoptimised assembly.
+
+    Merging into the base filter may restyle drops it already shows (the
+    rare safeguard gives way to the base filter's unique highlight), so
+    the plain assembly is compared on visibility and the merged one, before
+    minifying and dropping shadowed blocks, on visibility and style.
+    """
+    rules = parse_filter_file(filter_path)
+    for name, reference, styles in (("unmerged", plain, False), ("unminified", merged, True)):
+        differences = compare_filters(reference, rules, space.bases, space.drop_levels, styles=styles)
+        for difference in differences[:MAX_REPORTED_DIFFERENCES]:
+            print(describe_difference(difference, reference, rules))
+        if differences:
+            raise FilterVerifyError(f"{len(differences)} drop ranges are decided differently than by the "
+                                    f"{name} filter")
+    print(f"Verified {len(space.bases):,} bases at every rarity and area level")
+
+class FilterWriter:
+    """Buffered binary writer for the assembled filter.
+
+    Text is encoded like a file opened in text mode and the bytes written are
+    counted per section. Files that already use the output line endings are
+    spliced in unchanged, with sendfile where the platform has it.
+
+    Every non-empty header, block and spliced file is a piece of the output.
+    Without a file nothing is written and each piece is recorded with its
+    size and hash instead, so the output can be compared with the previous
+    one before touching the disk. The first skip pieces are not written, for
+    patching a file whose start is unchanged.
+    """
+    def __init__(self, f=None, skip: int = 0):
+        self.f = f
+        self.skip = skip
+        self.encoding = locale.getpreferredencoding(False)
+        self.section_bytes: Dict[str, int] = {}
+        self.section_blocks: Dict[str, int] = {}
+        self.pieces: List[Tuple[str, int, str]] = []
+        self.piece_count = 0
+
+    def encode(self, text: str) -> bytes:
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        return text.encode(self.encoding)
+
+    def write(self, section: str, header: str, blocks: List[str]):
+        """Write the header and blocks of a section with a single writelines call."""
+        data = [part for part in map(self.encode, [header] + blocks) if part]
+        skipped = max(0, min(len(data), self.skip - self.piece_count))
+        self.piece_count += len(data)
+        data = data[skipped:]
+        if self.f is None:
+            self.pieces.extend((section, len(part), hashlib.sha1(part).hexdigest()) for part in data)
+        else:
+            self.f.writelines(data)
+            profiler.count("blocks emitted", len(blocks))
+            profiler.count("bytes written", sum(map(len, data)))
+        self.section_bytes[section] = self.section_bytes.get(section, 0) + sum(map(len, data))
+        self.section_blocks[section] = self.section_blocks.get(section, 0) + len(blocks)
+
+    @staticmethod
+    def line_ending(path: str) -> Optional[bytes]:
+        with open(path, 'rb') as source:
+            first_line = source.readline()
+        if first_line.endswith(b"\r\n"):
+            return b"\r\n"
+        if first_line.endswith(b"\n"):
+            return b"\n"
+        return None
+
+    def file_chunks(self, path: str):
+        """Read a file as it is spliced into the output."""
+        if self.line_ending(path) in (None, os.linesep.encode()):
+            with open(path, 'rb') as source:
+                yield from iter(lambda: source.read(COPY_CHUNK_SIZE), b"")
+        else:
+            # Different line endings, translate them like a text mode copy
+            with open(path, 'r') as text_source:
+                for chunk in iter(lambda: text_source.read(COPY_CHUNK_SIZE), ""):
+                    yield self.encode(chunk)
+
+    def splice(self, section: str, path: str):
+        """Stream a file into the output without loading it into memory."""
+        self.piece_count += 1
+        if self.piece_count <= self.skip:
+            return
+        if self.f is None:
+            digest = hashlib.sha1()
+            size = 0
+            for chunk in self.file_chunks(path):
+                digest.update(chunk)
+                size += len(chunk)
+            self.pieces.append((section, size, digest.hexdigest()))
+        elif self.line_ending(path) in (None, os.linesep.encode()):
+            with open(path, 'rb') as source:
+                size = self.copy(source)
+            profiler.count("bytes written", size)
+        else:
+            size = 0
+            for chunk in self.file_chunks(path):
+                self.f.write(chunk)
+                size += len(chunk)
+            profiler.count("bytes written", size)
+        self.section_bytes[section] = self.section_bytes.get(section, 0) + size
+
+    def digest(self) -> str:
+        """Hash of the recorded pieces, equal for outputs with the same content."""
+        return hashlib.sha1("".join(digest for _, _, digest in self.pieces).encode('ascii')).hexdigest()
+
+    def copy(self, source) -> int:
+        """Append a binary file to the output and return the bytes copied."""
+        self.f.flush()
+        if hasattr(os, "sendfile"):
+            offset = 0
+            remaining = os.fstat(source.fileno()).st_size
+            try:
+                while remaining > 0:
+                    sent = os.sendfile(self.f.fileno(), source.fileno(), offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+                return offset
+            except OSError as e:
+                if offset:
+                    raise
+                logger.debug("sendfile unavailable, copying instead: %s", e)
+        size = 0
+        for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+            self.f.write(chunk)
+            size += len(chunk)
+        return size
+
+    def report(self, name: str):
+        total = sum(self.section_bytes.values())
+        sections = ", ".join(f"{section} {size:,}" for section, size in self.section_bytes.items())
+        print(f"Wrote {total:,} bytes to {name} ({sections})")
+
+    def size_report(self):
+        """Print the sections from largest to smallest with their share of the output."""
+        total = sum(self.section_bytes.values()) or 1
+        for section, size in sorted(self.section_bytes.items(), key=lambda item: -item[1]):
+            print(f"  {section:<16} {size:>10,} bytes {size / total:6.1%} {self.section_blocks.get(section, 0):>7,} blocks")
+
+    def check_budget(self, options: MinifyOptions):
+        """Raise FilterBudgetError if the written sections exceed the budget."""
+        blocks = sum(self.section_blocks.values())
+        size = sum(self.section_bytes.values())
+        exceeded = []
+        if options.max_blocks is not None and blocks > options.max_blocks:
+            exceeded.append(f"{blocks:,} blocks, budget {options.max_blocks:,}")
+        if options.max_bytes is not None and size > options.max_bytes:
+            exceeded.append(f"{size:,} bytes, budget {options.max_bytes:,}")
+        if exceeded:
+            largest = max(self.section_bytes, key=self.section_bytes.get)
+            raise FilterBudgetError(f"Minified filter is over budget ({'; '.join(exceeded)}), "
+                                    f"largest section is {largest}")
+
+class FilterOutputIndex:
+    """The pieces of the filter last written to an output, see FilterWriter.
+
+    Stored next to the output as <output>.index.json, along with the options
+    that changed the file after it was written and the size and mtime it was
+    left with. An unchanged filter is recognised from its hash and a stat
+    call, a changed one is patched from its first changed piece.
+    """
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = output_path + FILTER_INDEX_SUFFIX
+        self.entry: Optional[Dict] = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entry = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable filter index %s: %s", self.path, e)
+
+    def intact(self, options: List) -> bool:
+        """Whether the output is still the file the index was saved for, written with the same options."""
+        if self.entry is None or self.entry["options"] != options:
+            return False
+        try:
+            stat = os.stat(self.output_path)
+        except OSError:
+            return False
+        return [stat.st_size, stat.st_mtime_ns] == self.entry["stat"]
+
+    def unchanged(self, plan: FilterWriter, options: List) -> bool:
+        return self.intact(options) and self.entry["digest"] == plan.digest()
+
+    def unchanged_pieces(self, plan: FilterWriter) -> int:
+        """Count the pieces at the start of the output that are the same in plan."""
+        count = 0
+        for old, new in zip(self.entry["pieces"], plan.pieces):
+            if tuple(old) != new:
+                break
+            count += 1
+        return count
+
+    def report_changes(self, plan: FilterWriter):
+        """Print how many blocks of each section changed, were added or were removed."""
+        if self.entry is None:
+            return
+        old = [(section, digest) for section, _, digest in self.entry["pieces"]]
+        new = [(section, digest) for section, _, digest in plan.pieces]
+        changes: Dict[str, List[int]] = {}
+        for tag, old_start, old_end, new_start, new_end in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+            if tag == "equal":
+                continue
+            replaced = min(old_end - old_start, new_end - new_start)
+            for position in range(new_start, new_end):
+                counts = changes.setdefault(new[position][0], [0, 0, 0])
+                counts[0 if position - new_start < replaced else 1] += 1
+            for position in range(old_start + replaced, old_end):
+                changes.setdefault(old[position][0], [0, 0, 0])[2] += 1
+        summary = "; ".join(
+            f"{section} " + ", ".join(f"{count} {kind}" for count, kind in zip(counts, ("changed", "added", "removed"))
+                                      if count)
+            for section, counts in changes.items())
+        print(f"Changed blocks: {summary or 'none'}")
+
+    def save(self, plan: FilterWriter, options: List):
+        stat = os.stat(self.output_path)
+        self.entry = {
+            "digest": plan.digest(),
+            "options": options,
+            "stat": [stat.st_size, stat.st_mtime_ns],
+            "pieces": plan.pieces
+        }
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entry, f)
+        os.replace(temp_path, self.path)
+
+def merge_override_blocks(show_sections: List[Tuple[str, str, List[str]]], base_filter: Optional[FilterDocument],
+                          hide_sections: List[Tuple[str, str, List[str]]]):
+    """Merge the rendered blocks into the base filter where every show/hide decision stays the same.
+
+    The sections are (name, header, blocks) written before and after the
+    base filter. Blocks the base filter already decides are dropped and
+    blocks matching a base block apart from their BaseType values are folded
+    into it, see merge_rules. Returns the remaining show and hide sections;
+    sections left empty by the merge are removed.
+    """
+    rules = []
+    owners = []
+
+    def add_sections(group: int, sections: List[Tuple[str, str, List[str]]]):
+        for section_index, (_, _, blocks) in enumerate(sections):
+            for block_index, block in enumerate(blocks):
+                block_rules = parse_filter_rules(block.split("\n"))
+                owner = (group, section_index, block_index) if len(block_rules) == 1 else None
+                owners.extend([owner] * len(block_rules))
+                rules.extend(block_rules)
+
+    add_sections(0, show_sections)
+    base_start = len(rules)
+    if base_filter is not None:
+        rules.extend(base_filter.rules)
+        owners.extend([None] * len(base_filter.rules))
+    base_end = len(rules)
+    add_sections(1, hide_sections)
+
+    mergeable = [index for index, owner in enumerate(owners) if owner is not None]
+    dropped, folded = merge_rules(rules, mergeable, range(base_start, base_end))
+    for target in sorted(set(folded.values())):
+        base_filter.write_condition(target - base_start, "BaseType")
+    removed = {owners[index] for index in dropped + list(folded)}
+    if removed:
+        print(f"Merged {len(removed)} of {len(mergeable)} blocks into the base filter "
+              f"({len(dropped)} already decided by it, {len(folded)} folded into its blocks)")
+
+    merged = []
+    for group, sections in enumerate((show_sections, hide_sections)):
+        kept = []
+        for section_index, (name, header, blocks) in enumerate(sections):
+            remaining = [block for block_index, block in enumerate(blocks)
+                         if (group, section_index, block_index) not in removed]
+            if remaining or not blocks:
+                kept.append((name, header, remaining))
+        merged.append(kept)
+    return merged[0], merged[1]
+
+def minify_sections(sections: List[Tuple[str, str, List[str]]]) -> List[Tuple[str, List[str]]]:
+    """Rewrite (name, header, blocks) sections as minified blocks, see minify_rules.
+
+    Comments are dropped, blocks in a header are kept. Blocks folded into a
+    block of another section leave their own section.
+    """
+    rules = []
+    names = []
+    for name, header, blocks in sections:
+        parsed = parse_filter_rules((header + "".join(blocks)).split("\n"))
+        rules.extend(parsed)
+        names.extend([name] * len(parsed))
+    folded = minify_rules(rules)
+    minified: Dict[str, List[str]] = {name: [] for name, _, _ in sections}
+    for index, rule in enumerate(rules):
+        if index not in folded:
+            minified[names[index]].append(format_rule(rule))
+    print(f"Minified {len(rules)} blocks into {len(rules) - len(folded)}")
+    return list(minified.items())
+
+def filter_sections(build: FilterBuild) -> Tuple[List[Tuple[str, str, List[str]]], List[Tuple[str, str, List[str]]]]:
+    """Get the (name, header, blocks) sections written before and after the base filter."""
+    show_sections = [
+        ("endgame T1", "### Endgame Tier 1 Show Blocks ###\n", build.blocks(SECTION_ENDGAME_T1)),
+        ("endgame T2", "\n### Endgame Tier 2 Show Blocks ###\n", build.blocks(SECTION_ENDGAME_T2)),
+        ("skill weapons", "\n### Skill Weapon Show Blocks ###\n", build.blocks(SECTION_SKILL)),
+        ("quivers", "\n### Quiver Show Blocks ###\n", build.blocks(SECTION_QUIVER)),
+        # Leveling blocks are sorted by level
+        ("leveling", "\n### Leveling Show Blocks ###\n", coalesce_leveling_blocks(build.blocks(SECTION_LEVELING))),
+        ("rare safeguard", "\n### Rare Item Safeguard ###\n", [RARE_SAFEGUARD_BLOCK]),
+    ]
+    hide_sections = []
+    if build.show_settings.get("HIDE_UNSHOWN_ITEMS", True):
+        ordered_hide_blocks = build.ordered_blocks(SECTION_HIDE)
+        hide_blocks = consolidate_hide_blocks([(order[0], block) for order, block in ordered_hide_blocks])
+        report_hide_consolidation([block for _, block in ordered_hide_blocks], hide_blocks)
+        hide_sections.append(("hide", "\n### Hide Blocks ###\n", hide_blocks))
+    return show_sections, hide_sections
+
+def render_filter(build: FilterBuild, base_filter: Optional[FilterDocument] = None,
+                  minify: Optional[MinifyOptions] = None) -> bytes:
+    """Assemble the rendered blocks and the base filter in memory.
+
+    Gives the bytes write_filter would write for the same build. Blocks
+    are merged into base_filter, so pass a document that is not reused.
+    """
+    show_sections, hide_sections = filter_sections(build)
+    show_sections, hide_sections = merge_override_blocks(show_sections, base_filter, hide_sections)
+    base_sections = [("base filter", base_filter.text(), [])] if base_filter is not None else []
+    output = io.BytesIO()
+    writer = FilterWriter(output)
+    if minify is not None:
+        for name, blocks in minify_sections(show_sections + base_sections + hide_sections):
+            writer.write(name, "", blocks)
+        writer.check_budget(minify)
+    else:
+        for name, header, blocks in show_sections + base_sections + hide_sections:
+            writer.write(name, header, blocks)
+    return output.getvalue()
+
+def load_base_lines(base_filter_path: Optional[str] = None) -> Optional[List[str]]:
+    """Read the lines of the base filter, None if there is none."""
+    base_filter_path = base_filter_path or os.path.join(SCRIPT_DIR, FILTER_BASE)
+    if not os.path.exists(base_filter_path):
+        return None
+    with open(base_filter_path, 'r') as f:
+        return f.readlines()
+
+def copy_prefix(source, f, size: int):
+    """Copy the first size bytes of a binary file to another."""
+    while size > 0:
+        chunk = source.read(min(size, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise EOFError(f"{source.name} is shorter than its filter index")
+        f.write(chunk)
+        size -= len(chunk)
+
+def write_filter(build: FilterBuild, shadowed: Optional[str] = None, output_path: Optional[str] = None,
+                 base_filter_path: Optional[str] = None, minify: Optional[MinifyOptions] = None,
+                 verify: Optional[DropSpace] = None, base_lines: Optional[List[str]] = None) -> bool:
+    """Assemble the rendered blocks and the base filter into filter.filter
+
+    Blocks are merged into the base filter where that keeps every decision.
+    shadowed is "report" or "drop" to check the assembled filter for blocks
+    that earlier blocks make unreachable. With minify the filter is written
+    without comments and blank lines, with matching blocks folded together,
+    and FilterBudgetError is raised before writing when it is over budget.
+    With verify the written filter is compared with its unoptimised
+    assembly, see verify_filter, and FilterVerifyError is raised instead of
+    replacing the output when a drop changed.
+
+    The output is hashed before it is written: an output that would not
+    change is left alone, and one whose start is unchanged is rebuilt from
+    a copy of that start and its blocks from the first changed one, see
+    FilterOutputIndex. Either way the output is replaced atomically. The
+    output and the base filter default to the files next to this script,
+    pass base_lines from load_base_lines to skip reading the base filter
+    again when writing several filters. Returns whether the output was
+    written.
+    """
     try:
-        temp_path = os.path.join(SCRIPT_DIR, FILTER_TEMP)
-        with open(temp_path, 'w') as f:
-            # Write endgame T1 blocks
-            f.write("### Endgame Tier 1 Show Blocks ###\n")
-            for block in defense_generator.show_blocks["endgame_t1"]:
-                if isinstance(block, tuple):
-                    _, block_text = block
-                    f.write(block_text)
-                else:
-                    f.write(block)
-            for block in weapon_show_blocks["endgame_t1"]:
-                f.write(block)
-                
-            # Write endgame T2 blocks
-            f.write("\n### Endgame Tier 2 Show Blocks ###\n")
-            for block in defense_generator.show_blocks["endgame_t2"]:
-                if isinstance(block, tuple):
-                    _, block_text = block
-                    f.write(block_text)
-                else:
-                    f.write(block)
-            for block in weapon_show_blocks["endgame_t2"]:
-                f.write(block)
-                
-            # Write skill weapon blocks
-            f.write("\n### Skill Weapon Show Blocks ###\n")
-            for block in weapon_show_blocks["skill"]:
-                f.write(block)
-                
-            # Write quiver blocks
-            f.write("\n### Quiver Show Blocks ###\n")
-            for block in weapon_show_blocks["quiver"]:
-                f.write(block)
-                
-            # Write leveling blocks
-            f.write("\n### Leveling Show Blocks ###\n")
-            # Sort defense leveling blocks by level
-            defense_leveling = []
-            for block in defense_generator.show_blocks["leveling"]:
-                if isinstance(block, tuple):
-                    level, block_text = block
-                    defense_leveling.append((level, block_text))
+        if output_path is None:
+            output_path = os.path.join(SCRIPT_DIR, FILTER_OUTPUT)
+            temp_path = os.path.join(SCRIPT_DIR, FILTER_TEMP)
+        else:
+            temp_path = output_path + ".tmp"
+        base_filter_path = base_filter_path or os.path.join(SCRIPT_DIR, FILTER_BASE)
+        if base_lines is None:
+            base_lines = load_base_lines(base_filter_path)
+        base_filter = FilterDocument(list(base_lines)) if base_lines is not None else None
+        show_sections, hide_sections = filter_sections(build)
+        base_sections = [("base filter", base_filter.text(), [])] if base_filter is not None else []
+        if verify is not None:
+            plain_rules = section_rules(show_sections + base_sections + hide_sections)
+        show_sections, hide_sections = merge_override_blocks(show_sections, base_filter, hide_sections)
+        base_sections = [("base filter", base_filter.text(), [])] if base_filter is not None else []
+        if verify is not None:
+            merged_rules = section_rules(show_sections + base_sections + hide_sections)
+
+        if minify is not None:
+            minified = minify_sections(show_sections + base_sections + hide_sections)
+
+        def emit(writer: FilterWriter):
+            if minify is not None:
+                for name, blocks in minified:
+                    writer.write(name, "", blocks)
+                return
+            for name, header, blocks in show_sections:
+                writer.write(name, header, blocks)
+
+            # Include base filter, spliced in unchanged unless blocks were merged into it
+            if base_filter is not None:
+                if base_filter.modified:
+                    writer.write("base filter", base_filter.text(), [])
                 else:
-                    defense_leveling.append((0, block))
-            
-            # Combine and sort all leveling blocks
-            all_leveling = defense_leveling + [(level, block) for level, block in weapon_show_blocks["leveling"]]
-            for _, block in sorted(all_leveling, key=lambda x: x[0], reverse=True):
-                f.write(block)
-                
-            # Write rare safeguard
-            f.write("\n### Rare Item Safeguard ###\n")
-            f.write("Show\nRarity >= Rare\n\n")
-            
-            # Include base filter
-            base_filter_path = os.path.join(SCRIPT_DIR, FILTER_BASE)
-            if os.path.exists(base_filter_path):
-                with open(base_filter_path, 'r') as bf:
-                    f.write(bf.read())
-                    
-            # Write hide blocks
-            write_hide_blocks = True
-            settings_path = os.path.join(SCRIPT_DIR, 'filtersettings.txt')
-            with open(settings_path, 'r') as settings_file:
-                for line in settings_file:
-                    if line.strip().startswith('HIDE_UNSHOWN_ITEMS'):
-                        write_hide_blocks = 'True' in line
-                        break
-            
-            if write_hide_blocks:
-                f.write("\n### Hide Blocks ###\n")
-                for block in defense_generator.hide_blocks:
-                    f.write(block)
-                for block in weapon_hide_blocks:
-                    f.write(block)
+                    writer.splice("base filter", base_filter_path)
+
+            for name, header, blocks in hide_sections:
+                writer.write(name, header, blocks)
+
+        # Hash the output first, most regenerations leave it unchanged
+        plan = FilterWriter()
+        emit(plan)
+        if minify is not None:
+            plan.size_report()
+            plan.check_budget(minify)
+        name = os.path.basename(output_path)
+        options = [shadowed, verify is not None]
+        index = FilterOutputIndex(output_path)
+        if index.unchanged(plan, options):
+            print(f"{name} is unchanged, not rewritten")
+            return False
+        index.report_changes(plan)
+
+        # Shadowed blocks are dropped and verified in the temp file, so only plain outputs are patched
+        skip = index.unchanged_pieces(plan) if index.intact(options) and not shadowed and verify is None else 0
+        if skip:
+            offset = sum(size for _, size, _ in plan.pieces[:skip])
+            with open(output_path, 'rb') as source, open(temp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                copy_prefix(source, f, offset)
+                emit(FilterWriter(f, skip))
+            os.replace(temp_path, output_path)
+            print(f"Patched {name} from byte {offset:,}, {len(plan.pieces) - skip} of {len(plan.pieces)} "
+                  f"pieces rewritten")
+            index.save(plan, options)
+            return True
+
+        with open(temp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            emit(FilterWriter(f))
+        plan.report(name)
+
+        if shadowed:
+            check_shadowed_blocks(temp_path, drop=shadowed == "drop")
+
+        if verify is not None:
+            try:
+                verify_filter(temp_path, plain_rules, merged_rules, verify)
+            except FilterVerifyError:
+                os.remove(temp_path)
+                raise
                 
         # Rename temp file to final output
-        output_path = os.path.join(SCRIPT_DIR, FILTER_OUTPUT)
         os.replace(temp_path, output_path)
+        index.save(plan, options)
+        return True
         
     except Exception as e:
-        logger.error(f"Error generating filter: {e}")
+        logger.error("Error generating filter: %s", e)
         raise
 
+def regenerate_filter(shadowed: Optional[str] = None, settings_path: Optional[str] = None,
+                      output_path: Optional[str] = None, tiers: Optional[TierRule] = None,
+                      minify: Optional[MinifyOptions] = None, verify: bool = False,
+                      load_workers: int = LOAD_WORKERS) -> FilterBuild:
+    """Regenerate filter.filter, reusing the previous build where possible.
+
+    With verify the written filter is checked against its unoptimised
+    assembly for every base of the catalog, see verify_filter.
+    """
+    settings_path = settings_path or os.path.join(SCRIPT_DIR, FILTER_SETTINGS)
+    with profiler.phase("settings parse"):
+        settings = FilterSettings(settings_path)
+    with profiler.phase("catalog load"):
+        catalog = BaseCatalog(BASE_DIR, load_workers=load_workers)
+    block_cache = BlockCache()
+    build = FilterBuild(build_filter_units(catalog, settings, tiers), block_cache)
+    build.registry.report(settings, os.path.basename(settings_path))
+    
+    # Reuse the previous build so only blocks affected by changed settings are rendered
+    state_path = os.path.join(SCRIPT_DIR, FILTER_STATE)
+    with profiler.phase("build state"):
+        signature = build_signature(catalog, tiers)
+        state_loaded = build.load_state(state_path, signature)
+    with profiler.phase("block rendering"):
+        build.render(settings)
+    
+    # Generate combined filter, an unchanged one leaves every file alone
+    with profiler.phase("file write"):
+        written = write_filter(build, shadowed, output_path, minify=minify,
+                               verify=catalog_drop_space(catalog) if verify else None)
+    if written or not state_loaded:
+        with profiler.phase("build state"):
+            build.save_state(state_path, signature)
+            block_cache.save()
+    return build
+
+class FilterWatcher:
+    """Regenerate filter.filter whenever its inputs are saved.
+
+    Polls filtersettings.txt, filterbase.filter and every file in bases/.
+    The catalog and the rendered blocks stay in memory, so a settings change
+    only re-renders the affected blocks before the filter is replaced.
+    """
+    def __init__(self, poll_interval: float = 0.01, debounce: float = 0.02, shadowed: Optional[str] = None,
+                 settings_path: Optional[str] = None, output_path: Optional[str] = None,
+                 tiers: Optional[TierRule] = None, minify: Optional[MinifyOptions] = None,
+                 verify: bool = False, load_workers: int = LOAD_WORKERS):
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.shadowed = shadowed
+        self.settings_path = settings_path or os.path.join(SCRIPT_DIR, FILTER_SETTINGS)
+        self.output_path = output_path
+        self.tiers = tiers
+        self.minify = minify
+        self.verify = verify
+        self.base_filter_path = os.path.join(SCRIPT_DIR, FILTER_BASE)
+        self.catalog = BaseCatalog(BASE_DIR, load_workers=load_workers)
+        self.block_cache = BlockCache()
+        self.settings = FilterSettings(self.settings_path)
+        self.build = FilterBuild(build_filter_units(self.catalog, self.settings, self.tiers), self.block_cache)
+        self.build.registry.report(self.settings, os.path.basename(self.settings_path))
+        self.build.render(self.settings)
+        self.write()
+        self.snapshot = self.take_snapshot()
+
+    def write(self):
+        write_filter(self.build, self.shadowed, self.output_path, minify=self.minify,
+                     verify=catalog_drop_space(self.catalog) if self.verify else None)
+        self.block_cache.save()
+
+    def take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """Get the mtime and size of every watched file."""
+        paths = [self.settings_path, self.base_filter_path]
+        for root, _, files in os.walk(BASE_DIR):
+            paths.extend(os.path.join(root, file) for file in files if file.endswith('.txt'))
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changed_files(self, snapshot: Dict[str, Tuple[int, int]]) -> List[str]:
+        return [path for path in set(self.snapshot) | set(snapshot)
+                if self.snapshot.get(path) != snapshot.get(path)]
+
+    def rebuild(self, changed: List[str]):
+        """Regenerate the filter for a set of changed files."""
+        bases_changed = any(path.startswith(BASE_DIR) for path in changed)
+        if bases_changed:
+            # Unchanged base files are served from the in-memory catalog
+            self.settings = FilterSettings(self.settings_path)
+            self.build = FilterBuild(build_filter_units(self.catalog, self.settings, self.tiers), self.block_cache)
+        elif self.settings_path in changed:
+            self.settings = FilterSettings(self.settings_path)
+        if bases_changed or self.settings_path in changed:
+            self.build.registry.report(self.settings, os.path.basename(self.settings_path))
+        self.build.render(self.settings)
+        self.write()
+
+    def run(self):
+        """Poll for changes until interrupted."""
+        print(f"Watching {SCRIPT_DIR} for changes (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(self.poll_interval)
+                snapshot = self.take_snapshot()
+                changed = self.changed_files(snapshot)
+                if not changed:
+                    continue
+                
+                # Debounce bursts of saves until the files are stable
+                while True:
+                    time.sleep(self.debounce)
+                    latest = self.take_snapshot()
+                    if latest == snapshot:
+                        break
+                    snapshot = latest
+                changed = self.changed_files(snapshot)
+                self.snapshot = snapshot
+                if not changed:
+                    continue
+                
+                saved_ns = max((snapshot[path][0] for path in changed if path in snapshot), default=time.time_ns())
+                try:
+                    self.rebuild(changed)
+                except Exception as e:
+                    logger.error("Error regenerating filter: %s", e)
+                    continue
+                latency_ms = (time.time_ns() - saved_ns) / 1e6
+                names = ", ".join(sorted(os.path.relpath(path, SCRIPT_DIR) for path in changed))
+                print(f"Rebuilt {os.path.basename(self.output_path or FILTER_OUTPUT)} in {latency_ms:.1f} ms after saving {names} "
+                      f"({self.build.units_rendered} of {len(self.build.units)} block units re-rendered, "
+                      f"{self.build.units_cached} from the block cache)")
+        except KeyboardInterrupt:
+            print("Stopped watching")
+
+# Per-process state of the batch workers, set up by init_batch_worker
+_batch_worker = {}
+
+def effective_settings_key(units: List[FilterBlockUnit], settings: FilterSettings,
+                           registry: Optional[SettingsKeyRegistry] = None) -> str:
+    """Identify the output of a settings profile.
+
+    Only the keys and styles used by a unit are included, so profiles that
+    differ in unused settings get the same key. Pass the registry of the
+    units when identifying several profiles.
+    """
+    registry = registry or SettingsKeyRegistry(units)
+    styles = sorted(set().union(*(unit.styles for unit in units)))
+    return json.dumps([
+        registry.decisions(settings.show_settings),
+        [settings.styles.get(style) for style in styles],
+        settings.show_settings.get("HIDE_UNSHOWN_ITEMS", True)
+    ], sort_keys=True)
+
+def init_batch_worker(shadowed: Optional[str], units: Optional[List[FilterBlockUnit]] = None,
+                      tiers: Optional[TierRule] = None, minify: Optional[MinifyOptions] = None,
+                      load_workers: int = LOAD_WORKERS, base_lines: Optional[List[str]] = None):
+    """Set up a batch worker; the units are loaded from the base catalog if not given.
+
+    Units hold their renderers as closures and cannot be sent to worker
+    processes, so each worker rebuilds them from the catalog the batch just
+    saved, without writing it and without repeating the batch's reports.
+    """
+    if units is None:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            units = build_filter_units(BaseCatalog(BASE_DIR, load_workers=load_workers, read_only=True), tiers=tiers)
+    _batch_worker["build"] = FilterBuild(units)
+    _batch_worker["shadowed"] = shadowed
+    _batch_worker["minify"] = minify
+    _batch_worker["base_lines"] = base_lines
+
+def generate_profile(settings_path: str, output_paths: List[str]) -> int:
+    """Render one settings profile and write it to all of its outputs."""
+    build = _batch_worker["build"]
+    build.render(FilterSettings(settings_path))
+    write_filter(build, _batch_worker["shadowed"], output_paths[0], minify=_batch_worker["minify"],
+                 base_lines=_batch_worker["base_lines"])
+    for output_path in output_paths[1:]:
+        shutil.copyfile(output_paths[0], output_path)
+    return build.units_rendered
+
+def generate_filters(settings_paths: List[str], output_paths: List[str], workers: Optional[int] = None,
+                     shadowed: Optional[str] = None, tiers: Optional[TierRule] = None,
+                     minify: Optional[MinifyOptions] = None, load_workers: int = LOAD_WORKERS):
+    """Generate a filter for each settings file.
+
+    The bases and the base filter are loaded once. Profiles with the same
+    effective settings are rendered once and copied, the others are spread
+    over a pool of worker processes that each re-render incrementally.
+    """
+    start = time.perf_counter()
+    catalog = BaseCatalog(BASE_DIR, load_workers=load_workers)
+    units = build_filter_units(catalog, tiers=tiers)
+    base_lines = load_base_lines()
+    
+    registry = SettingsKeyRegistry(units)
+    profiles: Dict[str, Tuple[str, List[str]]] = {}
+    for settings_path, output_path in zip(settings_paths, output_paths):
+        settings = FilterSettings(settings_path)
+        registry.report(settings, os.path.basename(settings_path))
+        key = effective_settings_key(units, settings, registry)
+        profiles.setdefault(key, (settings_path, []))[1].append(output_path)
+    jobs = list(profiles.values())
+    
+    if workers == 1 or len(jobs) == 1:
+        init_batch_worker(shadowed, units, minify=minify, base_lines=base_lines)
+        for settings_path, paths in jobs:
+            generate_profile(settings_path, paths)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                 initargs=(shadowed, None, tiers, minify, load_workers, base_lines)) as pool:
+            list(pool.map(generate_profile, *zip(*jobs)))
+    
+    elapsed = time.perf_counter() - start
+    print(f"Generated {len(output_paths)} filters from {len(jobs)} distinct profiles in {elapsed:.2f}s "
+          f"({len(output_paths) / elapsed:.1f} filters/s)")
+
+class FilterResponse(NamedTuple):
+    """A served filter with its plain and gzip encoded bodies."""
+    etag: str
+    body: bytes
+    gzip_body: bytes
+
+class FilterResponseCache:
+    """Least recently used FilterResponses by ETag, safe to share between threads."""
+    def __init__(self, max_entries: int = SERVE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, FilterResponse]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag: str) -> Optional[FilterResponse]:
+        with self.lock:
+            response = self.entries.get(etag)
+            if response is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(etag)
+            self.hits += 1
+            return response
+
+    def put(self, response: FilterResponse):
+        with self.lock:
+            self.entries[response.etag] = response
+            self.entries.move_to_end(response.etag)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class FilterService:
+    """Render filters for settings sent over HTTP, see --serve.
+
+    The base catalog, its block units and filterbase.filter are loaded once.
+    Responses are cached by the ETag of their effective settings, see
+    effective_settings_key, so profiles differing only in unused settings
+    share an entry. Filters are rendered one at a time into a single
+    FilterBuild, which only re-renders the units a profile changed and
+    takes blocks rendered for earlier profiles from the block cache.
+    """
+    def __init__(self, tiers: Optional[TierRule] = None, minify: Optional[MinifyOptions] = None,
+                 cache_size: int = SERVE_CACHE_SIZE, load_workers: int = LOAD_WORKERS):
+        self.minify = minify
+        catalog = BaseCatalog(BASE_DIR, load_workers=load_workers)
+        self.units = build_filter_units(catalog, tiers=tiers)
+        self.block_cache = BlockCache()
+        self.build = FilterBuild(self.units, self.block_cache)
+        self.render_lock = threading.Lock()
+        self.base_lines = load_base_lines()
+        self.cache = FilterResponseCache(cache_size)
+        # Outputs differ between loaded bases, base filters and minify budgets
+        self.signature = json.dumps([build_signature(catalog, tiers), self.base_lines, minify])
+
+    def etag(self, settings: FilterSettings) -> str:
+        key = self.signature + effective_settings_key(self.units, settings, self.build.registry)
+        return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '"'
+
+    def response(self, settings: FilterSettings, etag: Optional[str] = None) -> FilterResponse:
+        """Get the filter for the settings, rendering it on a cache miss."""
+        etag = etag or self.etag(settings)
+        response = self.cache.get(etag)
+        if response is not None:
+            return response
+        with self.render_lock:
+            # Another request may have rendered the same settings meanwhile
+            response = self.cache.get(etag)
+            if response is not None:
+                return response
+            self.build.render(settings)
+            base_filter = FilterDocument(list(self.base_lines)) if self.base_lines is not None else None
+            body = render_filter(self.build, base_filter, self.minify)
+            response = FilterResponse(etag, body, gzip.compress(body))
+            self.cache.put(response)
+        return response
+
+class FilterRequestHandler(BaseHTTPRequestHandler):
+    """POST settings text, get the filter back.
+
+    Answers 304 when If-None-Match already names the filter and gzips the
+    body for clients that accept it. Errors are answered with a JSON body,
+    400 for settings that cannot be parsed and 500 for failed renders.
+    """
+    service: FilterService
+    protocol_version = "HTTP/1.1"
+
+    def send_json_error(self, code: int, message: str):
+        body = json.dumps({"error": message}).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            self.send_json_error(411, "Content-Length required")
+            return
+        if int(length) > MAX_SETTINGS_BYTES:
+            self.send_json_error(413, f"Settings larger than {MAX_SETTINGS_BYTES:,} bytes")
+            return
+        try:
+            settings = FilterSettings.from_text(self.rfile.read(int(length)).decode('utf-8'))
+        except UnicodeDecodeError:
+            self.send_json_error(400, "Settings must be UTF-8 text")
+            return
+        except ValueError as e:
+            self.send_json_error(400, f"Unreadable settings: {e}")
+            return
+        try:
+            self.send_filter(settings)
+        except Exception as e:
+            logger.exception("Error serving filter: %s", e)
+            self.send_json_error(500, f"Error rendering filter: {e}")
+
+    def send_filter(self, settings: FilterSettings):
+        etag = self.service.etag(settings)
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        try:
+            response = self.service.response(settings, etag)
+        except FilterBudgetError as e:
+            self.send_json_error(422, str(e))
+            return
+
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = response.gzip_body if use_gzip else response.body
+        self.send_response(200)
+        self.send_header("Content-Type", f"text/plain; charset={locale.getpreferredencoding(False)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+def serve_filters(address: Tuple[str, int], tiers: Optional[TierRule] = None,
+                  minify: Optional[MinifyOptions] = None, cache_size: int = SERVE_CACHE_SIZE,
+                  load_workers: int = LOAD_WORKERS):
+    """Serve filters over HTTP until interrupted, one thread per request."""
+    service = FilterService(tiers, minify, cache_size, load_workers)
+    handler = type("BoundFilterRequestHandler", (FilterRequestHandler,), {"service": service})
+    with ThreadingHTTPServer(address, handler) as server:
+        host, port = server.server_address[:2]
+        print(f"Serving filters on http://{host}:{port}/, POST settings text to get a filter")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    service.block_cache.save()
+    print(f"Served {service.cache.hits + service.cache.misses} filters, {service.cache.hits} from the cache")
+
+def serve_address(text: str) -> Tuple[str, int]:
+    """Parse a --serve PORT or HOST:PORT address."""
+    host, _, port = text.rpartition(":")
+    return host or SERVE_HOST, int(port)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate filter.filter from filtersettings.txt")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and regenerate the filter whenever its inputs are saved")
+    parser.add_argument("--poll-interval", type=float, default=0.01,
+                        help="seconds between checks for changes in watch mode")
+    parser.add_argument("--debounce", type=float, default=0.02,
+                        help="seconds files must be unchanged before regenerating in watch mode")
+    parser.add_argument("--shadowed", choices=["report", "drop"],
+                        help="report or drop the blocks that earlier blocks make unreachable")
+    parser.add_argument("--settings", nargs="+", metavar="PATH",
+                        help=f"settings files to generate filters for (default: {FILTER_SETTINGS})")
+    parser.add_argument("--output", nargs="+", metavar="PATH",
+                        help=f"filter to write for each settings file (default: {FILTER_OUTPUT})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes when generating several filters (default: one per core)")
+    parser.add_argument("--load-workers", type=int, default=LOAD_WORKERS, metavar="N",
+                        help=f"threads reading base files (default: {LOAD_WORKERS})")
+    parser.add_argument("--tiers", choices=TIER_MODES, default="file",
+                        help="take endgame defense tiers from the base files, or compute them relative to the "
+                             "best base of each slot and defense type or by percentile")
+    parser.add_argument("--tier-threshold", type=float, default=5.0, metavar="PCT",
+                        help="T1 cutoff for computed tiers: percent below the best base (relative) "
+                             "or top percent of the bases (percentile)")
+    parser.add_argument("--no-tier-overrides", action="store_true",
+                        help="use the computed tiers for every base, hand-written Tier lines win by default")
+    parser.add_argument("--minify", action="store_true",
+                        help="write the filter without comments or blank lines, with matching blocks folded together")
+    parser.add_argument("--max-blocks", type=int, metavar="N",
+                        help="fail instead of writing a minified filter with more than N blocks")
+    parser.add_argument("--max-bytes", type=int, metavar="N",
+                        help="fail instead of writing a minified filter larger than N bytes")
+    parser.add_argument("--verify", action="store_true",
+                        help="check every base at every rarity and area level against the unoptimised filter "
+                             "and keep the previous filter if a drop changed")
+    parser.add_argument("--shown-at", metavar="LEVEL",
+                        help="list the bases the settings show that drop at an area level or LOW-HIGH range "
+                             "instead of generating the filter")
+    parser.add_argument("--area-level-table", metavar="PATH",
+                        help="write the shown and hidden bases at every area level as JSON "
+                             "instead of generating the filter")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help=f"serve filters over HTTP for settings POSTed to it (host defaults to {SERVE_HOST})")
+    parser.add_argument("--cache-size", type=int, default=SERVE_CACHE_SIZE, metavar="N",
+                        help=f"filters kept in memory when serving (default: {SERVE_CACHE_SIZE})")
+    parser.add_argument("--profile", action="store_true",
+                        help="report time, memory and counters for every phase of the build")
+    parser.add_argument("--profile-stacks", metavar="PATH",
+                        help="also write cProfile collapsed stacks for flamegraph tools (implies --profile)")
+    args = parser.parse_args(argv)
+    if args.settings and args.output is None and len(args.settings) > 1:
+        parser.error("--output is required when generating several filters")
+    if args.output and len(args.output) != len(args.settings or [None]):
+        parser.error("--output needs one path for each settings file")
+    if args.watch and args.settings and len(args.settings) > 1:
+        parser.error("--watch supports a single settings file")
+    if args.shown_at:
+        try:
+            area_level_range(args.shown_at)
+        except ValueError:
+            parser.error("--shown-at takes an area level or a LOW-HIGH range")
+    if (args.shown_at or args.area_level_table) and (args.watch or (args.settings and len(args.settings) > 1)):
+        parser.error("--shown-at and --area-level-table take a single settings file")
+    if args.load_workers < 1:
+        parser.error("--load-workers must be at least 1")
+    if args.serve:
+        try:
+            args.serve = serve_address(args.serve)
+        except ValueError:
+            parser.error("--serve takes a PORT or HOST:PORT")
+        if args.watch or args.settings or args.output or args.shown_at or args.area_level_table:
+            parser.error("--serve takes settings over HTTP and cannot be combined with other modes")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    args.profile = args.profile or bool(args.profile_stacks)
+    if args.no_tier_overrides and args.tiers == "file":
+        parser.error("--no-tier-overrides needs --tiers relative or percentile")
+    args.tiers = TierRule(args.tiers, args.tier_threshold, not args.no_tier_overrides) if args.tiers != "file" else None
+    if (args.max_blocks is not None or args.max_bytes is not None) and not args.minify:
+        parser.error("--max-blocks and --max-bytes need --minify")
+    args.minify = MinifyOptions(args.max_blocks, args.max_bytes) if args.minify else None
+    if args.verify and args.settings and len(args.settings) > 1:
+        parser.error("--verify only supports generating a single filter")
+    if args.profile and (args.watch or (args.settings and len(args.settings) > 1)):
+        parser.error("--profile only supports generating a single filter")
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    settings_path = args.settings[0] if args.settings else None
+    output_path = args.output[0] if args.output else None
+    try:
+        if args.serve:
+            serve_filters(args.serve, args.tiers, args.minify, args.cache_size, args.load_workers)
+        elif args.shown_at or args.area_level_table:
+            audit_area_levels(settings_path, args.shown_at, args.area_level_table, args.tiers, args.load_workers)
+        elif args.watch:
+            FilterWatcher(args.poll_interval, args.debounce, args.shadowed, settings_path, output_path,
+                          args.tiers, args.minify, args.verify, args.load_workers).run()
+        elif args.settings and len(args.settings) > 1:
+            generate_filters(args.settings, args.output, args.workers, args.shadowed, args.tiers, args.minify,
+                             args.load_workers)
+        elif args.profile:
+            profiler.start(globals(), stacks=bool(args.profile_stacks))
+            try:
+                regenerate_filter(args.shadowed, settings_path, output_path, args.tiers, args.minify, args.verify,
+                                  args.load_workers)
+            finally:
+                profiler.stop()
+            profiler.report()
+            if args.profile_stacks:
+                count = profiler.write_collapsed_stacks(args.profile_stacks)
+                print(f"Wrote {count} collapsed stacks to {args.profile_stacks}")
+        else:
+            regenerate_filter(args.shadowed, settings_path, output_path, args.tiers, args.minify, args.verify,
+                              args.load_workers)
+    except (FilterBudgetError, FilterVerifyError):
+        # Already logged by write_filter
+        return 1
+    return 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,200 @@
+from typing import Dict, List, Optional, Tuple
+import builtins
+import cProfile
+import pstats
+import re
+import time
+import tracemalloc
+
+class PhaseStats:
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_memory = 0
+        self.calls = 0
+
+class Phase:
+    """Context manager adding its wall time, CPU time and memory peak to a phase."""
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        stats = self.profiler.phases.setdefault(self.name, PhaseStats())
+        stats.wall += time.perf_counter() - self.wall
+        stats.cpu += time.process_time() - self.cpu
+        stats.calls += 1
+        if tracemalloc.is_tracing():
+            stats.peak_memory = max(stats.peak_memory, tracemalloc.get_traced_memory()[1] - self.memory)
+        return False
+
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+# Marks globals instrument() added, stop() removes them again
+MISSING = object()
+
+class CountingPattern:
+    """Compiled regex wrapper that counts its evaluations."""
+    def __init__(self, pattern, counters: Dict[str, int]):
+        self.pattern = pattern
+        self.counters = counters
+
+    def __getattr__(self, name):
+        return getattr(self.pattern, name)
+
+    def _count(self):
+        self.counters["regex evaluations"] = self.counters.get("regex evaluations", 0) + 1
+
+    def match(self, *args):
+        self._count()
+        return self.pattern.match(*args)
+
+    def search(self, *args):
+        self._count()
+        return self.pattern.search(*args)
+
+    def findall(self, *args):
+        self._count()
+        return self.pattern.findall(*args)
+
+class CountingRegexModule(CountingPattern):
+    """Stand-in for the re module that counts evaluations of uncompiled patterns."""
+    def match(self, pattern, *args):
+        self._count()
+        return re.match(pattern, *args)
+
+    def search(self, pattern, *args):
+        self._count()
+        return re.search(pattern, *args)
+
+    def findall(self, pattern, *args):
+        self._count()
+        return re.findall(pattern, *args)
+
+class Profiler:
+    """Phase timings and hot path counters for --profile.
+
+    Disabled by default, in which case phase() returns a shared no-op
+    context and count() returns immediately, so instrumented code pays
+    almost nothing for it.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, PhaseStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.profile: Optional[cProfile.Profile] = None
+        self.instrumented: List[Tuple[Dict, Dict]] = []
+
+    def start(self, module_globals: Optional[Dict] = None, stacks: bool = False):
+        """Start profiling, counting the file opens and regex evaluations of a module."""
+        self.enabled = True
+        tracemalloc.start()
+        if module_globals is not None:
+            self.instrument(module_globals)
+        if stacks:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        """Stop profiling and put back the globals of instrumented modules."""
+        if self.profile is not None:
+            self.profile.disable()
+        tracemalloc.stop()
+        self.enabled = False
+        for module_globals, originals in reversed(self.instrumented):
+            for name, value in originals.items():
+                if value is MISSING:
+                    module_globals.pop(name, None)
+                else:
+                    module_globals[name] = value
+        self.instrumented = []
+
+    def instrument(self, module_globals: Dict):
+        """Swap a module's open(), re and compiled *_PATTERN globals for counting versions until stop()."""
+        counters = self.counters
+
+        def counting_open(*args, **kwargs):
+            counters["files opened"] = counters.get("files opened", 0) + 1
+            return builtins.open(*args, **kwargs)
+
+        replacements = {"open": counting_open, "re": CountingRegexModule(re, counters)}
+        for name, value in module_globals.items():
+            if name.endswith("_PATTERN") and isinstance(value, re.Pattern):
+                replacements[name] = CountingPattern(value, counters)
+        self.instrumented.append((module_globals, {name: module_globals.get(name, MISSING) for name in replacements}))
+        module_globals.update(replacements)
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        print(f"{'Phase':<20} {'Calls':>6} {'Wall ms':>10} {'CPU ms':>10} {'Peak KiB':>10}")
+        for name, stats in self.phases.items():
+            print(f"{name:<20} {stats.calls:>6} {stats.wall * 1000:>10.1f} {stats.cpu * 1000:>10.1f} "
+                  f"{stats.peak_memory / 1024:>10.1f}")
+        print("Counters: " + ", ".join(f"{name} {value:,}" for name, value in sorted(self.counters.items())))
+
+    def write_collapsed_stacks(self, path: str) -> int:
+        """Write the cProfile data as collapsed stacks for flamegraph tools.
+
+        cProfile only records caller/callee pairs, so stacks are rebuilt by
+        walking down from the root functions and splitting the time of every
+        function between its callers by their share of its cumulative time.
+        """
+        stats = pstats.Stats(self.profile).stats
+        callees: Dict[Tuple, List[Tuple]] = {}
+        for function, (_, _, _, cumulative, callers) in stats.items():
+            for caller in callers:
+                callees.setdefault(caller, []).append(function)
+        roots = [function for function, entry in stats.items() if not entry[4]]
+
+        def label(function: Tuple) -> str:
+            filename, line, name = function
+            return f"{name} ({filename.replace(';', ':')}:{line})" if line else name
+
+        lines = []
+
+        def walk(function: Tuple, stack: List[str], share: float):
+            _, _, own, cumulative, _ = stats[function]
+            if cumulative * share < 1e-6:
+                return  # too small to show, stops the walk from visiting every call path
+            stack = stack + [label(function)]
+            microseconds = int(own * share * 1e6)
+            if microseconds:
+                lines.append(f"{';'.join(stack)} {microseconds}")
+            for callee in callees.get(function, []):
+                if label(callee) in stack:
+                    continue  # recursion
+                callee_cumulative = stats[callee][3]
+                edge_cumulative = stats[callee][4][function][3]
+                if callee_cumulative:
+                    walk(callee, stack, share * edge_cumulative / callee_cumulative)
+
+        for root in roots:
+            walk(root, [], 1.0)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        return len(lines)
+
+profiler = Profiler()
@@ -0,0 +1,17 @@
+from filterrules import FilterDocument
+
+def test_write_condition_keeps_the_trailing_comment():
+    document = FilterDocument([
+        "Show # $type->currency\n",
+        '    BaseType == "Exalted Orb"  # top currency\n',
+        "    SetFontSize 45\n",
+    ])
+    document.rules[0].condition("BaseType").values.append("Divine Orb")
+    document.write_condition(0, "BaseType")
+    assert document.lines[1] == '    BaseType == "Exalted Orb" "Divine Orb"  # top currency\n'
+
+def test_write_condition_without_a_comment():
+    document = FilterDocument(["Show\n", '    BaseType "Exalted Orb"\n'])
+    document.rules[0].condition("BaseType").values.append("Divine Orb")
+    document.write_condition(0, "BaseType")
+    assert document.lines[1] == '    BaseType "Exalted Orb" "Divine Orb"\n'
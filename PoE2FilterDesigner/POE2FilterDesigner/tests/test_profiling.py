@@ -0,0 +1,16 @@
+import builtins
+import re
+
+import poe2filter
+from profiling import CountingPattern, Profiler
+
+def test_stop_restores_instrumented_globals():
+    module_globals = vars(poe2filter)
+    patterns = {name: value for name, value in module_globals.items() if name.endswith("_PATTERN")}
+    profiler = Profiler()
+    profiler.start(module_globals)
+    assert isinstance(poe2filter.re, CountingPattern)
+    profiler.stop()
+    assert module_globals.get("open", builtins.open) is builtins.open
+    assert poe2filter.re is re
+    assert all(getattr(poe2filter, name) is value for name, value in patterns.items())
@@ -0,0 +1,47 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from poe2filter import FilterRequestHandler, FilterService
+
+@pytest.fixture(scope="module")
+def service():
+    return FilterService()
+
+@pytest.fixture
+def server(service):
+    handler = type("TestFilterRequestHandler", (FilterRequestHandler,), {"service": service})
+    with ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+
+def post(server, body: bytes):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    connection.request("POST", "/", body)
+    response = connection.getresponse()
+    return response.status, response.getheader("Content-Type"), response.read()
+
+def test_malformed_settings_get_a_400(server):
+    status, content_type, body = post(server, b"SHOW_LEVELING_BOW = \xff\xfe True\n")
+    assert status == 400
+    assert content_type == "application/json"
+    assert "UTF-8" in json.loads(body)["error"]
+
+def test_render_errors_get_a_500(server, service, monkeypatch):
+    def fail(settings, etag=None):
+        raise KeyError("Endgame Tier 1")
+    monkeypatch.setattr(service, "response", fail)
+    status, content_type, body = post(server, b"SHOW_LEVELING_BOW = True\n")
+    assert status == 500
+    assert content_type == "application/json"
+    assert "Endgame Tier 1" in json.loads(body)["error"]
+
+def test_settings_get_a_filter(server):
+    status, _, body = post(server, b"SHOW_LEVELING_BOW = True\n")
+    assert status == 200
+    assert b"Show" in body
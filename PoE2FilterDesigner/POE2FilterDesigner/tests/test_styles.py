@@ -0,0 +1,14 @@
+from poe2filter import FilterSettings, format_style_lines
+
+def test_partial_minimap_style_defaults_to_a_white_circle():
+    assert format_style_lines({"MinimapIconSize": "Medium", "SetFontSize": "40"}) == [
+        "MinimapIcon 1 White Circle", "SetFontSize 40"]
+    assert format_style_lines({"MinimapIconSize": "Huge", "MinimapIconShape": "Star"}) == [
+        "MinimapIcon 0 White Star"]
+
+def test_minimap_colour_and_shape_need_a_size():
+    assert format_style_lines({"MinimapIconColour": "Red", "MinimapIconShape": "Star"}) == []
+
+def test_style_fragment_keeps_minimap_defaults():
+    settings = FilterSettings.from_text('"Leveling Armour" {\n    MinimapIconSize: Small\n}\n')
+    assert settings.style_fragments["Leveling Armour"] == "MinimapIcon 2 White Circle"
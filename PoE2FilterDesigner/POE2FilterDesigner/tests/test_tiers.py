@@ -0,0 +1,34 @@
+import os
+
+from poe2filter import (
+    BASE_DIR, DEFENSE_SLOTS, BaseCatalog, DefenseItem, DefenseStatTable, TierRule, parse_defense_file,
+    settings_defense_type
+)
+
+def shipped_table(tmp_path) -> DefenseStatTable:
+    catalog = BaseCatalog(BASE_DIR, str(tmp_path / "bases.cache.json"))
+    table = DefenseStatTable()
+    for slot in DEFENSE_SLOTS:
+        slot_dir = os.path.join(BASE_DIR, slot)
+        for filename in sorted(os.listdir(slot_dir)):
+            items = catalog.items_for(os.path.join(slot_dir, filename), parse_defense_file)
+            table.add_group(slot, settings_defense_type(os.path.splitext(filename)[0]), items)
+    return table
+
+def test_percentile_keeps_a_t1_in_every_group(tmp_path):
+    table = shipped_table(tmp_path)
+    rule = TierRule("percentile", overrides=False)
+    for slot, defense_type in table.columns:
+        if not any(table.columns[(slot, defense_type)]["endgame"]):
+            continue
+        assert 1 in table.group_tiers(slot, defense_type, rule), (slot, defense_type)
+
+def test_percentile_ties_share_a_tier():
+    table = DefenseStatTable()
+    items = []
+    for name, armour in (("A", 100), ("B", 100), ("C", 50), ("D", 40)):
+        item = DefenseItem(name, "65+")
+        item.armour = armour
+        items.append(item)
+    table.add_group("body", "ARMOUR", items)
+    assert list(table.group_tiers("body", "ARMOUR", TierRule("percentile", 25.0, False))) == [1, 1, 2, 2]